@@ -0,0 +1,125 @@
+"""
+Admission control under overload: a FIFO, unbounded queue vs the fair, bounded one.
+
+One heavy client uploads --burst documents at once (retrying rejected ones
+after the Retry-After the server asks for, plus jitter) while --clients light
+clients each upload one document every --interval seconds for --duration
+seconds. The fake Gemini backend takes --latency seconds per call and
+--workers jobs run at a time, so the backend can finish workers/latency
+jobs per second. Runs twice: first with the old behaviour (every upload is
+queued, jobs run oldest first), then with admission control (the queue is
+bounded per session and overall, and jobs are taken fairly across sessions).
+Reports throughput, rejections and the light clients' latency.
+
+    python benchmarks/admission.py --burst 200 --clients 8 --workers 4
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))] if values else float("nan")
+
+
+async def upload(main, request, multipart, cookies, name, results, retry=False):
+    """Upload one document and wait for its result. With retry, try again after each Retry-After."""
+    body, form_type = multipart({"instructions": f"Summarize {name}"},
+                                [("document", f"{name}.txt", f"{name} {random.random()}".encode(), "text/plain")])
+    start = time.perf_counter()
+    while True:
+        response = await request(main.app, "POST", "/upload", body, {"content-type": form_type}, cookies)
+        if response.status != 429:
+            break
+        results["rejected"] += 1
+        if not retry:
+            return
+        # Jitter, so the rejected uploads don't all come back at the same moment
+        await asyncio.sleep(float(response.headers["retry-after"]) * random.uniform(1, 2))
+    job_id = re.search(r"/download/([0-9a-f-]+)", response.text).group(1)
+    stream = await request(main.app, "GET", f"/stream/{job_id}", cookies=cookies)
+    if "event: done" not in stream.text:
+        results["failed"] += 1
+        return
+    results["seconds"].append(time.perf_counter() - start)
+
+
+async def scenario(name, main, args):
+    from benchmarks.asgi_client import request, multipart
+
+    heavy = {"seconds": [], "rejected": 0, "failed": 0}
+    light = {"seconds": [], "rejected": 0, "failed": 0}
+    heavy_cookies = {}
+    await request(main.app, "GET", "/", cookies=heavy_cookies)
+
+    async def light_client(index):
+        cookies = {}
+        await request(main.app, "GET", "/", cookies=cookies)
+        tasks = []
+        end = time.perf_counter() + args.duration
+        while time.perf_counter() < end:
+            tasks.append(asyncio.create_task(upload(main, request, multipart, cookies, f"light{index}", light)))
+            await asyncio.sleep(args.interval)
+        await asyncio.gather(*tasks)
+
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(upload(main, request, multipart, heavy_cookies, "heavy", heavy, retry=True) for _ in range(args.burst)),
+        *(light_client(i) for i in range(args.clients)),
+    )
+    seconds = time.perf_counter() - start
+    done = len(heavy["seconds"]) + len(light["seconds"])
+    print(f"{name}: {done} jobs in {seconds:.1f}s ({done / seconds:.2f}/s, backend limit "
+          f"{args.workers / args.latency:.2f}/s)")
+    for client, results in (("heavy client", heavy), ("light clients", light)):
+        values = results["seconds"]
+        print(f"  {client:<14} done {len(values):>4}  rejected {results['rejected']:>4}  "
+              f"p50 {statistics.median(values) if values else float('nan'):6.2f}s  "
+              f"p99 {percentile(values, 0.99):6.2f}s  max {max(values, default=float('nan')):6.2f}s")
+
+
+async def run(args):
+    import main
+    import models.jobs as jobs_module
+    from benchmarks.fake_gemini import FakeModel
+
+    main.processor.model = FakeModel(latency=args.latency)
+    main.workers.start()
+    fair_queue, queue_size, session_queue_size = (jobs_module.FAIR_QUEUE, jobs_module.JOB_QUEUE_SIZE,
+                                                  jobs_module.JOB_SESSION_QUEUE_SIZE)
+    try:
+        # Before: every upload is queued and jobs run in arrival order
+        jobs_module.FAIR_QUEUE = "SELECT jobs.*, 0 AS turn FROM jobs WHERE jobs.status = 'queued'"
+        jobs_module.JOB_QUEUE_SIZE = jobs_module.JOB_SESSION_QUEUE_SIZE = 10 ** 9
+        await scenario("FIFO, unbounded", main, args)
+
+        jobs_module.FAIR_QUEUE, jobs_module.JOB_QUEUE_SIZE, jobs_module.JOB_SESSION_QUEUE_SIZE = (
+            fair_queue, queue_size, session_queue_size)
+        await scenario(f"fair, bounded (queue {queue_size}, per session {session_queue_size})", main, args)
+    finally:
+        await main.workers.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--burst", type=int, default=200, help="uploads from the heavy client, all at once")
+    parser.add_argument("--clients", type=int, default=8, help="light clients")
+    parser.add_argument("--interval", type=float, default=2.0, help="seconds between a light client's uploads")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds the light clients keep uploading")
+    parser.add_argument("--workers", type=int, default=4, help="jobs run at a time (JOB_WORKERS)")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini seconds per call")
+    args = parser.parse_args()
+    # Set before the app is imported, it reads them at startup
+    os.environ["JOB_WORKERS"] = str(args.workers)
+    os.environ.setdefault("EXTRACT_WORKERS", "0")
+    os.environ.setdefault("RESULT_CACHE_TTL", "0")
+    asyncio.run(run(args))
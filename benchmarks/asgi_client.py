@@ -0,0 +1,97 @@
+"""
+Tiny in-process ASGI client used by the benchmarks.
+Requests go straight into the app on the current event loop, so anything that
+blocks the loop shows up directly in the measured latencies.
+"""
+import uuid
+import asyncio
+
+
+class Response:
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, content, content_type) files as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, filename, content, content_type in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+async def request(app, method, path, body=b"", headers=None, cookies=None):
+    """
+    Send a single HTTP request to an ASGI app and collect the full response.
+    Pass the same cookies dict to successive requests to act as one browser session.
+    """
+    path, _, query = path.partition("?")
+    raw_headers = [(b"host", b"testserver")]
+    for key, value in (headers or {}).items():
+        raw_headers.append((key.lower().encode(), value.encode()))
+    if cookies:
+        raw_headers.append((b"cookie", "; ".join(f"{k}={v}" for k, v in cookies.items()).encode()))
+    if body:
+        raw_headers.append((b"content-length", str(len(body)).encode()))
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": raw_headers,
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+
+    sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Like a real client, only disconnect once the response is complete
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    status, resp_headers, chunks = None, {}, []
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            for key, value in message.get("headers", []):
+                key, value = key.decode().lower(), value.decode()
+                resp_headers[key] = value
+                if key == "set-cookie" and cookies is not None:
+                    name, _, rest = value.partition("=")
+                    cookies[name] = rest.split(";", 1)[0]
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    return Response(status, resp_headers, b"".join(chunks))
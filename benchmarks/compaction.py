@@ -0,0 +1,81 @@
+"""
+Prompt compaction: tokens saved and time taken.
+
+Compacts each file given on the command line (or generated samples of a
+DOCX export with running headers and footers and a noisy Markdown export)
+and reports the estimated tokens before and after, the share saved and the
+compaction speed. Token counts are estimated at 4 characters per token.
+
+    python benchmarks/compaction.py README.md notes.md --budget 20000
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.compaction import compact_text
+from benchmarks.docx_extract import write_docx
+from models.docx_stream import iter_docx_text
+
+
+def docx_export(pages, seed=0):
+    """Text of a generated .docx with a header, footer and disclaimer repeated on every page."""
+    rng = random.Random(seed)
+    path = f"compaction_sample_{os.getpid()}.docx"
+    write_docx(path, pages * 10, seed=seed)
+    try:
+        paragraphs = list(iter_docx_text(path))
+    finally:
+        os.remove(path)
+    lines = []
+    for page in range(pages):
+        lines += ["ACME Corporation - Internal", f"Quarterly report, page {page + 1}", ""]
+        lines += paragraphs[page * 10:(page + 1) * 10]
+        lines += ["", "", "Confidential. Do not distribute without written permission from ACME Corporation.  ",
+                  "This document may contain forward-looking statements. " * rng.randint(3, 4), "", ""]
+    return "\n".join(lines)
+
+
+def markdown_export(sections, seed=0):
+    """A Markdown export with rules, padded tables, bold runs and an inline base64 image."""
+    rng = random.Random(seed)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf"]
+    parts = ["# Exported notes #", "", "![logo](data:image/png;base64," + "iVBORw0KGgo" * 400 + ")", ""]
+    for i in range(sections):
+        text = " ".join(rng.choice(words) for _ in range(80))
+        parts += [f"## Section {i} ##", "", f"**Summary:**   {text}    ", "", "---", "",
+                  "| Name       | Value      |", "|:-----------|-----------:|",
+                  f"| {rng.choice(words):<10} | {rng.randint(0, 999):>10} |", "", "", "",
+                  "<!-- exported by tool v1.2 -->", "Back to top", ""]
+    return "\n".join(parts)
+
+
+def report(name, text, markdown, budget):
+    start = time.perf_counter()
+    compacted, before, after = compact_text(text, markdown=markdown, budget=budget)
+    seconds = time.perf_counter() - start
+    saved = 1 - after / max(before, 1)
+    speed = len(text) / (1024 * 1024) / max(seconds, 1e-9)
+    print(f"{name:<32} {before:>9} -> {after:>9} tokens  saved {saved:6.1%}  {speed:7.1f} MB/s")
+
+
+def main(args):
+    print(f"token budget: {args.budget or 'none'}")
+    if args.files:
+        for path in args.files:
+            with open(path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            report(os.path.basename(path), text, path.endswith((".md", ".markdown")), args.budget)
+        return
+    report("docx export (200 pages)", docx_export(200), False, args.budget)
+    report("markdown export (300 sections)", markdown_export(300), True, args.budget)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="*", help="text or markdown files (default: generated samples)")
+    parser.add_argument("--budget", type=int, default=0, help="token budget, 0 = none")
+    main(parser.parse_args())
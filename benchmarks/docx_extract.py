@@ -0,0 +1,138 @@
+"""
+DOCX extraction: streaming parser vs python-docx.
+
+Generates .docx files of the given sizes (paragraphs, tables, a header, a
+footer and footnotes) and extracts each one with both engines. Every run
+happens in a fresh subprocess so peak RSS is measured per run.
+
+    python benchmarks/docx_extract.py --sizes 1 5 10
+"""
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+import zipfile
+import importlib.util
+from xml.sax.saxutils import escape
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+REL = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+CT = "application/vnd.openxmlformats-officedocument.wordprocessingml"
+
+CONTENT_TYPES = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/word/document.xml" ContentType="{CT}.document.main+xml"/>
+<Override PartName="/word/header1.xml" ContentType="{CT}.header+xml"/>
+<Override PartName="/word/footer1.xml" ContentType="{CT}.footer+xml"/>
+<Override PartName="/word/footnotes.xml" ContentType="{CT}.footnotes+xml"/>
+</Types>"""
+
+PACKAGE_RELS = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="{REL}/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+DOCUMENT_RELS = f"""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="{REL}/header" Target="header1.xml"/>
+<Relationship Id="rId2" Type="{REL}/footer" Target="footer1.xml"/>
+<Relationship Id="rId3" Type="{REL}/footnotes" Target="footnotes.xml"/>
+</Relationships>"""
+
+
+def paragraph(text):
+    return f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+
+def sentence(rng):
+    return " ".join("".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9)))
+                    for _ in range(rng.randint(8, 30)))
+
+
+def write_docx(path, paragraphs, seed=0):
+    """Write a .docx with the given number of body paragraphs, and a small table every 20 paragraphs."""
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", PACKAGE_RELS)
+        archive.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS)
+        archive.writestr("word/header1.xml", f'<w:hdr xmlns:w="{W_NS}">{paragraph("Benchmark header")}</w:hdr>')
+        archive.writestr("word/footer1.xml", f'<w:ftr xmlns:w="{W_NS}">{paragraph("Benchmark footer")}</w:ftr>')
+        archive.writestr("word/footnotes.xml", f'<w:footnotes xmlns:w="{W_NS}"><w:footnote w:id="1">'
+                                               f'{paragraph("A footnote")}</w:footnote></w:footnotes>')
+        with archive.open("word/document.xml", "w") as f:
+            f.write(f'<w:document xmlns:w="{W_NS}" xmlns:r="{R_NS}"><w:body>'.encode())
+            for i in range(paragraphs):
+                f.write(paragraph(sentence(rng)).encode())
+                if i % 20 == 19:
+                    cells = "".join(f"<w:tc>{paragraph(sentence(rng)[:40])}</w:tc>" for _ in range(3))
+                    f.write(f"<w:tbl>{f'<w:tr>{cells}</w:tr>' * 3}</w:tbl>".encode())
+            f.write(b'<w:sectPr><w:headerReference w:type="default" r:id="rId1"/>'
+                    b'<w:footerReference w:type="default" r:id="rId2"/></w:sectPr></w:body></w:document>')
+
+
+def make_docx(path, megabytes):
+    """Write a .docx of roughly the given compressed size."""
+    sample = 2000
+    write_docx(path, sample)
+    per_paragraph = os.path.getsize(path) / sample
+    write_docx(path, int(megabytes * 1024 * 1024 / per_paragraph))
+
+
+def extract(engine, path):
+    """Run one extraction in this process and print seconds, peak RSS and characters as JSON."""
+    if engine == "stream":
+        # Load the module on its own so the measurement doesn't include the rest of the app
+        spec = importlib.util.spec_from_file_location("docx_stream", os.path.join(ROOT, "models", "docx_stream.py"))
+        docx_stream = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(docx_stream)
+        run = lambda: "\n".join(docx_stream.iter_docx_text(path))
+    else:
+        import docx
+        run = lambda: "\n".join(para.text for para in docx.Document(path).paragraphs)
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    text = run()
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": seconds, "peak_kb": peak, "delta_kb": peak - baseline, "chars": len(text)}))
+
+
+def measure(engine, path):
+    output = subprocess.run([sys.executable, __file__, "--run", engine, path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(args):
+    print(f"{'size':>6} {'engine':>12} {'time':>8} {'peak RSS':>10} {'RSS growth':>11} {'chars':>11}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for megabytes in args.sizes:
+            path = os.path.join(tmp, f"{megabytes}mb.docx")
+            make_docx(path, megabytes)
+            actual = os.path.getsize(path) / (1024 * 1024)
+            for engine in ("python-docx", "stream"):
+                result = measure(engine, path)
+                print(f"{actual:5.1f}M {engine:>12} {result['seconds']:7.2f}s "
+                      f"{result['peak_kb'] / 1024:8.1f}MB {result['delta_kb'] / 1024:9.1f}MB {result['chars']:>11,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 5, 10], help="document sizes in MB")
+    parser.add_argument("--run", nargs=2, metavar=("ENGINE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        extract(*args.run)
+    else:
+        main(args)
@@ -0,0 +1,65 @@
+"""
+Extraction throughput: threads vs the process pool.
+
+Extracts --docs generated .docx files concurrently, first in threads (the
+old asyncio.to_thread path, limited by the GIL) and then with WorkerPool
+at 1, 2, 4, ... workers up to the number of cores.
+
+    python benchmarks/extract_pool.py --docs 32 --size 1
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.document import Document
+from models.pool import WorkerPool
+from benchmarks.docx_extract import make_docx
+
+
+async def extract_all(paths, pool):
+    documents = [Document(path, os.path.basename(path), "application/octet-stream") for path in paths]
+    start = time.perf_counter()
+    if pool is None:
+        await asyncio.gather(*(asyncio.to_thread(document.extract_text) for document in documents))
+    else:
+        await asyncio.gather(*(pool.extract(document) for document in documents))
+    return time.perf_counter() - start
+
+
+async def run(args):
+    cores = os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template.docx")
+        make_docx(template, args.size)
+        paths = []
+        for i in range(args.docs):
+            path = os.path.join(tmp, f"{i}.docx")
+            os.link(template, path)
+            paths.append(path)
+
+        print(f"{args.docs} documents of {os.path.getsize(template) / (1024 * 1024):.1f}MB, {cores} cores")
+        seconds = await extract_all(paths, None)
+        print(f"{'threads':>12}: {seconds:6.2f}s {args.docs / seconds:6.1f} docs/s")
+
+        workers = 1
+        while workers <= cores:
+            pool = WorkerPool(workers=workers, timeout=600)
+            pool.start()
+            # Wait for the workers to start and warm up before timing
+            await asyncio.gather(*(pool.run(os.getpid) for _ in range(workers)))
+            seconds = await extract_all(paths, pool)
+            pool.shutdown()
+            print(f"{f'{workers} workers':>12}: {seconds:6.2f}s {args.docs / seconds:6.1f} docs/s")
+            workers *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=32, help="number of documents")
+    parser.add_argument("--size", type=float, default=1, help="document size in MB")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""
+Extraction cache: a cold extraction vs a cache hit.
+
+Generates a DOCX, a PDF with scanned pages, a JSON and a text file of
+about --size MB each and extracts each one cold (empty extraction cache)
+and again from the cache, in-process and through WorkerPool. A hit with
+the content hash known is what an upload gets (the hash is computed while
+it is saved); "hit, hashing" is a file that has to be hashed first, like
+a batch item. Reports the median of --repeat runs.
+
+    python benchmarks/extraction_cache.py --size 5 --repeat 5
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.document import Document
+from models.extractors import DOCX_TYPE, extraction_cache, file_hash
+from models.pool import WorkerPool
+
+
+def make_files(directory, megabytes):
+    """Write the sample files, return (name, path, MIME type) for each."""
+    from benchmarks.docx_extract import make_docx
+    from benchmarks.pdf_extract import write_pdf
+    from benchmarks.text_ingest import make_text
+    from benchmarks.json_tokens import sample_payloads
+
+    files = []
+    path = os.path.join(directory, "report.docx")
+    make_docx(path, megabytes)
+    files.append(("docx", path, DOCX_TYPE))
+
+    path = os.path.join(directory, "report.pdf")
+    # About 12KB per text page
+    write_pdf(path, max(10, int(megabytes * 1024 / 12)), scan_every=10)
+    files.append(("pdf", path, "application/pdf"))
+
+    records = sample_payloads(directory)[0]
+    path = os.path.join(directory, "records.json")
+    with open(records, encoding="utf-8") as f:
+        record = f.read()
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[" + ",".join([record] * max(1, int(megabytes * 1024 * 1024 / len(record)))) + "]")
+    files.append(("json", path, "application/json"))
+
+    path = os.path.join(directory, "server.log")
+    make_text(path, megabytes)
+    files.append(("text", path, "text/plain"))
+    return files
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def measure(path, file_type, repeat):
+    content_hash = file_hash(path)
+    extract = lambda hashed=True: Document(path, os.path.basename(path), file_type,
+                                           content_hash=content_hash if hashed else None).extract_text()
+    cold, hit, hit_hashing = [], [], []
+    for _ in range(repeat):
+        extraction_cache.clear()
+        cold.append(timed(extract))
+        hit.append(timed(extract))
+        hit_hashing.append(timed(lambda: extract(hashed=False)))
+    return [statistics.median(times) for times in (cold, hit, hit_hashing)]
+
+
+async def measure_pool(path, file_type, repeat):
+    pool = WorkerPool(workers=1, timeout=600)
+    pool.start()
+    # Wait for the worker to start and warm up before timing
+    await pool.run(os.getpid)
+    content_hash = file_hash(path)
+    cold, hit = [], []
+    for _ in range(repeat):
+        extraction_cache.clear()
+        for times in (cold, hit):
+            document = Document(path, os.path.basename(path), file_type, content_hash=content_hash)
+            start = time.perf_counter()
+            await pool.extract(document)
+            times.append(time.perf_counter() - start)
+    pool.shutdown()
+    return [statistics.median(times) for times in (cold, hit)]
+
+
+def ms(seconds):
+    return f"{seconds * 1000:9.2f}ms"
+
+
+def main(args):
+    print(f"{'file':>16} {'cold':>11} {'hit':>11} {'hit, hashing':>12} {'pool cold':>11} {'pool hit':>11} {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, path, file_type in make_files(tmp, args.size):
+            cold, hit, hit_hashing = measure(path, file_type, args.repeat)
+            pool_cold, pool_hit = asyncio.run(measure_pool(path, file_type, args.repeat))
+            label = f"{name} {os.path.getsize(path) / (1024 * 1024):.1f}MB"
+            print(f"{label:>16} {ms(cold)} {ms(hit)} {ms(hit_hashing):>12} {ms(pool_cold)} {ms(pool_hit)} "
+                  f"{cold / hit:7.0f}x")
+    stats = extraction_cache.stats()
+    print(f"cache: {stats['hits']} hits, {stats['misses']} misses, {stats['bytes'] / (1024 * 1024):.1f}MB "
+          f"of {stats['max_bytes'] / (1024 * 1024):.0f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=5, help="approximate size of each generated file in MB")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    main(parser.parse_args())
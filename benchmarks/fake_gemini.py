@@ -0,0 +1,192 @@
+"""
+Local stand-in for genai.GenerativeModel used by the benchmarks.
+
+It answers every call after a configurable latency, streams its answer in
+chunks (the first one after --ttft seconds), fails a configurable share
+of calls with a transient 503 error, makes a share of calls slow (or hang)
+and counts tokens at 4 characters per token (also reported as
+usage_metadata on responses and the last streamed chunk). FakeContextCaches
+stands in for Gemini's context caches. Install them with
+
+    main.processor.model = FakeModel(latency=1.0, error_rate=0.01)
+    main.processor.context_caches = FakeContextCaches(main.processor.model)
+"""
+import itertools
+import time
+import random
+import asyncio
+
+
+class FakeServerError(Exception):
+    """Like google.api_core.exceptions.ServiceUnavailable, the HTTP status is in `code`."""
+    code = 503
+
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count, cached_content_token_count=0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class FakeChunk(FakeResponse):
+    def __init__(self, text, usage_metadata=None):
+        super().__init__(text, usage_metadata)
+        self.parts = [text] if text else []
+
+
+class FakeTokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+class FakeStream:
+    """Async iterator over response chunks, the first after ttft and the rest spread over the remaining latency."""
+    def __init__(self, chunks, ttft, delay, fail_after=None, usage_metadata=None):
+        self.chunks = chunks
+        self.ttft = ttft
+        self.delay = delay
+        self.fail_after = fail_after
+        self.usage_metadata = usage_metadata
+
+    async def __aiter__(self):
+        last = len(self.chunks) - 1
+        for index, chunk in enumerate(self.chunks):
+            await asyncio.sleep(self.ttft if index == 0 else self.delay)
+            if index == self.fail_after:
+                raise FakeServerError("Fake Gemini error")
+            yield FakeChunk(chunk, self.usage_metadata if index == last else None)
+
+
+class FakeModel:
+    """
+    Stands in for genai.GenerativeModel.
+    latency is the total time per call, ttft the time to the first streamed
+    chunk (defaults to a third of latency), chunks the number of streamed
+    chunks and error_rate the share of calls that fail. slow_rate is the
+    share of calls that take slow_latency seconds instead (an hour by
+    default, i.e. a hung connection). prefill adds that many seconds per
+    1000 prompt tokens that aren't served from a context cache.
+    prompt_tokens and cached_tokens add up the billed prompt tokens.
+    """
+    def __init__(self, latency=1.0, ttft=None, chunks=8, error_rate=0.0, response_chars=2000, seed=None,
+                 slow_rate=0.0, slow_latency=3600, prefill=0.0):
+        self.latency = latency
+        self.ttft = latency / 3 if ttft is None else ttft
+        self.chunks = max(chunks, 1)
+        self.error_rate = error_rate
+        self.response_chars = response_chars
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.prefill = prefill
+        self._random = random.Random(seed)
+        self.calls = 0
+        self.errors = 0
+        self.slow = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _prompt_chars(self, contents):
+        return sum(len(part) if isinstance(part, str) else len(part.get("data", b""))
+                   for part in (contents if isinstance(contents, list) else [contents]))
+
+    def _response(self, contents):
+        line = f"- The prompt had {self._prompt_chars(contents)} characters.\n"
+        body = line * max(1, self.response_chars // len(line))
+        return "# Result\n\n" + body
+
+    def _usage(self, contents, text, cached_chars=0):
+        prompt_tokens = self._prompt_chars(contents) // 4
+        cached_tokens = cached_chars // 4
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        return FakeUsage(prompt_tokens + cached_tokens, len(text) // 4, cached_tokens)
+
+    def _should_fail(self):
+        self.calls += 1
+        if self._random.random() < self.error_rate:
+            self.errors += 1
+            return True
+        return False
+
+    def _latency(self, contents=()):
+        """
+        Total time for this call: usually latency, slow_latency for a slow_rate
+        share of calls, plus the prefill time for the prompt.
+        """
+        prefill = self.prefill * self._prompt_chars(contents) / 4000
+        if self._random.random() < self.slow_rate:
+            self.slow += 1
+            return self.slow_latency + prefill
+        return self.latency + prefill
+
+    def generate_content(self, contents, **kwargs):
+        latency = self._latency(contents)
+        time.sleep(latency)
+        if self._should_fail():
+            raise FakeServerError("Fake Gemini error")
+        text = self._response(contents)
+        return FakeResponse(text, self._usage(contents, text))
+
+    async def generate_content_async(self, contents, stream=False, cached_chars=0, **kwargs):
+        latency = self._latency(contents)
+        fail = self._should_fail()
+        text = self._response(contents)
+        if stream:
+            size = -(-len(text) // self.chunks)
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            # A slow call is slow to start, like a request stuck in a queue
+            ttft = self.ttft + latency - self.latency
+            delay = max(self.latency - self.ttft, 0) / max(len(chunks) - 1, 1)
+            # A failing stream errors out before its first chunk, like a 503 from the API
+            return FakeStream(chunks, ttft, delay, fail_after=0 if fail else None,
+                              usage_metadata=self._usage(contents, text, cached_chars))
+
+        await asyncio.sleep(latency)
+        if fail:
+            raise FakeServerError("Fake Gemini error")
+        return FakeResponse(text, self._usage(contents, text, cached_chars))
+
+    def count_tokens(self, contents):
+        text = contents if isinstance(contents, str) else str(contents)
+        return FakeTokenCount(len(text) // 4)
+
+    async def count_tokens_async(self, contents):
+        return self.count_tokens(contents)
+
+
+class FakeCachedModel:
+    """A FakeModel answering with cached contents in front of the prompt, which cost no prefill time."""
+    def __init__(self, model, cached_chars):
+        self.model = model
+        self.cached_chars = cached_chars
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        return await self.model.generate_content_async(contents, stream=stream, cached_chars=self.cached_chars, **kwargs)
+
+
+class FakeContextCaches:
+    """Stands in for models.gemini_client.ContextCaches, keeping the cached contents' size in memory."""
+    def __init__(self, model):
+        self.backend = model
+        self.caches = {}  # name -> cached characters
+        self.created = 0
+        self._names = itertools.count()
+
+    def create(self, contents, ttl):
+        name = f"cachedContents/fake-{next(self._names)}"
+        self.caches[name] = len(contents)
+        self.created += 1
+        return name
+
+    def model(self, name):
+        return FakeCachedModel(self.backend, self.caches[name])
+
+    def delete(self, name):
+        self.caches.pop(name, None)
@@ -0,0 +1,109 @@
+"""
+Follow-up questions: a kept document against uploading it again.
+
+Asks --questions different questions about one text document of --size KB,
+first by uploading the document with every question (the old way) and then
+by uploading it once with "keep for follow-up questions" and asking the rest
+through /ask. The fake Gemini backend spends --prefill seconds per 1000
+prompt tokens that don't come from a context cache. Reports the time per
+question and the prompt tokens billed at the full and the cached rate.
+
+    python benchmarks/followup.py --size 200 --questions 5
+"""
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import main
+from benchmarks.asgi_client import request, multipart
+from benchmarks.fake_gemini import FakeModel, FakeContextCaches
+
+
+def make_document(size_kb):
+    rng = random.Random(0)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot"]
+    lines = (" ".join(rng.choice(words) for _ in range(12)) for _ in range(size_kb * 14))
+    return "\n".join(lines).encode()
+
+
+async def wait_for_result(job_id, cookies):
+    stream = await request(main.app, "GET", f"/stream/{job_id}", cookies=cookies)
+    if "event: done" not in stream.text:
+        raise RuntimeError(f"Job {job_id} failed: {stream.text[-200:]}")
+
+
+async def ask(path, fields, files, cookies):
+    """Post a question and wait for its answer. Returns the seconds it took."""
+    body, form_type = multipart(fields, files)
+    start = time.perf_counter()
+    response = await request(main.app, "POST", path, body, {"content-type": form_type}, cookies)
+    match = re.search(r"/download/([0-9a-f-]+)", response.text)
+    if match is None:
+        raise RuntimeError(f"{path} did not queue a job: {response.text[:200]}")
+    await wait_for_result(match.group(1), cookies)
+    return time.perf_counter() - start
+
+
+async def scenario(name, model, run):
+    prompt_tokens, cached_tokens = model.prompt_tokens, model.cached_tokens
+    seconds = await run()
+    print(f"{name:<20} first {seconds[0]:6.2f}s  follow-ups {statistics.mean(seconds[1:]):6.2f}s each  "
+          f"prompt tokens {model.prompt_tokens - prompt_tokens:>8}  cached {model.cached_tokens - cached_tokens:>8}")
+
+
+async def run(args):
+    model = FakeModel(latency=args.latency, prefill=args.prefill)
+    main.processor.model = model
+    main.processor.context_caches = FakeContextCaches(model)
+    main.pool.start()
+    main.workers.start()
+    await main.pool.run(os.getpid)
+
+    content = make_document(args.size)
+    questions = [f"Question {i}: what does the document say about item {i}?" for i in range(args.questions)]
+    document = ("notes.txt", content, "text/plain")
+    print(f"{len(content) // 1024}KB document (~{len(content) // 4} tokens), {args.questions} questions")
+
+    async def upload_every_time():
+        cookies = {}
+        return [await ask("/upload", {"instructions": question}, [("document", *document)], cookies)
+                for question in questions]
+
+    async def keep_document():
+        cookies = {}
+        body, form_type = multipart({"instructions": questions[0], "keep": "1"}, [("document", *document)])
+        start = time.perf_counter()
+        response = await request(main.app, "POST", "/upload", body, {"content-type": form_type}, cookies)
+        job_id = re.search(r"/download/([0-9a-f-]+)", response.text).group(1)
+        document_id = re.search(r"/ask/([0-9a-f-]+)", response.text).group(1)
+        await wait_for_result(job_id, cookies)
+        seconds = [time.perf_counter() - start]
+        for question in questions[1:]:
+            seconds.append(await ask(f"/ask/{document_id}", {"instructions": question}, [], cookies))
+        return seconds
+
+    try:
+        await scenario("upload every time", model, upload_every_time)
+        # Different questions so none of them are answered from the result cache
+        questions = [f"Another {question}" for question in questions]
+        await scenario("kept document", model, keep_document)
+    finally:
+        await main.workers.stop()
+        main.pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=200, help="document size in KB")
+    parser.add_argument("--questions", type=int, default=5, help="questions about the document")
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini seconds per call")
+    parser.add_argument("--prefill", type=float, default=0.05, help="fake Gemini seconds per 1000 uncached prompt tokens")
+    asyncio.run(run(parser.parse_args()))
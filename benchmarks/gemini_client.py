@@ -0,0 +1,119 @@
+"""
+GeminiClient against the fake Gemini backend.
+
+Runs --calls concurrent calls per scenario and compares the bare model with
+the client (retries, deadlines, hedging, circuit breaker, rate limits):
+
+- errors:   a share of calls fail with a transient 503
+- hangs:    a share of calls never answer
+- tail:     a share of calls are slow, with and without hedging
+- outage:   every call fails, with and without the circuit breaker
+- rate:     calls are held to --rpm requests per minute
+
+    python benchmarks/gemini_client.py --calls 200 --latency 0.2
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.gemini_client import GeminiClient, CircuitBreaker, TokenBucket
+from benchmarks.fake_gemini import FakeModel
+
+PROMPT = "Summarize this document. " * 40
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+
+async def timed(call, limit):
+    """Run call() and return (seconds, ok), giving up after `limit` seconds."""
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(call(), limit)
+        ok = True
+    except Exception:
+        ok = False
+    return time.perf_counter() - start, ok
+
+
+async def measure(name, model, call, calls, limit):
+    start = time.perf_counter()
+    results = await asyncio.gather(*(timed(call, limit) for _ in range(calls)))
+    wall = time.perf_counter() - start
+    latencies = [seconds for seconds, _ in results]
+    ok = sum(1 for _, ok in results if ok)
+    print(f"  {name:<24} ok {ok:>4}/{calls:<4} p50 {percentile(latencies, 50):6.2f}s  "
+          f"p99 {percentile(latencies, 99):6.2f}s  wall {wall:6.2f}s  backend calls {model.calls}")
+
+
+def client(model, **kwargs):
+    settings = dict(rpm=0, tpm=0, timeout=60, retries=3, backoff=0.05, hedge_after=0,
+                    breaker=CircuitBreaker(threshold=0))
+    settings.update(kwargs)
+    return GeminiClient(lambda: model, **settings)
+
+
+async def run(args):
+    calls, latency, seed = args.calls, args.latency, args.seed
+    # Calls that are still running after this are counted as failed (stalled)
+    limit = latency * 20
+
+    print(f"errors: {args.error_rate:.0%} of calls fail with a 503")
+    model = FakeModel(latency=latency, error_rate=args.error_rate, seed=seed)
+    await measure("bare model", model, lambda: model.generate_content_async(PROMPT), calls, limit)
+    model = FakeModel(latency=latency, error_rate=args.error_rate, seed=seed)
+    gemini = client(model)
+    await measure("client (3 retries)", model, lambda: gemini.generate(PROMPT), calls, limit)
+
+    print(f"hangs: {args.slow_rate:.0%} of calls never answer (stalled after {limit:g}s)")
+    model = FakeModel(latency=latency, slow_rate=args.slow_rate, seed=seed)
+    await measure("bare model", model, lambda: model.generate_content_async(PROMPT), calls, limit)
+    model = FakeModel(latency=latency, slow_rate=args.slow_rate, seed=seed)
+    gemini = client(model, timeout=latency * 5)
+    await measure(f"client ({latency * 5:g}s deadline)", model, lambda: gemini.generate(PROMPT), calls, limit)
+
+    print(f"tail: {args.slow_rate:.0%} of calls take {latency * 10:g}s")
+    for hedge_after in (0, latency * 2):
+        model = FakeModel(latency=latency, slow_rate=args.slow_rate, slow_latency=latency * 10, seed=seed)
+        gemini = client(model, hedge_after=hedge_after)
+        name = f"hedge after {hedge_after:g}s" if hedge_after else "no hedging"
+        await measure(name, model, lambda: gemini.generate(PROMPT), calls, limit)
+
+    print("outage: every call fails")
+    for threshold in (0, 5):
+        model = FakeModel(latency=latency, error_rate=1.0, seed=seed)
+        gemini = client(model, breaker=CircuitBreaker(threshold=threshold, cooldown=60))
+        name = f"breaker after {threshold}" if threshold else "no breaker"
+        start = time.perf_counter()
+        # One call at a time, as requests keep arriving during an outage
+        for _ in range(calls // 10):
+            await timed(lambda: gemini.generate(PROMPT), limit)
+        print(f"  {name:<24} {calls // 10} calls in {time.perf_counter() - start:6.2f}s  backend calls {model.calls}")
+
+    print(f"rate: {args.rpm} requests per minute, bursts of {args.burst}")
+    model = FakeModel(latency=latency, seed=seed)
+    gemini = client(model)
+    gemini.requests = TokenBucket(args.rpm, burst=args.burst)
+    count = args.burst + args.rpm // 6
+    start = time.perf_counter()
+    await asyncio.gather(*(gemini.generate(PROMPT) for _ in range(count)))
+    wall = time.perf_counter() - start
+    print(f"  {count} calls in {wall:.2f}s, expected about {(count - args.burst) * 60 / args.rpm + latency:.2f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="concurrent calls per scenario")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake Gemini seconds per call")
+    parser.add_argument("--error-rate", type=float, default=0.2, help="share of calls that fail in the errors scenario")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="share of slow calls in the hangs and tail scenarios")
+    parser.add_argument("--rpm", type=int, default=600, help="requests per minute in the rate scenario")
+    parser.add_argument("--burst", type=int, default=10, help="bucket size in the rate scenario")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the fake backend")
+    asyncio.run(run(parser.parse_args()))
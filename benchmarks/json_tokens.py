@@ -0,0 +1,115 @@
+"""
+JSON extraction: prompt size before and after.
+
+Renders each JSON file the old way (json.dumps with indent=2) and with the
+incremental extractor in minified and flat mode, and reports the token
+count of each. Tokens come from Gemini's count_tokens when GEMINI_API_KEY
+is set, otherwise they are estimated at 4 characters per token.
+
+    python benchmarks/json_tokens.py                      # generated sample payloads
+    python benchmarks/json_tokens.py data/*.json --sample 50
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models.json_stream import iter_json_text
+
+
+def sample_payloads(directory):
+    """Write a few payloads shaped like common API responses, return their paths."""
+    rng = random.Random(0)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+    payloads = {
+        "api_records.json": {
+            "page": 1,
+            "total": 2000,
+            "results": [{
+                "id": i,
+                "name": f"{rng.choice(words)} {rng.choice(words)}",
+                "email": f"user{i}@example.com",
+                "active": rng.random() > 0.3,
+                "score": round(rng.random() * 100, 2),
+                "address": {"city": rng.choice(words).title(), "zip": f"{rng.randint(10000, 99999)}"},
+                "tags": rng.sample(words, 3),
+            } for i in range(2000)],
+        },
+        "geo_points.json": {
+            "type": "FeatureCollection",
+            "features": [{
+                "type": "Feature",
+                "properties": {"name": rng.choice(words), "elevation": rng.randint(0, 3000)},
+                "geometry": {"type": "LineString", "coordinates": [
+                    [round(rng.uniform(-180, 180), 6), round(rng.uniform(-90, 90), 6)] for _ in range(50)
+                ]},
+            } for _ in range(200)],
+        },
+        "config.json": {
+            "service": {"name": "contentlens", "replicas": 3, "ports": [80, 443],
+                        "env": {w.upper(): rng.choice(words) for w in words}},
+            "features": {w: {"enabled": rng.random() > 0.5, "rollout": rng.randint(0, 100)} for w in words},
+        },
+    }
+    paths = []
+    for name, data in payloads.items():
+        path = os.path.join(directory, name)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        paths.append(path)
+    return paths
+
+
+def token_counter():
+    """Return a function that counts tokens, and whether the counts are exact."""
+    if not os.getenv("GEMINI_API_KEY"):
+        return (lambda text: len(text) // 4), False
+
+    import google.generativeai as genai
+    from models.processor import MODEL_NAME
+    genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+    model = genai.GenerativeModel(MODEL_NAME)
+    return (lambda text: model.count_tokens(text).total_tokens), True
+
+
+def render(path, mode, sample):
+    """Return the text, seconds taken and peak traced memory for one rendering."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "indent=2":
+        with open(path, "r", encoding="utf-8") as f:
+            text = json.dumps(json.load(f), indent=2)
+    else:
+        text = "".join(iter_json_text(path, mode=mode, array_sample=sample))
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return text, seconds, peak
+
+
+def main(args):
+    count_tokens, exact = token_counter()
+    print(f"token counts: {'count_tokens' if exact else 'estimated (4 chars per token)'}, array sample: {args.sample}")
+    print(f"{'file':>20} {'mode':>9} {'tokens':>9} {'saved':>7} {'time':>8} {'peak mem':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for path in args.paths or sample_payloads(tmp):
+            baseline = None
+            for mode in ("indent=2", "minified", "flat"):
+                text, seconds, peak = render(path, mode, args.sample)
+                tokens = count_tokens(text)
+                baseline = baseline or tokens
+                print(f"{os.path.basename(path)[:20]:>20} {mode:>9} {tokens:>9,} {1 - tokens / baseline:>6.0%} "
+                      f"{seconds:7.3f}s {peak / (1024 * 1024):7.1f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="*", help="JSON files to measure (default: generated samples)")
+    parser.add_argument("--sample", type=int, default=50, help="items kept per array, 0 keeps all")
+    main(parser.parse_args())
@@ -0,0 +1,104 @@
+"""
+Load test: page-load latency while uploads are in flight.
+
+Runs the real app in-process with a fake Gemini model that takes --latency
+seconds per call, fires --uploads concurrent /upload requests and measures
+GET / latency while they are running.
+
+    python benchmarks/load_upload.py --uploads 50 --latency 2
+    python benchmarks/load_upload.py --uploads 50 --latency 2 --blocking
+"""
+import os
+import re
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import main
+from benchmarks.asgi_client import request, multipart
+from benchmarks.fake_gemini import FakeModel
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def upload(app, index):
+    # Unique content per upload so the result cache doesn't short-circuit the model
+    body, content_type = multipart(
+        {"instructions": "Summarize this document in 3 lines."},
+        [("document", "notes.txt", b"Some text to summarize.\n" * 100 + str(index).encode(), "text/plain")],
+    )
+    cookies = {}  # each upload is its own browser session
+    start = time.perf_counter()
+    response = await request(app, "POST", "/upload", body, {"content-type": content_type}, cookies)
+    job_id = re.search(r"/download/([0-9a-f-]+)", response.text).group(1)
+    if main.STREAM_RESULTS:
+        # The result arrives over the /stream route
+        stream = await request(app, "GET", f"/stream/{job_id}", cookies=cookies)
+        ok = "event: done" in stream.text
+    else:
+        # Poll the status route like the results page does
+        while True:
+            status = await request(app, "GET", f"/status/{job_id}", headers={"hx-request": "true"}, cookies=cookies)
+            if "hx-get" not in status.text:
+                break
+            await asyncio.sleep(0.1)
+        ok = "Processing Complete" in status.text
+    return time.perf_counter() - start, response.status if ok else 500
+
+
+async def page_loads(app, stop, interval):
+    latencies = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await request(app, "GET", "/")
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+    return latencies
+
+
+async def run(args):
+    main.processor.model = FakeModel(args.latency)
+    main.STREAM_RESULTS = not args.no_stream
+    if args.blocking:
+        # Simulate the old behaviour: the blocking SDK call on the event loop
+        async def blocking(document, instructions):
+            yield main.processor.process_document(document, instructions)
+        main.processor.astream_document = blocking
+    main.workers.start()
+
+    stop = asyncio.Event()
+    loader = asyncio.create_task(page_loads(main.app, stop, args.interval))
+    start = time.perf_counter()
+    uploads = await asyncio.gather(*(upload(main.app, i) for i in range(args.uploads)))
+    wall = time.perf_counter() - start
+    stop.set()
+    pages = await loader
+    await main.workers.stop()
+
+    upload_times = [t for t, _ in uploads]
+    print(f"uploads in flight:   {args.uploads} (model latency {args.latency}s, "
+          f"concurrency limit {main.processor.max_concurrency}, "
+          f"blocking={args.blocking}, streaming={main.STREAM_RESULTS})")
+    print(f"upload wall time:    {wall:.2f}s, failures: {sum(1 for _, s in uploads if s != 200)}")
+    print(f"upload latency:      p50={statistics.median(upload_times):.3f}s p99={percentile(upload_times, 99):.3f}s")
+    print(f"page loads measured: {len(pages)}")
+    print(f"page load latency:   p50={statistics.median(pages) * 1000:.1f}ms p99={percentile(pages, 99) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=50, help="number of concurrent uploads")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake Gemini latency in seconds")
+    parser.add_argument("--interval", type=float, default=0.05, help="delay between page loads")
+    parser.add_argument("--blocking", action="store_true", help="use the blocking process_document call")
+    parser.add_argument("--no-stream", action="store_true", help="poll the status route instead of streaming")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,161 @@
+"""
+PDF extraction: whole document vs page ranges, in-process vs the worker pool.
+
+Generates a PDF of --pages pages of text with every --scan-every'th page a
+scanned image, then extracts it: every page in-process, only a --range of
+pages in-process, and every page with WorkerPool at 1, 2, 4, ... workers up
+to the number of cores. Every in-process run happens in a fresh subprocess
+so peak RSS is measured per run.
+
+    python benchmarks/pdf_extract.py --pages 100 300 --range 1-10
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import resource
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+WORDS = ["revenue", "quarter", "growth", "customer", "margin", "forecast", "region", "product", "cost", "team"]
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _scan(rng):
+    """A grey, noisy JPEG the size of a page scanned at 100 DPI."""
+    from PIL import Image, ImageDraw
+
+    image = Image.effect_noise((850, 1100), 12).convert("RGB")
+    draw = ImageDraw.Draw(image)
+    for y in range(80, 1020, 28):
+        draw.text((70, y), " ".join(rng.choice(WORDS) for _ in range(12)), fill=(20, 20, 20))
+    output = io.BytesIO()
+    image.save(output, "JPEG", quality=60)
+    return output.getvalue()
+
+
+def write_pdf(path, pages, scan_every=10, seed=0):
+    """
+    Write a PDF of letter-size pages with 45 lines of text each, except
+    that every scan_every'th page only holds a JPEG, like a scan.
+    """
+    rng = random.Random(seed)
+    scan = _scan(rng) if scan_every else None
+    objects = []  # Object bodies, object n is objects[n - 1]
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    image = scan and add(b"<< /Type /XObject /Subtype /Image /Width 850 /Height 1100 /ColorSpace /DeviceRGB "
+                         b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n" % len(scan) + scan
+                         + b"\nendstream")
+    pages_id = len(objects) + 2 * pages + 1
+    kids = []
+    for number in range(1, pages + 1):
+        if scan_every and number % scan_every == 0:
+            content = b"q 612 0 0 792 0 0 cm /Im1 Do Q"
+        else:
+            lines = [f"Page {number}, section {rng.randint(1, 40)}"]
+            lines += [" ".join(rng.choice(WORDS) for _ in range(11)) for _ in range(44)]
+            content = b"BT /F1 10 Tf 14 TL 50 750 Td " + b" ".join(
+                f"({_escape(line)}) Tj T*".encode() for line in lines) + b" ET"
+        stream = add(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+        resources = b"/Font << /F1 %d 0 R >>" % font + (b" /XObject << /Im1 %d 0 R >>" % image if image else b"")
+        kids.append(add(b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] /Resources << %s >> "
+                        b"/Contents %d 0 R >>" % (pages_id, resources, stream)))
+    add(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (b" ".join(b"%d 0 R" % kid for kid in kids), pages))
+    catalog = add(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        f.write(b"".join(b"%010d 00000 n \n" % offset for offset in offsets))
+        f.write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, catalog, xref))
+
+
+def extract(path, pages):
+    """Extract in this process and print seconds, peak RSS, characters and page images as JSON."""
+    from models.document import Document
+
+    document = Document(path, os.path.basename(path), "application/pdf", pages=pages or None)
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    document.extract_text()
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": seconds, "peak_kb": peak, "delta_kb": peak - baseline,
+                      "chars": len(document.extracted_text), "images": len(document.page_images)}))
+
+
+def measure(path, pages):
+    output = subprocess.run([sys.executable, __file__, "--run", path, pages or ""],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+async def measure_pool(path, workers):
+    from models.pool import WorkerPool
+    from models.document import Document
+
+    pool = WorkerPool(workers=workers, timeout=600)
+    pool.start()
+    # Wait for the workers to start and warm up before timing
+    await asyncio.gather(*(pool.run(os.getpid) for _ in range(workers)))
+    document = Document(path, os.path.basename(path), "application/pdf")
+    start = time.perf_counter()
+    await pool.extract(document)
+    seconds = time.perf_counter() - start
+    pool.shutdown()
+    return {"seconds": seconds, "chars": len(document.extracted_text), "images": len(document.page_images)}
+
+
+def report(name, result, peak=True):
+    memory = f"{result['peak_kb'] / 1024:8.1f}MB {result['delta_kb'] / 1024:9.1f}MB" if peak else f"{'':>10} {'':>11}"
+    print(f"{name:>24} {result['seconds']:7.2f}s {memory} {result['chars']:>10,} {result['images']:>7}")
+
+
+def main(args):
+    cores = os.cpu_count() or 1
+    print(f"{cores} cores")
+    print(f"{'':>24} {'time':>8} {'peak RSS':>10} {'RSS growth':>11} {'chars':>10} {'images':>7}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for pages in args.pages:
+            path = os.path.join(tmp, f"{pages}.pdf")
+            write_pdf(path, pages, args.scan_every)
+            print(f"{pages} pages, {os.path.getsize(path) / (1024 * 1024):.1f}MB")
+            report("every page", measure(path, None))
+            report(f"pages {args.range}", measure(path, args.range))
+            workers = 1
+            while workers <= cores:
+                report(f"pool, {workers} workers", asyncio.run(measure_pool(path, workers)), peak=False)
+                workers *= 2
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[100, 300], help="page counts of the generated PDFs")
+    parser.add_argument("--scan-every", type=int, default=10, help="every Nth page is a scanned image, 0 for none")
+    parser.add_argument("--range", default="1-10", help="page range for the page range run")
+    parser.add_argument("--run", nargs=2, metavar=("PATH", "PAGES"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        extract(*args.run)
+    else:
+        main(args)
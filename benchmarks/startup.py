@@ -0,0 +1,105 @@
+"""
+Cold start: import time of the app and time to the first home page.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter
+--runs times and reports the median import time and the slowest imports.
+It then measures, also in fresh interpreters, how long it takes to import
+the app and serve GET /. Exits with status 1 if the median import time
+is over --budget milliseconds, or if a heavy module (the Gemini SDK,
+Pillow, python-docx, markdown, pypdfium2) is imported at startup, so regressions fail CI.
+
+    python benchmarks/startup.py --runs 5 --budget 2000
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that should only load when a document needs them
+LAZY_MODULES = ("google.generativeai", "PIL.Image", "docx", "markdown", "pypdfium2")
+
+FIRST_PAGE = f"""
+import sys, time, json, asyncio
+start = time.perf_counter()
+sys.path.insert(0, {ROOT!r})
+import main
+from benchmarks.asgi_client import request
+imported = time.perf_counter()
+response = asyncio.run(request(main.app, "GET", "/"))
+served = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (imported - start) * 1000,
+    "first_page_ms": (served - start) * 1000,
+    "status": response.status,
+    "loaded": [name for name in {LAZY_MODULES!r} if name in sys.modules],
+}}))
+"""
+
+
+def environment():
+    env = dict(os.environ, PYTHONWARNINGS="ignore")
+    env.setdefault("GEMINI_API_KEY", "benchmark")
+    return env
+
+
+def import_times(cwd):
+    """Return {module: cumulative microseconds} from one -X importtime run."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import sys; sys.path.insert(0, {ROOT!r}); import main"],
+        cwd=cwd, env=environment(), capture_output=True, text=True, check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def first_page(cwd):
+    result = subprocess.run([sys.executable, "-c", FIRST_PAGE], cwd=cwd, env=environment(),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(args):
+    # Run from an empty directory so the app's runtime files don't land in the repo
+    with tempfile.TemporaryDirectory() as cwd:
+        runs = [import_times(cwd) for _ in range(args.runs)]
+        pages = [first_page(cwd) for _ in range(args.runs)]
+
+    main_ms = statistics.median(run["main"] for run in runs) / 1000
+    print(f"import main:       median {main_ms:.0f}ms over {args.runs} runs")
+    print(f"first home page:   median {statistics.median(p['first_page_ms'] for p in pages):.0f}ms "
+          f"(status {pages[0]['status']})")
+
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1], reverse=True)
+    top_level = [(name, us) for name, us in slowest if "." not in name and name != "main"][:args.top]
+    print("slowest packages (cumulative):")
+    for name, us in top_level:
+        print(f"  {us / 1000:8.1f}ms  {name}")
+
+    failed = False
+    loaded = sorted({name for run in runs for name in LAZY_MODULES if name in run}
+                    | {name for page in pages for name in page["loaded"]})
+    if loaded:
+        print(f"FAIL: imported at startup but should be lazy: {', '.join(loaded)}")
+        failed = True
+    if args.budget and main_ms > args.budget:
+        print(f"FAIL: import main took {main_ms:.0f}ms, budget is {args.budget}ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=10, help="number of slow imports to list")
+    parser.add_argument("--budget", type=float, default=0, help="fail if import main takes longer (ms), 0 = no limit")
+    main(parser.parse_args())
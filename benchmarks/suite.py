@@ -0,0 +1,216 @@
+"""
+End-to-end benchmark suite against a local fake Gemini backend.
+
+Drives the real app in-process through upload -> extract -> process ->
+render -> download for each file type (txt, md, json, docx, image) at
+each concurrency level. For each combination it reports throughput,
+p50/p95/p99 latency, the error count and peak RSS (the server plus its
+pool workers) as JSON, so runs can be compared.
+
+    python benchmarks/suite.py --concurrency 1 8 32 --requests 40 --output results.json
+    python benchmarks/suite.py --types txt docx --latency 2 --error-rate 0.05
+"""
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import itertools
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import main
+from benchmarks.asgi_client import request, multipart
+from benchmarks.fake_gemini import FakeModel
+from benchmarks.docx_extract import write_docx
+
+FILE_TYPES = ("txt", "md", "json", "docx", "image")
+_unique = itertools.count()
+
+
+def make_file(kind, size_kb):
+    """Return (file name, content, content type) for a document of roughly size_kb, unique per call."""
+    n = next(_unique)
+    rng = random.Random(n)
+    words = " ".join(rng.choice(["alpha", "bravo", "charlie", "delta", "echo"]) for _ in range(size_kb * 170))
+    if kind == "txt":
+        return f"doc{n}.txt", f"Document {n}\n{words}".encode(), "text/plain"
+    if kind == "md":
+        sections = "\n\n".join(f"## Section {i}\n\n{words[i::8]}" for i in range(8))
+        return f"doc{n}.md", f"# Document {n}\n\n{sections}".encode(), "text/markdown"
+    if kind == "json":
+        records = [{"id": i, "doc": n, "text": words[i * 40:i * 40 + 40]} for i in range(size_kb * 15)]
+        return f"doc{n}.json", json.dumps({"records": records}, indent=2).encode(), "application/json"
+    if kind == "docx":
+        path = f"uploads/bench_{n}.docx"
+        write_docx(path, max(1, size_kb * 5), seed=n)
+        with open(path, "rb") as f:
+            data = f.read()
+        os.remove(path)
+        return f"doc{n}.docx", data, "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    if kind == "image":
+        from PIL import Image
+        image = Image.effect_noise((1600, 1200), 30 + n % 50).convert("RGB")
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=90)
+        return f"photo{n}.jpg", output.getvalue(), "image/jpeg"
+    raise ValueError(f"Unknown file type: {kind}")
+
+
+def rss_bytes():
+    """Resident memory of this process and the pool workers, from /proc (Linux)."""
+    pids = [os.getpid()]
+    executor = main.pool._executor
+    if executor is not None:
+        pids.extend(getattr(executor, "_processes", None) or {})
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            pass
+    # Without /proc fall back to the peak of this process alone
+    return total or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+async def sample_memory(stop, interval=0.05):
+    peak = rss_bytes()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        peak = max(peak, rss_bytes())
+    return peak
+
+
+async def one_request(app, file_name, content, content_type):
+    """Upload one document, wait for its result and download it. Returns (seconds, ok)."""
+    body, form_type = multipart({"instructions": "Summarize this document."},
+                                [("document", file_name, content, content_type)])
+    cookies = {}  # each request is its own browser session
+    start = time.perf_counter()
+
+    response = await request(app, "POST", "/upload", body, {"content-type": form_type}, cookies)
+    match = re.search(r"/download/([0-9a-f-]+)", response.text)
+    if response.status != 200 or match is None:
+        return time.perf_counter() - start, False
+    job_id = match.group(1)
+
+    if main.STREAM_RESULTS:
+        stream = await request(app, "GET", f"/stream/{job_id}", cookies=cookies)
+        ok = "event: done" in stream.text
+    else:
+        while True:
+            status = await request(app, "GET", f"/status/{job_id}", headers={"hx-request": "true"}, cookies=cookies)
+            if "hx-get" not in status.text:
+                break
+            await asyncio.sleep(0.05)
+        ok = "Processing Complete" in status.text
+
+    if ok:
+        download = await request(app, "GET", f"/download/{job_id}", cookies=cookies)
+        ok = download.status == 200 and download.body.startswith(b"# Result")
+    return time.perf_counter() - start, ok
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def scenario(kind, concurrency, requests, size_kb):
+    """Run `requests` uploads of one file type with at most `concurrency` in flight."""
+    limit = asyncio.Semaphore(concurrency)
+    # Build the files up front so generating them doesn't count towards latency
+    files = [make_file(kind, size_kb) for _ in range(requests)]
+
+    async def limited(file):
+        async with limit:
+            return await one_request(main.app, *file)
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample_memory(stop))
+    start = time.perf_counter()
+    results = await asyncio.gather(*(limited(file) for file in files))
+    wall = time.perf_counter() - start
+    stop.set()
+    peak = await sampler
+
+    latencies = [seconds for seconds, ok in results if ok]
+    return {
+        "file_type": kind,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(1 for _, ok in results if not ok),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 3),
+        "latency_seconds": {
+            f"p{pct}": round(percentile(latencies, pct), 4) if latencies else None for pct in (50, 95, 99)
+        },
+        "peak_rss_mb": round(peak / (1024 * 1024), 1),
+    }
+
+
+async def run(args):
+    model = FakeModel(latency=args.latency, ttft=args.ttft, chunks=args.chunks,
+                      error_rate=args.error_rate, seed=args.seed)
+    main.processor.model = model
+    main.STREAM_RESULTS = not args.no_stream
+    main.pool.start()
+    main.workers.start()
+    # Let the pool workers start before anything is timed
+    await main.pool.run(os.getpid)
+
+    results = []
+    try:
+        for kind in args.types:
+            for concurrency in args.concurrency:
+                result = await scenario(kind, concurrency, args.requests, args.size)
+                results.append(result)
+                print(f"{kind:>6} x{concurrency:<3} {result['throughput_rps']:7.2f} req/s  "
+                      f"p50={result['latency_seconds']['p50']}s p99={result['latency_seconds']['p99']}s  "
+                      f"errors={result['errors']}  peak={result['peak_rss_mb']}MB", file=sys.stderr)
+    finally:
+        await main.workers.stop()
+        main.pool.shutdown()
+
+    report = {
+        "config": {
+            "latency": args.latency, "ttft": model.ttft, "chunks": args.chunks, "error_rate": args.error_rate,
+            "requests": args.requests, "size_kb": args.size, "streaming": main.STREAM_RESULTS,
+            "gemini_max_concurrency": main.processor.max_concurrency, "job_workers": main.workers.workers,
+            "extract_workers": main.pool.workers, "python": platform.python_version(), "cpus": os.cpu_count(),
+        },
+        "model_calls": model.calls,
+        "model_errors": model.errors,
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--types", nargs="+", default=list(FILE_TYPES), choices=FILE_TYPES, help="file types to run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="requests in flight")
+    parser.add_argument("--requests", type=int, default=40, help="requests per file type and concurrency level")
+    parser.add_argument("--size", type=int, default=20, help="approximate document size in KB")
+    parser.add_argument("--latency", type=float, default=1.0, help="fake Gemini seconds per call")
+    parser.add_argument("--ttft", type=float, default=None, help="fake Gemini time to first chunk (default latency/3)")
+    parser.add_argument("--chunks", type=int, default=8, help="streamed chunks per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Gemini calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the fake backend's failures")
+    parser.add_argument("--no-stream", action="store_true", help="poll the status route instead of streaming")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    asyncio.run(run(parser.parse_args()))
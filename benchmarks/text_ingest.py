@@ -0,0 +1,94 @@
+"""
+Text ingestion: memory-mapped chunked decoding vs reading the whole file.
+
+Generates log-like text files of the given sizes (UTF-8 with CRLF line
+endings, plus a cp1252 file that isn't valid UTF-8) and reads each one with
+open().read() as before and with models/text_stream.py. Every run happens
+in a fresh subprocess so peak RSS is measured per run.
+
+    python benchmarks/text_ingest.py --sizes 1 10 50
+"""
+import os
+import sys
+import json
+import time
+import random
+import resource
+import argparse
+import tempfile
+import subprocess
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_text(path, megabytes, encoding="utf-8", seed=0):
+    """Write a log-like text file of roughly the given size."""
+    rng = random.Random(seed)
+    levels = ["INFO", "WARN", "ERROR", "DEBUG"]
+    words = ["request", "handled", "user", "café", "timeout", "retry", "queue", "naïve", "cache", "worker"]
+    with open(path, "w", encoding=encoding, newline="\r\n") as f:
+        line = 0
+        while f.tell() < megabytes * 1024 * 1024:
+            f.write(f"2024-05-01 12:{line // 60 % 60:02d}:{line % 60:02d} {rng.choice(levels)} "
+                    + ",".join(rng.choice(words) for _ in range(10)) + "\n")
+            line += 1
+
+
+def extract(engine, path):
+    """Run one read in this process and print seconds, peak RSS and characters (or the error) as JSON."""
+    if engine == "mmap":
+        # Load the module on its own so the measurement doesn't include the rest of the app
+        spec = importlib.util.spec_from_file_location("text_stream", os.path.join(ROOT, "models", "text_stream.py"))
+        text_stream = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(text_stream)
+        run = lambda: text_stream.read_text(path)
+    else:
+        def run():
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    try:
+        text = run()
+    except UnicodeDecodeError as e:
+        print(json.dumps({"error": str(e)[:60]}))
+        return
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"seconds": seconds, "peak_kb": peak, "delta_kb": peak - baseline, "chars": len(text)}))
+
+
+def measure(engine, path):
+    output = subprocess.run([sys.executable, __file__, "--run", engine, path],
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main(args):
+    print(f"{'file':>12} {'engine':>7} {'time':>8} {'peak RSS':>10} {'RSS growth':>11} {'chars':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        files = [(f"{megabytes:g}MB utf-8", megabytes, "utf-8") for megabytes in args.sizes]
+        files.append((f"{args.sizes[0]:g}MB cp1252", args.sizes[0], "cp1252"))
+        for name, megabytes, encoding in files:
+            path = os.path.join(tmp, f"{megabytes}mb-{encoding}.txt")
+            make_text(path, megabytes, encoding)
+            for engine in ("read", "mmap"):
+                result = measure(engine, path)
+                if "error" in result:
+                    print(f"{name:>12} {engine:>7}  failed: {result['error']}")
+                    continue
+                print(f"{name:>12} {engine:>7} {result['seconds']:7.2f}s "
+                      f"{result['peak_kb'] / 1024:8.1f}MB {result['delta_kb'] / 1024:9.1f}MB {result['chars']:>12,}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=float, nargs="+", default=[1, 10, 50], help="file sizes in MB")
+    parser.add_argument("--run", nargs=2, metavar=("ENGINE", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.run:
+        extract(*args.run)
+    else:
+        main(args)
@@ -1,19 +1,95 @@
 from fasthtml.common import *
 from monsterui.all import *
 import os 
-from models import Document, Processor
+from models import Processor, Batch, BatchStore, BATCH_MAX_FILES, JobStore, JobWorkers, WorkerPool, save_upload, UploadLimit, FileTooLargeError, MAX_UPLOAD_SIZE, DownloadResponse, remove_file
+from models import span, record_stage, render_metrics, UPLOAD_BYTES, DocumentSessionStore, DOCUMENT_SESSION_TTL, parse_page_range, QueueFullError, extraction_cache
 import uuid
-import markdown
+import json
+import time
+import codecs
 import asyncio
-from starlette.responses import RedirectResponse
-from starlette.background import BackgroundTask
+import threading
+import zipfile
+from starlette.responses import RedirectResponse, JSONResponse, PlainTextResponse
 
 
 os.makedirs('uploads', exist_ok=True)
 os.makedirs('downloads', exist_ok=True)
 
 
+def sweep_once():
+    """
+    Delete what has expired once. Other server processes sweep the same
+    rows, so files may already be gone; an error with one item is logged
+    and the rest are still swept.
+    """
+    def sweep(kind, items, delete, name):
+        for item in items():
+            try:
+                delete(item)
+                print(f"Deleted expired {kind}: {name(item)}")
+            except Exception as e:
+                print(f"Could not delete expired {kind} {name(item)}: {e}")
+
+    def delete_job(job):
+        for path in (job["result_path"], job["file_path"]):
+            if path:
+                remove_file(path)
+        processor.cache.delete(job["result_key"])
+        jobs.delete(job["id"])
+
+    sweep("job", jobs.expired, delete_job, lambda job: job["id"])
+    sweep("batch", batch_store.expired, delete_batch, lambda batch: batch.id)
+    # Batches left unfinished by a process that stopped
+    for batch in batch_store.abandoned():
+        try:
+            batch.abandon(jobs)
+            print(f"Failed the unfinished files of interrupted batch: {batch.id}")
+        except Exception as e:
+            print(f"Could not finish interrupted batch {batch.id}: {e}")
+    sweep("document", doc_sessions.expired, delete_document, lambda doc: doc["id"])
+
+async def sweep_expired(interval=60):
+    """Delete results that have outlived RESULT_TTL, for every session."""
+    while True:
+        try:
+            # SQLite and file system calls, kept off the event loop
+            await asyncio.to_thread(sweep_once)
+        except Exception as e:
+            # A locked database or the like, try again next time
+            print(f"Sweeping expired results failed: {e}")
+        await asyncio.sleep(interval)
+
+async def start_workers():
+    """Start the extraction pool, the background job workers and the expiry sweep when the server starts."""
+    pool.start()
+    workers.start()
+    app.state.sweeper = asyncio.create_task(sweep_expired())
+    # Load the Gemini client in the background, the home page doesn't need it
+    app.state.model_loader = asyncio.create_task(asyncio.to_thread(lambda: processor.model))
+
+async def stop_workers():
+    """Stop the workers, unfinished jobs are picked up again after a restart."""
+    app.state.sweeper.cancel()
+    await workers.stop()
+    pool.shutdown()
+
+def upload_too_large(req, exc):
+    """Page for an upload whose body went over the limit (see UploadLimit)."""
+    return Titled(
+        "Error",
+        P(exc.detail),
+        A("Go Back", href="/batch" if req.url.path == "/batch" else "/", cls=ButtonT.primary)
+    )
+
+
 app, rt = fast_app(
+    on_startup=[start_workers],
+    on_shutdown=[stop_workers],
+    # Cap upload bodies as they arrive, before FastHTML parses (and spools) the form
+    middleware=[Middleware(UploadLimit, limits={"/upload": MAX_UPLOAD_SIZE,
+                                                "/batch": MAX_UPLOAD_SIZE * BATCH_MAX_FILES})],
+    exception_handlers={413: upload_too_large},
     hdrs=(
         Theme.blue.headers(),  # Already blue-based, but we'll enhance it
         Link(rel="stylesheet", href="/static/css/custom.css", type="text/css"), 
@@ -31,26 +107,6 @@ app, rt = fast_app(
     static_path="static"
 )
 
-# Add this after your app initialization
-@app.middleware("http")
-async def check_session_expiry(request, call_next):
-    """Clean up files when session expires or page is refreshed."""
-    response = await call_next(request)
-    
-    # If this is a new page load (not an asset request)
-    if request.url.path == "/" and request.method == "GET":
-        # Clean up any existing documents
-        for file_id, doc_info in list(documents.items()):
-            result_path = doc_info["result_path"]
-            if os.path.exists(result_path):
-                os.remove(result_path)
-                print(f"Deleted result file on page refresh: {result_path}")
-        
-        # Clear the documents dictionary
-        documents.clear()
-    
-    return response
-
 def logo():
     return DivLAligned(
         Span("Content", cls="text-center text-3xl font-bold text-white"),
@@ -60,20 +116,198 @@ def logo():
     )
 
 
-processor = Processor() # Creating the processor 
+# CPU-bound extraction and rendering run in worker processes
+pool = WorkerPool()
+
+processor = Processor(pool=pool) # Creating the processor 
+
+# Stream LLM output to the results page as it is generated
+STREAM_RESULTS = os.getenv("STREAM_RESULTS", "true").lower() == "true"
 
-# temporary storage
-documents = {}
+# Uploads are processed as jobs by background workers. Jobs and batches
+# live in SQLite so every server process sees the same results.
+jobs = JobStore()
+batch_store = BatchStore()
+# Documents kept for follow-up questions, in the same database
+doc_sessions = DocumentSessionStore()
+workers = JobWorkers(jobs, processor, pool=pool, sessions=doc_sessions)
 
-def markdown_to_html(md_text):
-    """Convert markdown text to HTML for display."""
-    return markdown.markdown(md_text)
+def session_id(session):
+    """Return the id of the browser session, creating one if needed."""
+    if "sid" not in session:
+        session["sid"] = str(uuid.uuid4())
+    return session["sid"]
+
+def clear_session_results(session):
+    """Delete the finished results of this session only (queued and running jobs are kept)."""
+    for job in jobs.finished(session_id(session)):
+        result_path = job["result_path"]
+        if remove_file(result_path):
+            print(f"Deleted result file: {result_path}")
+        processor.cache.delete(job["result_key"])
+        jobs.delete(job["id"])
+    for doc in doc_sessions.for_session(session_id(session)):
+        delete_document(doc)
+
+def delete_batch(batch):
+    """Delete a batch's files, its row and the cached copies of its results."""
+    batch.cleanup()
+    for item in batch.items:
+        processor.cache.delete(item.get("result_key"))
+
+def delete_document(doc):
+    """Delete a document kept for follow-up questions: its files, its row and its context cache."""
+    for path in (doc["file_path"], doc["text_path"]):
+        if path:
+            remove_file(path)
+    doc_sessions.delete(doc["id"])
+    if doc["cache_name"]:
+        # Deleting the cache is a Gemini call, don't hold up the page for it
+        threading.Thread(target=processor.context_caches.delete, args=(doc["cache_name"],), daemon=True).start()
+
+async def markdown_to_html(md_text):
+    """Convert markdown text to HTML for display, in the worker pool for long results."""
+    with span("render"):
+        return await pool.render(md_text)
+
+def download_button(file_id, ready, **kwargs):
+    """Download button for a result, disabled until the result is ready."""
+    return A(
+        DivLAligned(UkIcon("download"), "Download Result"),
+        href=f"/download/{file_id}", 
+        id="download-button",
+        cls=(ButtonT.primary, "mr-4", "" if ready else "pointer-events-none opacity-50"),
+        uk_tooltip="Download now - this file will be deleted afterward",
+        **kwargs
+    )
+
+def follow_up_form(doc):
+    """Form for asking another question about a document kept for follow-up questions."""
+    minutes = max(1, int((doc["expires_at"] - time.time()) // 60))
+    return Form(method="post", action=f"/ask/{doc['id']}")(
+        H4("Ask another question", cls="font-semibold mb-2"),
+        P(f"This document is kept for {minutes} more minutes, follow-up questions don't need a new upload.",
+          cls=TextT.muted),
+        TextArea(
+            name="instructions",
+            placeholder="Enter another instruction for this document...",
+            required=True,
+            rows=3,
+            cls="w-full p-3 border rounded-md mb-2"
+        ),
+        Button(DivLAligned(UkIcon("message-circle"), Span("Ask", cls="ml-2")), type="submit", cls=ButtonT.primary),
+        cls="mb-6"
+    )
+
+def results_page(file_id, file_name, instructions, sid, doc=None):
+    """
+    Render the results page for a queued job.
+    The page fills itself in from the /stream/{file_id} Server-Sent Events route
+    as the LLM generates, or by polling /status/{file_id} when streaming is off.
+    doc is the document session when the document is kept for follow-up questions.
+    """
+    return Titled(
+        "Processing Results",
+        Container(
+            Section(
+                H1("Processing...", id="result-title", cls="text-center text-2xl font-bold"),
+                P("Your document has been processed according to your instructions.", 
+                cls=(TextT.muted, "text-center")),
+                cls=(SectionT.primary, "rounded-lg p-6 mb-6")
+            ),
+            
+            Card(
+                Grid(
+                    Div(
+                        H4("Document", cls="font-semibold mb-2"),
+                        P(file_name, cls="break-all"),
+                    ),
+                    Div(
+                        H4("Instructions", cls="font-semibold mb-2"),
+                        P(instructions, cls="break-all"),
+                    ),
+                    cols=2,
+                    gap=4,
+                    cls="mb-4"
+                ),
+                
+                Divider(),
+                  # Add this notice at the bottom of the card
+                Div(
+                    P("Note: Your processed document will be deleted after download or when you start a new process.", 
+                    cls=TextT.muted),
+                    cls="mt-4 text-center"
+                ),
+                
+                Div(
+                    H3("Result:", cls="text-xl font-bold mb-4"),
+                    Div(
+                        P("Waiting for the first words...", cls=TextT.muted) if STREAM_RESULTS else pending_status(file_id, "queued"), 
+                        id="result-container",
+                        cls="result-container bg-gray-50 p-4 rounded-md overflow-auto max-h-96 text-gray-800"
+                    ),
+                    cls="mb-6"
+                ),
+
+                follow_up_form(doc) if doc else None,
+                
+                DivCentered(
+                    # In your results page, update the download button
+                    download_button(file_id, ready=False),
+                    # Update your "Process Another" button
+                    A(
+                        DivLAligned(UkIcon("redo"), "Process Another Document"),
+                        href="/process-another",
+                        cls=ButtonT.secondary,
+                        uk_tooltip="Current results will be deleted",
+                        onclick="return confirm('Start a new process? Your current results will be deleted.');"
+                    ),
+                    cls="space-x-4"
+                ),
+                
+                header=H3("Processing Results", cls="text-xl font-bold"),
+                cls="max-w-4xl mx-auto"
+            ),
+            
+            # Show the text as it arrives over SSE, then the rendered result once it is complete
+            Script(f"""
+            const source = new EventSource('/stream/{file_id}');
+            const result = document.getElementById('result-container');
+            let streamed = null;
+            source.onmessage = (e) => {{ result.innerHTML = e.data; streamed = null; }};
+            source.addEventListener('delta', (e) => {{
+                if (!streamed) {{
+                    streamed = document.createElement('div');
+                    streamed.className = 'whitespace-pre-wrap';
+                    result.replaceChildren(streamed);
+                }}
+                streamed.append(JSON.parse(e.data));
+                result.scrollTop = result.scrollHeight;
+            }});
+            source.addEventListener('done', (e) => {{
+                source.close();
+                result.innerHTML = e.data;
+                document.getElementById('result-title').textContent = 'Processing Complete';
+                document.getElementById('download-button').classList.remove('pointer-events-none', 'opacity-50');
+            }});
+            source.addEventListener('failed', (e) => {{
+                source.close();
+                document.getElementById('result-title').textContent = 'An Error Occurred';
+                result.innerHTML = e.data;
+            }});
+            """) if STREAM_RESULTS else None,
+            
+            cls=ContainerT.xl
+        )
+    )
 
 
 # Defining main page 
 @rt("/")
-def get():
+def get(session):
     """Handle GET requests to the home page."""
+    # A new page load clears this session's previous results
+    clear_session_results(session)
     return Titled(
         "🔍 ContentLens | AI-Powered Document Insights",
         Container(
@@ -106,7 +340,7 @@ def get():
                 Div(
                     H4("Privacy Notice:", cls="text-orange-600"),
                     Ul(
-                        Li("Uploaded files are deleted immediately after processing"),
+                        Li("Uploaded files are deleted immediately after processing, unless you keep them for follow-up questions"),
                         Li("Results are deleted after download or when you process another document"),
                         Li("All data is automatically deleted when the page is refreshed"),
                         cls=ListT.disc
@@ -132,7 +366,7 @@ def get():
                                     type="file", 
                                     name="document", 
                                     required=True,
-                                    accept=".txt,.md,.markdown,.json,.docx,image/*",
+                                    accept=".txt,.md,.markdown,.json,.docx,.pdf,image/*",
                                     id="document-input",
                                     onchange="document.getElementById('upload-status').textContent = 'File selected: ' + this.files[0].name; document.getElementById('upload-status').style.display = 'block';",
                                     
@@ -144,7 +378,7 @@ def get():
                                 ),
                                 cls="flex items-center justify-center p-4 border-2 border-dashed border-gray-300 rounded-lg cursor-pointer"
                             ),
-                            P("Supported formats: TXT, MD, JSON, DOCX, and images", cls=TextT.muted),
+                            P("Supported formats: TXT, MD, JSON, DOCX, PDF, and images", cls=TextT.muted),
                             cls="mb-6"
                         ),
                         
@@ -160,6 +394,26 @@ def get():
                             ),
                             cls="mb-6"
                         ),
+
+                        # Only the requested pages of a PDF are read
+                        Div(
+                            H4("Pages", cls="font-semibold mb-2"),
+                            Input(
+                                name="pages",
+                                placeholder="All pages, or e.g. 1-10, 15 (PDF only)",
+                                cls="w-full p-3 border rounded-md"
+                            ),
+                            cls="mb-6"
+                        ),
+
+                        # Keep the document to ask more questions without uploading it again
+                        Div(
+                            LabelCheckboxX(
+                                f"Keep this document for follow-up questions ({DOCUMENT_SESSION_TTL // 60} minutes)",
+                                id="keep"
+                            ),
+                            cls="mb-6"
+                        ),
                     ),
                     
 
@@ -174,6 +428,7 @@ def get():
                 ),
                 
                 header=H3("Upload Your Document", cls="text-xl font-bold"),
+                footer=P("Processing many files? ", A("Try batch mode", href="/batch", cls="text-blue-600 underline"), cls=(TextT.muted, "text-center")),
                 cls="max-w-2xl mx-auto"
             ),
             
@@ -189,7 +444,13 @@ def get():
     )
 
 @rt("/upload")
-async def post(req):
+async def post(req, session):
+    # Turn the request away before its upload is read if it couldn't be queued anyway
+    try:
+        await asyncio.to_thread(jobs.admit, session_id(session))
+    except QueueFullError as e:
+        return queue_full_page(e)
+
     form = await req.form()
     uploaded_file = form.get("document")
     instructions = form.get("instructions")
@@ -200,16 +461,14 @@ async def post(req):
             P("Please provide both a document and instructions"), 
             A("Go Back", href="/", cls=ButtonT.primary)
         )
-        
-    # Add this file size check
-    file_size = len(await uploaded_file.read())
-    await uploaded_file.seek(0)  # Reset file pointer after reading
-    
-    # 10MB limit (adjust as needed)
-    if file_size > 10 * 1024 * 1024:  
+
+    pages = (form.get("pages") or "").strip() or None
+    try:
+        parse_page_range(pages)
+    except ValueError as e:
         return Titled(
             "Error",
-            P("File too large. Please upload files smaller than 10MB."),
+            P(f"Invalid pages: {e}"),
             A("Go Back", href="/", cls=ButtonT.primary)
         )
         
@@ -217,106 +476,41 @@ async def post(req):
     file_name = uploaded_file.filename
     file_path = f"uploads/{file_id}_{file_name}"
     
-    # Saving the file 
-    with open(file_path, "wb") as f:
-        f.write(await uploaded_file.read())
-        
-    # Creating Document object
-    document = Document(file_path, file_name, uploaded_file.content_type)
-    
+    # Stream the file to disk in chunks, enforcing the size limit as we go
     try:
-        # Extract text from the document
-        document.extract_text()
-        
-        # Process the document with the LLM
-        result = processor.process_document(document, instructions)
-        
-        # Save the result to a file
-        result_path = f"downloads/{file_id}_result.md"
-        with open(result_path, "w", encoding="utf-8") as f:
-            f.write(result)
-            
-        # Delete the original uploaded file since we don't need it anymore
-        if os.path.exists(document.file_path):
-            os.remove(document.file_path)
-            print(f"Deleted uploaded file after processing: {document.file_path}")
-        
-        # Store the document and result path for download  
-        documents[file_id] = {
-            "result_path": result_path,
-            "file_name": file_name
-        }
-        
-        # Show the result
-        # Show the result (in your post function)
+        with span("save"):
+            file_size, content_hash = await save_upload(uploaded_file, file_path)
+    except FileTooLargeError as e:
         return Titled(
-            "Processing Results",
-            Container(
-                Section(
-                    H1("Processing Complete", cls="text-center text-2xl font-bold"),
-                    P("Your document has been processed according to your instructions.", 
-                    cls=(TextT.muted, "text-center")),
-                    cls=(SectionT.primary, "rounded-lg p-6 mb-6")
-                ),
-                
-                Card(
-                    Grid(
-                        Div(
-                            H4("Document", cls="font-semibold mb-2"),
-                            P(file_name, cls="break-all"),
-                        ),
-                        Div(
-                            H4("Instructions", cls="font-semibold mb-2"),
-                            P(instructions, cls="break-all"),
-                        ),
-                        cols=2,
-                        gap=4,
-                        cls="mb-4"
-                    ),
-                    
-                    Divider(),
-                      # Add this notice at the bottom of the card
-                    Div(
-                        P("Note: Your processed document will be deleted after download or when you start a new process.", 
-                        cls=TextT.muted),
-                        cls="mt-4 text-center"
-                    ),
-                    
-                    Div(
-                        H3("Result:", cls="text-xl font-bold mb-4"),
-                        Div(
-                            Safe(markdown_to_html(result)), 
-                            cls="result-container bg-gray-50 p-4 rounded-md overflow-auto max-h-96 text-gray-800"
-                        ),
-                        cls="mb-6"
-                    ),
-                    
-                    DivCentered(
-                        # In your results page, update the download button
-                        A(
-                            DivLAligned(UkIcon("download"), "Download Result"),
-                            href=f"/download/{file_id}", 
-                            cls=(ButtonT.primary, "mr-4"),
-                            uk_tooltip="Download now - this file will be deleted afterward"
-                        ),
-                        # Update your "Process Another" button
-                        A(
-                            DivLAligned(UkIcon("redo"), "Process Another Document"),
-                            href="/process-another",
-                            cls=ButtonT.secondary,
-                            uk_tooltip="Current results will be deleted",
-                            onclick="return confirm('Start a new process? Your current results will be deleted.');"
-                        ),
-                        cls="space-x-4"
-                    ),
-                    
-                    header=H3("Processing Results", cls="text-xl font-bold"),
-                    cls="max-w-4xl mx-auto"
-                ),
-                
-                cls=ContainerT.xl
-            )
+            "Error",
+            P(str(e)),
+            A("Go Back", href="/", cls=ButtonT.primary)
         )
+    UPLOAD_BYTES.observe(file_size, file_type=uploaded_file.content_type or "unknown")
+        
+    try:
+        # Kept documents are reused by follow-up questions, the session id is the first job's id
+        doc = None
+        if form.get("keep"):
+            await asyncio.to_thread(doc_sessions.create, file_id, file_path, file_name, uploaded_file.content_type,
+                                    content_hash=content_hash, session_id=session_id(session), pages=pages)
+            doc = await asyncio.to_thread(doc_sessions.get, file_id)
+
+        # Queue the document, a background worker extracts and processes it
+        await asyncio.to_thread(jobs.enqueue, file_id, file_path, file_name, uploaded_file.content_type, instructions,
+                                content_hash=content_hash, session_id=session_id(session),
+                                document_id=doc and doc["id"], pages=pages)
+        workers.notify()
+        
+        # Show the results page right away, it fills in as the job runs
+        return results_page(file_id, file_name, instructions, session_id(session), doc)
+
+    except QueueFullError as e:
+        # The queue filled up while the file was uploading
+        if doc:
+            await asyncio.to_thread(doc_sessions.delete, doc["id"])
+        await asyncio.to_thread(remove_file, file_path)
+        return queue_full_page(e)
 
     except Exception as e:
         # Clean up the uploaded file if there's an error
@@ -348,24 +542,189 @@ def get():
     """Handle GET requests to the upload URL by redirecting to home."""
     return RedirectResponse(url="/", status_code=303)
 
+@rt("/ask/{document_id}")
+async def post(document_id: str, req, session):
+    """Queue a follow-up question about a kept document, reusing its extracted text and context cache."""
+    doc = await asyncio.to_thread(doc_sessions.get, document_id, session_id(session))
+    if doc is None:
+        return Titled(
+            "Error",
+            P("This document has expired or been deleted, please upload it again."),
+            A("Go Back", href="/", cls=ButtonT.primary)
+        )
+
+    form = await req.form()
+    instructions = form.get("instructions")
+    if not instructions:
+        return Titled(
+            "Error",
+            P("Please provide instructions"),
+            A("Go Back", href="/", cls=ButtonT.primary)
+        )
+
+    file_id = str(uuid.uuid4())
+    try:
+        await asyncio.to_thread(jobs.enqueue, file_id, doc["file_path"], doc["file_name"], doc["file_type"],
+                                instructions, content_hash=doc["content_hash"], session_id=session_id(session),
+                                document_id=doc["id"], pages=doc["pages"])
+    except QueueFullError as e:
+        return queue_full_page(e)
+    workers.notify()
+    return results_page(file_id, doc["file_name"], instructions, session_id(session), doc)
+
+@rt("/ask/{document_id}")
+def get():
+    """Follow-up questions are posted from the results page."""
+    return RedirectResponse(url="/", status_code=303)
+
+def queue_full_page(error, back="/"):
+    """Page for a request turned away because the queue is full, with a Retry-After header."""
+    return FtResponse(
+        Titled(
+            "Error",
+            P(str(error)),
+            A("Go Back", href=back, cls=ButtonT.primary)
+        ),
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+def queue_message(status, position=None):
+    """What a job that hasn't produced any output yet is doing."""
+    if status != "queued":
+        return "Processing your document..."
+    if position is None:
+        return "Waiting in the queue..."
+    return "Waiting in the queue, you're next..." if position == 1 else f"Waiting in the queue (position {position})..."
+
+def pending_status(file_id, status, position=None):
+    """Placeholder for a job that hasn't finished, polls /status until it has."""
+    return Div(
+        P(queue_message(status, position), cls=TextT.muted),
+        id="result",
+        hx_get=f"/status/{file_id}",
+        hx_trigger="every 1s",
+        hx_swap="outerHTML"
+    )
+
+async def job_status(file_id, sid):
+    """
+    Result fragment for a job, polled by the results page when results aren't streamed.
+    Once the job has finished it also updates the page title and download button.
+    """
+    job = await asyncio.to_thread(jobs.get, file_id, sid)
+    if job is None:
+        return P("Document not found. It may have expired or been deleted.", id="result")
+    
+    if job["status"] == "failed":
+        return Div(
+            P(f"Error message: {job['error']}"),
+            H1("An Error Occurred", id="result-title", hx_swap_oob="true", cls="text-center text-2xl font-bold"),
+            id="result"
+        )
+    
+    if job["status"] == "done":
+        with open(job["result_path"], "r", encoding="utf-8") as f:
+            result = f.read()
+        return Div(
+            Safe(await markdown_to_html(result)),
+            H1("Processing Complete", id="result-title", hx_swap_oob="true", cls="text-center text-2xl font-bold"),
+            download_button(file_id, ready=True, hx_swap_oob="true"),
+            id="result"
+        )
+    
+    position = await asyncio.to_thread(jobs.queue_position, file_id) if job["status"] == "queued" else None
+    return pending_status(file_id, job["status"], position)
+
+
+@rt("/status/{file_id}")
+async def get(file_id: str, session):
+    """Handle polling for the status of a job."""
+    return await job_status(file_id, session_id(session))
+
+
+async def stream_result(file_id, sid):
+    """
+    Follow a job's partial result file as SSE messages: the text as it is
+    written ("delta" events, JSON strings), then the result rendered once
+    it is complete ("done").
+    """
+    job = await asyncio.to_thread(jobs.get, file_id, sid)
+    if job is None:
+        yield sse_message(P("Document not found. It may have expired or been deleted."), event="failed")
+        return
+    
+    part_path = f"{job['result_path']}.part"
+    # Bytes of the result already sent, decoded a chunk at a time so a character split between reads isn't lost
+    offset, decoder, parts = 0, codecs.getincrementaldecoder("utf-8")(errors="ignore"), []
+    shown, checked = None, 0  # Queue message on the page, and when the queue was last looked at
+    while True:
+        job = await asyncio.to_thread(jobs.get, file_id, sid)
+        if job is None:
+            yield sse_message(P("Document not found. It may have expired or been deleted."), event="failed")
+            return
+        if job["status"] == "failed":
+            yield sse_message(P(f"Error message: {job['error']}"), event="failed")
+            return
+
+        # Until there is output, show the place in the queue (looked up at most once a second)
+        if not offset and job["status"] != "done" and time.monotonic() - checked >= 1:
+            checked = time.monotonic()
+            position = await asyncio.to_thread(jobs.queue_position, file_id) if job["status"] == "queued" else None
+            message = queue_message(job["status"], position)
+            if message != shown:
+                shown = message
+                yield sse_message(P(message, cls=TextT.muted))
+        
+        # Send only what the worker has written since the last look
+        path = job["result_path"] if job["status"] == "done" else part_path
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < offset:
+                    # The job was started again after its worker stopped, so is its output
+                    offset, parts = 0, []
+                    decoder.reset()
+                    yield sse_message(P("Processing was interrupted, starting again...", cls=TextT.muted))
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            data = b""
+        offset += len(data)
+        delta = decoder.decode(data, final=job["status"] == "done")
+        if delta:
+            parts.append(delta)
+            yield sse_message(json.dumps(delta), event="delta")
+        
+        if job["status"] == "done":
+            # Render the markdown once, now that it is complete
+            yield sse_message(Safe(await markdown_to_html("".join(parts))), event="done")
+            return
+        await asyncio.sleep(0.2)
+
+
+@rt("/stream/{file_id}")
+async def get(file_id: str, session):
+    """Stream the result for a job as Server-Sent Events."""
+    return EventStream(stream_result(file_id, session_id(session)))
+
         
 # Add this route to handle downloads
 
 @rt("/download/{file_id}")
-async def get(file_id: str):
+async def get(file_id: str, session):
     """Handle GET requests to download processed results."""
-    # Check if the file_id exists in our documents dictionary
-    if file_id not in documents:
+    # Check if the job exists, belongs to this session and has finished
+    job = await asyncio.to_thread(jobs.get, file_id, session_id(session))
+    if job is None or job["status"] != "done":
         return Titled(
             "Error",
-            P("Document not found. It may have expired or been deleted."),
+            P("Document not found. It may still be processing, have expired or been deleted."),
             A("Go Back", href="/", cls=ButtonT.primary)
         )
     
     # Get the document info
-    doc_info = documents[file_id]
-    result_path = doc_info["result_path"]
-    file_name = doc_info["file_name"]
+    result_path = job["result_path"]
+    file_name = job["file_name"]
     
     # Check if the result file exists
     if not os.path.exists(result_path):
@@ -375,49 +734,248 @@ async def get(file_id: str):
             A("Go Back", href="/", cls=ButtonT.primary)
         )
     
-    # Create a temporary file with the same content
-    temp_file_path = f"downloads/temp_{file_id}.md"
-    with open(result_path, "r", encoding="utf-8") as src, open(temp_file_path, "w", encoding="utf-8") as dst:
-        dst.write(src.read())
-    
-    # Delete the original file
-    os.remove(result_path)
-    print(f"Deleted original result file: {result_path}")
-    
-    # Remove from memory
-    documents.pop(file_id, None)
-    print(f"Removed document {file_id} from memory")
-    
-    # Serve the temporary file
-    response = FileResponse(
-        temp_file_path,
+    started = time.perf_counter()
+
+    def remove_result():
+        record_stage("download", time.perf_counter() - started)
+        # Only the download that removes the job deletes the file, so concurrent downloads can't race
+        if jobs.delete(file_id) and remove_file(result_path):
+            print(f"Deleted result file after download: {result_path}")
+        # The cached copy goes too, so the result is really gone once downloaded
+        processor.cache.delete(job["result_key"])
+
+    # Stream the result straight from disk, it is removed once the whole body has been sent
+    return DownloadResponse(
+        result_path,
+        on_sent=remove_result,
         filename=f"{file_name}_result.md",
         media_type="text/markdown"
     )
+
+def batch_progress(batch):
+    """Progress table for a batch. Polls itself every second until the archive is ready."""
+    counts = batch.counts()
+    ready = batch.archive_path is not None
+    status_icons = {"queued": "clock", "processing": "loader", "done": "check", "failed": "x"}
+    return Div(
+        P(f"{counts['done'] + counts['failed']} of {len(batch.items)} files finished "
+          f"({counts['done']} done, {counts['failed']} failed, {counts['processing']} processing)",
+          cls="font-semibold mb-4"),
+        Table(
+            Thead(Tr(Th("File"), Th("Status"), Th("Details"))),
+            Tbody(*[
+                Tr(
+                    Td(item["file_name"], cls="break-all"),
+                    Td(DivLAligned(UkIcon(status_icons[item["status"]]), Span(item["status"], cls="ml-1"))),
+                    Td(item["error"] or "", cls="text-red-600 break-all"),
+                )
+                for item in batch.items
+            ]),
+            cls=(TableT.divider, TableT.sm)
+        ),
+        DivCentered(
+            A(
+                DivLAligned(UkIcon("download"), "Download All Results"),
+                href=f"/batch/{batch.id}/download",
+                cls=ButtonT.primary,
+                uk_tooltip="Download now - the results will be deleted afterward"
+            ) if ready else P("Processing... this page updates automatically.", cls=TextT.muted),
+            cls="mt-6"
+        ),
+        id="batch-progress",
+        hx_get=None if ready else f"/batch/{batch.id}/status",
+        hx_trigger=None if ready else "every 1s",
+        hx_swap="outerHTML"
+    )
+
+
+@rt("/batch")
+def get():
+    """Batch page: one instruction applied to many documents."""
+    return Titled(
+        "🔍 ContentLens | Batch Processing",
+        Container(
+            Card(
+                P("Upload several files, or a single zip archive, and the same instructions will be applied to each one. "
+                  "You'll get one archive with a result per file.", cls=(TextT.muted, "mb-6")),
+                Form(
+                    method="post",
+                    action="/batch",
+                    enctype="multipart/form-data"
+                )(
+                    Fieldset(
+                        Div(
+                            H4("Select Documents", cls="font-semibold mb-2"),
+                            Input(
+                                type="file",
+                                name="documents",
+                                multiple=True,
+                                required=True,
+                                accept=".txt,.md,.markdown,.json,.docx,.pdf,.zip,image/*",
+                            ),
+                            P(f"Up to {BATCH_MAX_FILES} files. Supported formats: TXT, MD, JSON, DOCX, PDF, images, or a ZIP of these", cls=TextT.muted),
+                            cls="mb-6"
+                        ),
+                        Div(
+                            H4("Instructions", cls="font-semibold mb-2"),
+                            TextArea(
+                                name="instructions",
+                                placeholder="Enter instructions to apply to every document...",
+                                required=True,
+                                rows=5,
+                                cls="w-full p-3 border rounded-md"
+                            ),
+                            cls="mb-6"
+                        ),
+                    ),
+                    DivCentered(
+                        Button(
+                            DivLAligned(UkIcon("wand"), Span("Process Documents", cls="ml-2")),
+                            type="submit",
+                            cls=(ButtonT.primary, "px-6 py-3")
+                        )
+                    )
+                ),
+                header=H3("Batch Processing", cls="text-xl font-bold"),
+                cls="max-w-2xl mx-auto mt-5"
+            ),
+            cls=ContainerT.xl
+        )
+    )
+
+
+@rt("/batch")
+async def post(req, session):
+    """Save the uploaded files, start processing them in the background and show the progress page."""
+    # Batches count against the same queue limits as single uploads, and only so many run at once
+    try:
+        await asyncio.to_thread(jobs.admit, session_id(session))
+        await asyncio.to_thread(batch_store.admit, session_id(session))
+    except QueueFullError as e:
+        return queue_full_page(e, back="/batch")
+
+    form = await req.form()
+    uploaded_files = [f for f in form.getlist("documents") if getattr(f, "filename", None)]
+    instructions = form.get("instructions")
+    
+    if not uploaded_files or not instructions:
+        return Titled(
+            "Error",
+            P("Please provide at least one document and instructions"), 
+            A("Go Back", href="/batch", cls=ButtonT.primary)
+        )
+    
+    batch = Batch(instructions, session_id=session_id(session), store=batch_store)
+    try:
+        for uploaded_file in uploaded_files:
+            file_name = uploaded_file.filename
+            file_path = f"uploads/{batch.id}_{len(batch.items)}_{file_name}"
+            
+            if file_name.lower().endswith(".zip"):
+                # Archives may hold many files, so allow one file's limit per file in the batch
+                await save_upload(uploaded_file, file_path, max_size=MAX_UPLOAD_SIZE * BATCH_MAX_FILES)
+                await asyncio.to_thread(batch.add_zip, file_path)
+            else:
+                await save_upload(uploaded_file, file_path)
+                batch.add_file(file_path, file_name, uploaded_file.content_type)
+                
+    except (ValueError, zipfile.BadZipFile) as e:
+        await asyncio.to_thread(batch.cleanup)
+        return Titled(
+            "Error",
+            P(f"Error message: {str(e)}"),
+            A("Go Back", href="/batch", cls=ButtonT.primary)
+        )
     
-    # Set up a background task to delete the temporary file after a few seconds
-    async def cleanup_temp():
-        await asyncio.sleep(5)  # Wait longer to ensure file is sent
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
-            print(f"Deleted temporary file: {temp_file_path}")
+    try:
+        await batch.start(workers)
+    except QueueFullError as e:
+        # Another batch started while the files were being saved
+        await asyncio.to_thread(batch.cleanup)
+        return queue_full_page(e, back="/batch")
     
-    response.background = BackgroundTask(cleanup_temp)
+    return Titled(
+        "Batch Progress",
+        Container(
+            Card(
+                Grid(
+                    Div(
+                        H4("Documents", cls="font-semibold mb-2"),
+                        P(f"{len(batch.items)} files"),
+                    ),
+                    Div(
+                        H4("Instructions", cls="font-semibold mb-2"),
+                        P(instructions, cls="break-all"),
+                    ),
+                    cols=2,
+                    gap=4,
+                    cls="mb-4"
+                ),
+                Divider(),
+                batch_progress(batch),
+                header=H3("Batch Progress", cls="text-xl font-bold"),
+                cls="max-w-4xl mx-auto mt-5"
+            ),
+            cls=ContainerT.xl
+        )
+    )
+
+
+@rt("/batch/{batch_id}/status")
+def get(batch_id: str, session):
+    """Progress fragment for a batch, polled by the progress page."""
+    batch = batch_store.get(batch_id, session_id(session))
+    if not batch:
+        return P("Batch not found. It may have expired or been downloaded.", id="batch-progress")
+    return batch_progress(batch)
+
+
+@rt("/batch/{batch_id}/download")
+def get(batch_id: str, session):
+    """Download the combined results of a batch, then delete them."""
+    batch = batch_store.get(batch_id, session_id(session))
+    if not batch or batch.archive_path is None or not os.path.exists(batch.archive_path):
+        return Titled(
+            "Error",
+            P("Batch results not found. They may still be processing, or have already been downloaded."),
+            A("Go Back", href="/batch", cls=ButtonT.primary)
+        )
     
-    return response
+    return DownloadResponse(
+        batch.archive_path,
+        on_sent=lambda: delete_batch(batch),
+        filename="contentlens_results.zip",
+        media_type="application/zip"
+    )
+
+
+@rt("/cache-stats")
+def get():
+    """Return the result cache hit/miss counters as JSON."""
+    return JSONResponse(processor.cache.stats())
+
+@rt("/metrics")
+def get():
+    """Stage latencies, sizes, token counts and result and extraction cache counters in the Prometheus text format."""
+    cache = processor.cache.stats()
+    extra = []
+    for name in ("hits", "misses", "coalesced"):
+        extra += [f"# TYPE contentlens_cache_{name}_total counter", f"contentlens_cache_{name}_total {cache[name]}"]
+    extra += ["# TYPE contentlens_cache_entries gauge", f"contentlens_cache_entries {cache['entries']}"]
+    extraction = extraction_cache.stats()
+    for name in ("hits", "misses"):
+        extra += [f"# TYPE contentlens_extraction_cache_{name}_total counter",
+                  f"contentlens_extraction_cache_{name}_total {extraction[name]}"]
+    for name in ("entries", "bytes"):
+        extra += [f"# TYPE contentlens_extraction_cache_{name} gauge",
+                  f"contentlens_extraction_cache_{name} {extraction[name]}"]
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
 
 @rt("/process-another")
-async def get():
+async def get(session):
     """Handle clicking 'Process Another Document' button."""
-    # Clear all documents and their files
-    for file_id, doc_info in list(documents.items()):
-        result_path = doc_info["result_path"]
-        if os.path.exists(result_path):
-            os.remove(result_path)
-            print(f"Deleted result file when starting new process: {result_path}")
-    
-    # Clear the documents dictionary
-    documents.clear()
+    # Clear this session's finished jobs and their files
+    await asyncio.to_thread(clear_session_results, session)
     
     # Redirect to home page
     return RedirectResponse(url="/", status_code=303)
@@ -1,4 +1,16 @@
 from .document import Document
 from .processor import Processor
+from .cache import ResultCache, ExtractionCache
+from .extractors import Extractor, register, extraction_cache
+from .batch import Batch, BatchStore, BATCH_MAX_FILES
+from .jobs import JobStore, JobWorkers, QueueFullError
+from .upload import save_upload, UploadLimit, FileTooLargeError, MAX_UPLOAD_SIZE
+from .download import DownloadResponse, remove_file
+from .pool import WorkerPool
+from .gemini_client import GeminiClient, CircuitOpenError, ContextCaches
+from .doc_sessions import DocumentSessionStore, DOCUMENT_SESSION_TTL
+from .pdf_extract import parse_page_range
+from .compaction import compact_text, truncate_middle
+from .metrics import Trace, span, record_stage, record_usage, render_metrics, UPLOAD_BYTES, RESULT_BYTES
 
-__all__ = ['Document', 'Processor']
\ No newline at end of file
+__all__ = ['Document', 'Processor', 'ResultCache', 'ExtractionCache', 'Extractor', 'register', 'extraction_cache', 'Batch', 'BatchStore', 'BATCH_MAX_FILES', 'JobStore', 'JobWorkers', 'QueueFullError', 'save_upload', 'UploadLimit', 'FileTooLargeError', 'MAX_UPLOAD_SIZE', 'DownloadResponse', 'remove_file', 'WorkerPool', 'GeminiClient', 'CircuitOpenError', 'ContextCaches', 'DocumentSessionStore', 'DOCUMENT_SESSION_TTL', 'parse_page_range', 'compact_text', 'truncate_middle', 'Trace', 'span', 'record_stage', 'record_usage', 'render_metrics', 'UPLOAD_BYTES', 'RESULT_BYTES']
\ No newline at end of file
@@ -0,0 +1,406 @@
+import os
+import copy
+import json
+import math
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+import zipfile
+import mimetypes
+from datetime import datetime
+from .upload import MAX_UPLOAD_SIZE
+from .download import remove_file
+from .jobs import (JOBS_DB, JOB_WORKERS, JOB_LEASE_SECONDS, JOB_MAX_RUNNING, RESULT_TTL, DEFAULT_JOB_SECONDS,
+                   MAX_RETRY_AFTER, QueueFullError)
+
+# Limits for a single batch
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "200"))
+# Batches running at once across all server processes, and per browser session, before new ones are turned away
+BATCH_MAX_RUNNING = int(os.getenv("BATCH_MAX_RUNNING", "4"))
+BATCH_SESSION_MAX_RUNNING = int(os.getenv("BATCH_SESSION_MAX_RUNNING", "1"))
+
+# Strong references to running batch tasks, asyncio only keeps weak ones
+_running = set()
+
+
+class BatchStore:
+    """
+    SQLite-backed registry of batches, shared by every server process.
+    The process running a batch saves a snapshot of it after every change,
+    so any process can report progress or serve the archive. It also keeps
+    renewing a lease on the batch; if the process dies the lease runs out
+    and the sweep fails the files that weren't processed (see abandoned()).
+    New batches are turned away while BATCH_MAX_RUNNING batches (or
+    BATCH_SESSION_MAX_RUNNING of the same session) are running.
+    """
+    def __init__(self, db_path=JOBS_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS batches (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                data TEXT NOT NULL,
+                expires_at REAL,
+                lease_until REAL               -- renewed while the batch runs, NULL once it has finished
+            )
+        """)
+        # Databases created before batches had leases lack the column
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(batches)")}
+        if "lease_until" not in columns:
+            self._conn.execute("ALTER TABLE batches ADD COLUMN lease_until REAL")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def save(self, batch):
+        with self._lock:
+            self._save(batch)
+
+    def _save(self, batch):
+        # Called with self._lock held
+        data = json.dumps({
+            "instructions": batch.instructions,
+            "created": batch.created.isoformat(),
+            "items": batch.items,
+            "archive_path": batch.archive_path,
+        })
+        self._conn.execute(
+            "INSERT OR REPLACE INTO batches (id, session_id, data, expires_at, lease_until) VALUES (?, ?, ?, ?, ?)",
+            (batch.id, batch.session_id, data, batch.expires_at, batch.lease_until)
+        )
+
+    def start(self, batch):
+        """
+        Save a new batch as running. Raises QueueFullError if too many
+        batches are already running, overall or for the batch's session.
+        """
+        with self._lock:
+            # Check and insert in one transaction, so other server processes can't start one in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_admission(batch.session_id)
+                self._save(batch)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def admit(self, session_id):
+        """
+        Check that a batch from session_id could start right now, so a
+        request can be turned away before its files are read. Raises
+        QueueFullError with a retry hint if it couldn't.
+        """
+        with self._lock:
+            self._check_admission(session_id)
+
+    def _check_admission(self, session_id):
+        # Called with self._lock held
+        rows = self._conn.execute(
+            "SELECT session_id, data FROM batches WHERE expires_at IS NULL AND lease_until >= ?", (time.time(),)
+        ).fetchall()
+        own = [row for row in rows if row["session_id"] == session_id]
+        if len(own) >= BATCH_SESSION_MAX_RUNNING:
+            raise QueueFullError(self._retry_after(own), session=True)
+        if len(rows) >= BATCH_MAX_RUNNING:
+            raise QueueFullError(self._retry_after(rows))
+
+    @staticmethod
+    def _retry_after(rows):
+        """Seconds until about the first of the given running batches is done."""
+        remaining = min(sum(item["status"] in ("queued", "processing") for item in json.loads(row["data"])["items"])
+                        for row in rows)
+        seconds = DEFAULT_JOB_SECONDS * remaining / (JOB_MAX_RUNNING or JOB_WORKERS)
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(seconds)))
+
+    def get(self, batch_id, session_id=None):
+        """Return a Batch snapshot, or None. If session_id is given the batch must belong to that session."""
+        row = self._execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if row is None or (session_id is not None and row["session_id"] != session_id):
+            return None
+        data = json.loads(row["data"])
+        batch = Batch(data["instructions"], session_id=row["session_id"], store=self)
+        batch.id = row["id"]
+        batch.created = datetime.fromisoformat(data["created"])
+        batch.items = data["items"]
+        batch.archive_path = data["archive_path"]
+        batch.expires_at = row["expires_at"]
+        batch.lease_until = row["lease_until"]
+        return batch
+
+    def delete(self, batch_id):
+        self._execute("DELETE FROM batches WHERE id = ?", (batch_id,))
+
+    def expired(self):
+        """Batches whose results have outlived RESULT_TTL."""
+        rows = self._execute("SELECT id FROM batches WHERE expires_at < ?", (time.time(),)).fetchall()
+        return [self.get(row["id"]) for row in rows]
+
+    def abandoned(self):
+        """
+        Unfinished batches whose lease has run out because the process
+        running them stopped. Each one is taken over with a fresh lease, so
+        only one process handles it.
+        """
+        now = time.time()
+        rows = self._execute(
+            "SELECT id FROM batches WHERE expires_at IS NULL AND (lease_until IS NULL OR lease_until < ?)", (now,)
+        ).fetchall()
+        batches = []
+        for row in rows:
+            taken = self._execute(
+                "UPDATE batches SET lease_until = ? "
+                "WHERE id = ? AND expires_at IS NULL AND (lease_until IS NULL OR lease_until < ?)",
+                (now + JOB_LEASE_SECONDS, row["id"], now)
+            ).rowcount
+            if taken:
+                batches.append(self.get(row["id"]))
+        return [batch for batch in batches if batch is not None]
+
+
+class Batch:
+    """
+    A set of documents processed with the same instructions.
+    Each file is queued as a job of the batch's session, so the files are
+    claimed fairly alongside everyone else's uploads and count against
+    JOB_MAX_RUNNING. The batch follows its jobs, takes over their results
+    as they finish and builds the archive once they all have. A failure on
+    one file is recorded on that file only, the rest of the batch carries on.
+    """
+    def __init__(self, instructions, session_id=None, store=None):
+        self.id = str(uuid.uuid4())
+        self.instructions = instructions
+        self.session_id = session_id
+        self.store = store
+        self.created = datetime.now()
+
+        # One dict per file: file_name, file_path, file_type, status, error, result_path (and result_key once processed).
+        # The file at index i is processed as the job job_id(i)
+        self.items = []
+        self.task = None
+        self.archive_path = None
+        self.expires_at = None
+        self.lease_until = None
+        self._save_lock = asyncio.Lock()
+
+    def save(self):
+        """Save a snapshot to the store, if there is one."""
+        if self.store is not None:
+            self.store.save(self)
+
+    async def asave(self):
+        """
+        save() in a thread, off the event loop. Saves go one at a time and
+        each writes a copy of the items taken when its turn comes, so other
+        files' progress can't change them mid-write or be overwritten by an
+        older snapshot.
+        """
+        async with self._save_lock:
+            snapshot = copy.copy(self)
+            snapshot.items = [dict(item) for item in self.items]
+            await asyncio.to_thread(snapshot.save)
+
+    def add_file(self, file_path, file_name, file_type=None):
+        """Add a saved file to the batch."""
+        if len(self.items) >= BATCH_MAX_FILES:
+            raise ValueError(f"Too many files. A batch can hold at most {BATCH_MAX_FILES} files.")
+        if not file_type or file_type == 'application/octet-stream':
+            file_type = mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+        self.items.append({
+            "file_name": file_name,
+            "file_path": file_path,
+            "file_type": file_type,
+            "status": "queued",
+            "error": None,
+            "result_path": None,
+        })
+
+    def add_zip(self, zip_path):
+        """Extract every file in a zip archive into the batch, then delete the archive."""
+        try:
+            with zipfile.ZipFile(zip_path) as archive:
+                for info in archive.infolist():
+                    file_name = os.path.basename(info.filename)
+                    # Skip folders and OS metadata
+                    if info.is_dir() or not file_name or file_name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                        continue
+                    if info.file_size > MAX_UPLOAD_SIZE:
+                        raise ValueError(f"{info.filename} is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)}MB.")
+
+                    file_path = f"uploads/{self.id}_{len(self.items)}_{file_name}"
+                    with archive.open(info) as src, open(file_path, "wb") as dst:
+                        # Read at most one byte past the limit, in case the header lied
+                        data = src.read(MAX_UPLOAD_SIZE + 1)
+                        if len(data) > MAX_UPLOAD_SIZE:
+                            raise ValueError(f"{info.filename} is larger than {MAX_UPLOAD_SIZE // (1024 * 1024)}MB.")
+                        dst.write(data)
+                    try:
+                        self.add_file(file_path, file_name)
+                    except ValueError:
+                        os.remove(file_path)
+                        raise
+        finally:
+            if os.path.exists(zip_path):
+                os.remove(zip_path)
+
+    @property
+    def done(self):
+        return all(item["status"] in ("done", "failed") for item in self.items)
+
+    def counts(self):
+        """Number of files in each status."""
+        counts = {"queued": 0, "processing": 0, "done": 0, "failed": 0}
+        for item in self.items:
+            counts[item["status"]] += 1
+        return counts
+
+    def job_id(self, index):
+        """Id of the job processing the file at index."""
+        return f"{self.id}_{index}"
+
+    def update(self, jobs):
+        """
+        Bring the files' statuses up to date with their jobs, as listed by
+        JobStore.batch_jobs(). Returns the ids of the jobs that have
+        finished: their results now belong to the batch, so once it is
+        saved the jobs can be deleted.
+        """
+        jobs = {job["id"]: job for job in jobs}
+        finished = []
+        for index, item in enumerate(self.items):
+            if item["status"] in ("done", "failed"):
+                continue
+            job = jobs.get(self.job_id(index))
+            if job is None:
+                item["status"] = "failed"
+                item["error"] = "Processing was interrupted, please upload this file again"
+            elif job["status"] in ("done", "failed"):
+                item["status"] = job["status"]
+                item["error"] = job["error"]
+                if job["status"] == "done":
+                    item["result_path"] = job["result_path"]
+                    # The cached copy is deleted with the batch's results
+                    item["result_key"] = job["result_key"]
+                finished.append(job["id"])
+            else:
+                item["status"] = "processing" if job["status"] == "running" else "queued"
+        return finished
+
+    async def _follow(self, jobs):
+        counts = self.counts()
+        finished = self.update(await asyncio.to_thread(jobs.batch_jobs, self.id))
+        if finished or self.counts() != counts:
+            await self.asave()
+        await asyncio.to_thread(_delete_jobs, jobs, finished)
+
+    async def run(self, workers):
+        """Follow the files' jobs until they have all finished, then build the archive."""
+        lease = asyncio.create_task(self._keep_lease())
+        try:
+            while not self.done:
+                await asyncio.sleep(workers.poll_interval)
+                try:
+                    await self._follow(workers.store)
+                except Exception as e:
+                    # A locked database or the like, look again next time
+                    print(f"Updating batch {self.id} failed: {e}")
+        finally:
+            lease.cancel()
+        await asyncio.to_thread(self.finish)
+
+    async def _keep_lease(self):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            self.lease_until = time.time() + JOB_LEASE_SECONDS
+            await self.asave()
+
+    def finish(self):
+        """Build the archive and start the clock on the results."""
+        self.archive_path = self.write_archive()
+        self.expires_at = time.time() + RESULT_TTL
+        self.lease_until = None
+        self.save()
+
+    def abandon(self, jobs):
+        """
+        Take the results of the files an interrupted batch had finished, fail
+        the rest and finish it, so its progress page shows the results it has
+        and it expires as usual. jobs is the JobStore.
+        """
+        finished = self.update(jobs.batch_jobs(self.id))
+        for index, item in enumerate(self.items):
+            if item["status"] in ("queued", "processing"):
+                # Without its job a worker still on the file drops the result
+                jobs.delete(self.job_id(index))
+                item["status"] = "failed"
+                item["error"] = "Processing was interrupted, please upload this file again"
+                remove_file(item["file_path"])
+        self.finish()
+        _delete_jobs(jobs, finished)
+
+    async def start(self, workers):
+        """
+        Queue the files as jobs and follow them in the background. workers
+        is the JobWorkers that runs the jobs. Raises QueueFullError if too
+        many batches are running.
+        """
+        self.lease_until = time.time() + JOB_LEASE_SECONDS
+        if self.store is not None:
+            await asyncio.to_thread(self.store.start, self)
+        files = [(self.job_id(index), item["file_path"], item["file_name"], item["file_type"])
+                 for index, item in enumerate(self.items)]
+        await asyncio.to_thread(workers.store.enqueue_batch, self.id, self.session_id, self.instructions, files)
+        workers.notify()
+        self.task = asyncio.create_task(self.run(workers))
+        _running.add(self.task)
+        self.task.add_done_callback(_running.discard)
+        return self.task
+
+    def write_archive(self):
+        """Combine the results into one zip archive, with a list of failures if there were any."""
+        archive_path = f"downloads/{self.id}_results.zip"
+        used_names = set()
+        failures = []
+        with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+            for item in self.items:
+                if item["status"] != "done":
+                    failures.append(f"{item['file_name']}: {item['error']}")
+                    continue
+
+                # Keep names unique when several files share a name
+                name = f"{item['file_name']}_result.md"
+                counter = 1
+                while name in used_names:
+                    counter += 1
+                    name = f"{item['file_name']}_{counter}_result.md"
+                used_names.add(name)
+
+                archive.write(item["result_path"], name)
+                os.remove(item["result_path"])
+                item["result_path"] = None
+
+            if failures:
+                archive.writestr("errors.txt", "\n".join(failures) + "\n")
+        return archive_path
+
+    def cleanup(self):
+        """Delete any files the batch still has on disk."""
+        paths = [self.archive_path]
+        for item in self.items:
+            paths.extend([item["file_path"], item["result_path"]])
+        for path in paths:
+            if path:
+                remove_file(path)
+        if self.store is not None:
+            self.store.delete(self.id)
+
+
+def _delete_jobs(jobs, job_ids):
+    for job_id in job_ids:
+        jobs.delete(job_id)
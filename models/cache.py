@@ -0,0 +1,266 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResultCache:
+    """
+    Content-addressed cache for LLM results.
+    Entries live in a size-bounded in-memory LRU, optionally backed by an
+    on-disk store with TTL eviction. Identical requests that arrive while a
+    call is in flight wait on that call instead of issuing their own
+    (single-flight). A result's entry is deleted along with the result
+    (see delete()), and in-memory entries are never kept longer than
+    finished results are (RESULT_TTL).
+    """
+    def __init__(self, max_entries=None, ttl=None, cache_dir=None, max_age=None):
+        if max_entries is None:
+            max_entries = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+        if ttl is None:
+            ttl = int(os.getenv("RESULT_CACHE_TTL", "0"))
+        if cache_dir is None:
+            cache_dir = os.getenv("RESULT_CACHE_DIR", "cache")
+        if max_age is None:
+            max_age = int(os.getenv("RESULT_TTL", "3600"))
+
+        self.max_entries = max_entries
+        self.ttl = ttl  # seconds, 0 disables the on-disk store
+        self.max_age = max_age  # seconds an in-memory entry is kept
+        self.cache_dir = cache_dir
+        if self.ttl > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._last_sweep = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(content_hash, instructions, model_name):
+        """Build a cache key from the content hash, normalized instructions and model name."""
+        normalized = " ".join(instructions.split()).lower()
+        return hashlib.sha256(f"{model_name}\0{content_hash}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.md")
+
+    def get(self, key):
+        """Return the cached result for key, or None. Counts a hit or a miss."""
+        with self._lock:
+            if key in self._entries:
+                result, stored = self._entries[key]
+                if time.time() - stored <= self.max_age:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return result
+                del self._entries[key]
+
+        result = self._read_disk(key)
+        with self._lock:
+            if result is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, result)
+        return result
+
+    def put(self, key, result):
+        """Store a result in memory and on disk."""
+        with self._lock:
+            self._remember(key, result)
+        self._write_disk(key, result)
+
+    def _remember(self, key, result):
+        # Caller must hold self._lock
+        self._entries[key] = (result, time.time())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Forget a result, in memory and on disk (in this process; other processes' memory ages out)."""
+        if key is None:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.ttl > 0:
+            try:
+                os.remove(self._disk_path(key))
+            except FileNotFoundError:
+                pass
+
+    def _read_disk(self, key):
+        if self.ttl <= 0:
+            return None
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write_disk(self, key, result):
+        if self.ttl <= 0:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(result)
+        os.replace(temp_path, path)
+        self._sweep()
+
+    def _sweep(self):
+        """Delete expired files from the on-disk store (at most once a minute)."""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for entry in os.scandir(self.cache_dir):
+            try:
+                if now - entry.stat().st_mtime > self.ttl:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def join(self, key):
+        """Return the future of an identical call already in flight, or None."""
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+        return future
+
+    def start(self, key):
+        """Register a new in-flight call for key."""
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        return future
+
+    def finish(self, key, result=None, error=None):
+        """Resolve the in-flight call for key, caching the result if it succeeded."""
+        future = self._inflight.pop(key, None)
+        if error is None:
+            self.put(key, result)
+        if future is None or future.done():
+            return
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+            # Mark as retrieved so an unawaited failure isn't logged
+            future.exception()
+
+    async def get_or_compute(self, key, compute):
+        """Return the cached result for key, or await compute() exactly once for concurrent callers."""
+        result = self.get(key)
+        if result is not None:
+            return result
+
+        future = self.join(key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        self.start(key)
+        try:
+            result = await compute()
+        except Exception as e:
+            self.finish(key, error=e)
+            raise
+        except BaseException:
+            self.finish(key, error=RuntimeError("Processing was cancelled"))
+            raise
+        self.finish(key, result)
+        return result
+
+    def stats(self):
+        """Return the cache counters."""
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+
+class ExtractionCache:
+    """
+    In-memory LRU of extracted documents keyed by the content hash of the
+    file, so a file uploaded again is not parsed again. Bounded by the
+    size of the text and page images it holds rather than by entries.
+    """
+    def __init__(self, max_bytes=None):
+        if max_bytes is None:
+            max_bytes = int(os.getenv("EXTRACTION_CACHE_SIZE", str(64 * 1024 * 1024)))
+
+        self.max_bytes = max_bytes  # 0 disables the cache
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(content_hash, file_type, pages=None):
+        """Build a cache key from the content hash, the type the file is read as and the PDF page range."""
+        pages = "".join(pages.split()) if pages else ""
+        return hashlib.sha256(f"{content_hash}\0{file_type}\0{pages}".encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Return (text, page_images) for key, or None. Counts a hit or a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            text, page_images, _ = entry
+        return text, list(page_images)
+
+    def put(self, key, text, page_images=()):
+        """Store an extraction result, evicting the least recently used ones to stay within max_bytes."""
+        page_images = tuple(page_images)
+        size = sys.getsizeof(text) + sum(len(data) for _, _, data in page_images)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.bytes -= self._entries.pop(key)[2]
+            self._entries[key] = (text, page_images, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self.bytes -= self._entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        """Return the cache counters."""
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+        }
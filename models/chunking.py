@@ -0,0 +1,76 @@
+import re
+
+# Blank lines separate paragraphs
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def _is_heading(block):
+    """Markdown-style headings start a new section."""
+    return block.lstrip().startswith("#")
+
+
+def _split_block(block, max_chars):
+    """Split a block that is too big on its own, first by lines then by characters."""
+    if len(block) <= max_chars:
+        return [block]
+
+    pieces = []
+    current = ""
+    for line in block.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(line[:max_chars])
+            line = line[max_chars:]
+        if current and len(current) + len(line) + 1 > max_chars:
+            pieces.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text, max_chars, overlap_chars=0):
+    """
+    Split text into chunks of at most max_chars on paragraph and heading boundaries.
+    Each chunk starts with up to overlap_chars of trailing paragraphs from the
+    previous chunk so context isn't lost at the seams.
+    """
+    blocks = []
+    for block in PARAGRAPH_BREAK.split(text):
+        if block.strip():
+            blocks.extend(_split_block(block, max_chars))
+
+    chunks = []
+    current = []
+    size = 0
+    for block in blocks:
+        # Start a new chunk when this block doesn't fit, or at a heading once the chunk is half full
+        full = size + len(block) + 2 > max_chars
+        at_heading = _is_heading(block) and size > max_chars // 2
+        if current and (full or at_heading):
+            chunks.append("\n\n".join(current))
+
+            # Carry trailing paragraphs over as overlap
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + len(previous) + 2 > overlap_chars:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += len(previous) + 2
+            if overlap_size + len(block) + 2 > max_chars:
+                overlap, overlap_size = [], 0
+
+            current = overlap
+            size = overlap_size
+
+        current.append(block)
+        size += len(block) + 2
+
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
@@ -0,0 +1,169 @@
+import os
+import re
+from collections import Counter
+from .gemini_client import estimate_tokens
+
+# Compaction settings
+PROMPT_COMPACTION = os.getenv("PROMPT_COMPACTION", "true").lower() == "true"
+# Hard cap on a document's tokens in the prompt, the middle is cut out above it (0 = no cap)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "0"))
+# Short lines repeated this often at page or section boundaries (running headers, footers) are kept once
+COMPACTION_MIN_REPEATS = int(os.getenv("COMPACTION_MIN_REPEATS", "3"))
+
+# Lines and blocks at least this long are kept once even if they only repeat once
+LONG_REPEAT_CHARS = 200
+# Share of the token budget kept from the start of the document, the rest comes from the end
+HEAD_SHARE = 2 / 3
+
+# Zero-width characters are dropped, non-breaking and other odd spaces become plain spaces
+INVISIBLE = {0x200B: None, 0x200C: None, 0x200D: None, 0x2060: None, 0xFEFF: None, 0x00AD: None,
+             0x00A0: " ", 0x2007: " ", 0x202F: " ", 0x3000: " "}
+INNER_SPACES = re.compile(r"(?<=\S)[ \t]{2,}")
+BLANK_RUNS = re.compile(r"\n{3,}")
+FENCE = re.compile(r"^\s*(```|~~~)")
+
+# Markdown noise: its removal doesn't change what the document says
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+DATA_IMAGE = re.compile(r"!\[([^\]]*)\]\(data:[^)]*\)")
+HORIZONTAL_RULE = re.compile(r"^ {0,3}([-*_])( *\1){2,} *$")
+TABLE_RULE = re.compile(r"^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)+\|?\s*$")
+HEADING_CLOSE = re.compile(r"^(#{1,6} .*?) +#+ *$")
+STRONG = re.compile(r"(\*\*|__)(?=\S)(.+?)(?<=\S)\1")
+
+# Lines that carry structure (headings, list items, quotes, table rows) are never deduplicated
+STRUCTURAL = re.compile(r"^(#|[-*+>] |\d+[.)] )|\|")
+# Page markers of extracted PDFs, see models/pdf_extract.py
+PAGE_MARKER = re.compile(r"^\[Page \d+\]$")
+
+
+def _markdown_line(line):
+    """Strip markdown noise from one line. Returns None for lines that can go entirely."""
+    if HORIZONTAL_RULE.match(line):
+        return None
+    if TABLE_RULE.match(line):
+        return "|" + "|".join("-" for _ in range(line.strip().strip("|").count("|") + 1)) + "|"
+    line = HEADING_CLOSE.sub(r"\1", line)
+    return STRONG.sub(r"\2", line)
+
+
+def _normalize_lines(lines, markdown):
+    """Trailing and repeated inner whitespace, plus markdown noise. Code blocks only lose trailing whitespace."""
+    in_code = False
+    for line in lines:
+        line = line.rstrip()
+        if FENCE.match(line):
+            in_code = not in_code
+        elif not in_code:
+            line = INNER_SPACES.sub(" ", line)
+            if markdown:
+                line = _markdown_line(line)
+                if line is None:
+                    continue
+        yield line
+
+
+def _boundary_lines(lines):
+    """
+    Indexes of the lines at a page or section boundary: the first and last
+    line of each block, where blocks are separated by blank lines, "[Page N]"
+    markers, form feeds and headings. Indented lines and code blocks are
+    never boundaries, so repeated code and log or data lines are left alone.
+    """
+    boundaries = set()
+    block = []
+
+    def close():
+        if block:
+            boundaries.update((block[0], block[-1]))
+            block.clear()
+
+    in_code = False
+    for index, line in enumerate(lines):
+        key = line.strip()
+        if FENCE.match(line):
+            in_code = not in_code
+            close()
+        elif in_code:
+            continue
+        elif not key or "\f" in line or PAGE_MARKER.match(key) or key.startswith("#"):
+            close()
+        else:
+            block.append(index)
+    close()
+    return {index for index in boundaries if not lines[index][:1].isspace()}
+
+
+def _dedupe_lines(lines, min_repeats):
+    """
+    Drop repeats of running headers, footers and other boilerplate: plain
+    lines at a page or section boundary that occur there at least
+    min_repeats times, or twice if they are long. The first occurrence is
+    kept, and lines anywhere else are never dropped.
+    """
+    boundaries = _boundary_lines(lines)
+    counts = Counter(lines[index].strip() for index in boundaries)
+    seen = set()
+    for index, line in enumerate(lines):
+        key = line.strip()
+        if index in boundaries and not STRUCTURAL.match(key):
+            repeated = counts[key] >= min_repeats or (counts[key] > 1 and len(key) >= LONG_REPEAT_CHARS)
+            if repeated and key in seen:
+                continue
+            seen.add(key)
+        yield line
+
+
+def _dedupe_blocks(text):
+    """Drop later copies of long blocks (paragraphs separated by blank lines)."""
+    seen = set()
+    blocks = []
+    for block in text.split("\n\n"):
+        if len(block) >= LONG_REPEAT_CHARS:
+            if block in seen:
+                continue
+            seen.add(block)
+        blocks.append(block)
+    return "\n\n".join(blocks)
+
+
+def truncate_middle(text, budget):
+    """
+    Cut text down to about `budget` tokens, keeping its start and end on
+    line boundaries with a marker where the middle was taken out.
+    """
+    tokens = estimate_tokens(text)
+    if budget <= 0 or tokens <= budget:
+        return text
+    chars = len(text) * budget // tokens
+    head = text[:int(chars * HEAD_SHARE)]
+    tail = text[len(text) - (chars - len(head)):]
+    # Don't cut lines in half unless they are very long
+    if "\n" in head[len(head) // 2:]:
+        head = head[:head.rindex("\n")]
+    if "\n" in tail[:len(tail) // 2]:
+        tail = tail[tail.index("\n") + 1:]
+    omitted = tokens - estimate_tokens(head) - estimate_tokens(tail)
+    return f"{head}\n\n[... about {omitted} tokens omitted ...]\n\n{tail}"
+
+
+def compact_text(text, markdown=False, dedupe=True, budget=PROMPT_TOKEN_BUDGET, min_repeats=COMPACTION_MIN_REPEATS):
+    """
+    Deterministically shrink a document's text before it goes into a prompt:
+    normalize whitespace, drop repeated lines and blocks, strip markdown
+    noise (if markdown) and cut the middle out of anything over the token
+    budget. Returns (text, estimated tokens before, estimated tokens after).
+    """
+    before = estimate_tokens(text)
+    text = text.translate(INVISIBLE).replace("\r\n", "\n").replace("\r", "\n")
+    if markdown:
+        text = HTML_COMMENT.sub("", text)
+        text = DATA_IMAGE.sub(lambda match: f"[image: {match.group(1)}]" if match.group(1) else "[image]", text)
+
+    lines = list(_normalize_lines(text.split("\n"), markdown))
+    if dedupe:
+        lines = list(_dedupe_lines(lines, min_repeats))
+    text = BLANK_RUNS.sub("\n\n", "\n".join(lines)).strip("\n")
+    if dedupe:
+        text = _dedupe_blocks(text)
+    text = truncate_middle(text, budget)
+    return text, before, estimate_tokens(text)
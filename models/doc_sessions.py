@@ -0,0 +1,88 @@
+import os
+import time
+import sqlite3
+import threading
+from .jobs import JOBS_DB
+
+# Seconds an uploaded document is kept for follow-up questions
+DOCUMENT_SESSION_TTL = int(os.getenv("DOCUMENT_SESSION_TTL", "1800"))
+
+
+class DocumentSessionStore:
+    """
+    SQLite-backed store for documents kept for follow-up questions.
+    A document session holds the uploaded file, its extracted text (saved
+    to text_path after the first job extracts it) and the name of the
+    Gemini context cache holding it (NULL until the first job has tried to
+    create one, "" if the document isn't cached). Sessions belong to a
+    browser session and expire DOCUMENT_SESSION_TTL seconds after upload.
+    """
+    def __init__(self, db_path=JOBS_DB, ttl=DOCUMENT_SESSION_TTL):
+        self.db_path = db_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS document_sessions (
+                id TEXT PRIMARY KEY,
+                session_id TEXT,
+                file_path TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_type TEXT,
+                content_hash TEXT,
+                pages TEXT,
+                text_path TEXT,
+                cache_name TEXT,
+                created_at REAL NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        """)
+        # Databases created before page ranges were added lack the column
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(document_sessions)")}
+        if "pages" not in columns:
+            self._conn.execute("ALTER TABLE document_sessions ADD COLUMN pages TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS document_sessions_session ON document_sessions (session_id)")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def create(self, document_id, file_path, file_name, file_type, content_hash=None, session_id=None, pages=None):
+        """Keep an uploaded document (or the given page range of a PDF) for follow-up questions."""
+        now = time.time()
+        self._execute(
+            "INSERT INTO document_sessions (id, session_id, file_path, file_name, file_type, content_hash, "
+            "pages, created_at, expires_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (document_id, session_id, file_path, file_name, file_type, content_hash, pages, now, now + self.ttl)
+        )
+        return document_id
+
+    def get(self, document_id, session_id=None):
+        """Return a live document session as a dict, or None. If session_id is given it must match."""
+        row = self._execute(
+            "SELECT * FROM document_sessions WHERE id = ? AND expires_at >= ?", (document_id, time.time())
+        ).fetchone()
+        if row is None or (session_id is not None and row["session_id"] != session_id):
+            return None
+        return dict(row)
+
+    def set_text(self, document_id, text_path):
+        self._execute("UPDATE document_sessions SET text_path = ? WHERE id = ?", (text_path, document_id))
+
+    def set_cache(self, document_id, cache_name):
+        self._execute("UPDATE document_sessions SET cache_name = ? WHERE id = ?", (cache_name, document_id))
+
+    def delete(self, document_id):
+        """Delete a document session. Returns False if it was already gone."""
+        return self._execute("DELETE FROM document_sessions WHERE id = ?", (document_id,)).rowcount > 0
+
+    def for_session(self, session_id):
+        """Document sessions of a browser session."""
+        rows = self._execute("SELECT * FROM document_sessions WHERE session_id = ?", (session_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def expired(self):
+        rows = self._execute("SELECT * FROM document_sessions WHERE expires_at < ?", (time.time(),)).fetchall()
+        return [dict(row) for row in rows]
@@ -1,10 +1,8 @@
 import os 
 import uuid
 from datetime import datetime
-from PIL import Image
-import json 
-import markdown
-import docx
+from .cache import ExtractionCache
+from .extractors import extraction_cache, file_hash, select_extractor
 
 
 class Document:
@@ -12,7 +10,7 @@ class Document:
     Document class for handling different types of documents.
     Uses a task-based approach where files are processed and then deleted.
     """
-    def __init__(self, file_path, file_name, file_type):
+    def __init__(self, file_path, file_name, file_type, content_hash=None, pages=None):
         # Generate a unique ID for this document
         self.id = str(uuid.uuid4())
         
@@ -20,6 +18,8 @@ class Document:
         self.file_path = file_path # Where the file is saved on disk
         self.file_name = file_name # Original name of the file
         self.file_type = file_type # MIME type (e.g., 'text/plain', 'application/pdf')
+        self.content_hash = content_hash # SHA-256 of the file bytes, computed during upload
+        self.pages = pages # Page range to extract from a PDF (e.g. '1-5, 8'), None for every page
         
         # Record when this document was uploaded
         self.upload_time = datetime.now()
@@ -27,60 +27,70 @@ class Document:
         # Placeholders for content that will be extracted
         self.content = None
         self.extracted_text = None
+        self.compacted = False # Whether extracted_text has been compacted for prompts
+        self.page_images = [] # (page number, mime_type, bytes) of scanned PDF pages
+        self.extractor = None # Extractor picked for the file, see models/extractors.py
+        self.extract_error = None # Why extraction failed, if it did
+        self.result_key = None # Result cache key, set when the document is processed
         
     # Add this import at the top of the file
 
-    def extract_text(self):
-        """Extract text content from the document based on its type."""
+    def extract_text(self, cached=True):
+        """
+        Extract text content from the document with the extractor for its
+        type. Results are kept in the extraction cache by content hash, so a
+        file seen before isn't parsed again (cached=False skips the cache).
+        """
         try:
-            # Check if we need to determine the file type from extension
-            if self.file_type == 'application/octet-stream':
-                # Try to determine type from file extension
-                if self.file_name.endswith('.md') or self.file_name.endswith('.markdown'):
-                    self.file_type = 'text/markdown'
-                elif self.file_name.endswith('.txt'):
-                    self.file_type = 'text/plain'
-                elif self.file_name.endswith('.json'):
-                    self.file_type = 'application/json'
-                elif self.file_name.endswith('.docx'):
-                    self.file_type = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            
-            # For text-based files (plain text, markdown, etc.)
-            if self.file_type in ['text/plain', 'text/markdown']:
-                with open(self.file_path, 'r', encoding='utf-8') as file:
-                    self.extracted_text = file.read()
-                    
-            # For JSON files
-            elif self.file_type == 'application/json':
-                with open(self.file_path, 'r', encoding='utf-8') as file:
-                    data = json.load(file)
-                    # Convert JSON to a formatted string
-                    self.extracted_text = json.dumps(data, indent=2)
-            
-            # For Word (docx) files
-            elif self.file_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' or self.file_name.endswith('.docx'):
-                doc = docx.Document(self.file_path)
-                full_text = []
-                for para in doc.paragraphs:
-                    full_text.append(para.text)
-                self.extracted_text = '\n'.join(full_text)
-                    
-            # For image files
-            elif self.file_type.startswith('image/'):
-                # For images, we'll rely on the LLM to describe the image
-                self.extracted_text = f"[Image: {self.file_name}]"
-                
+            self.find_extractor()
+            key = self.cache_key() if cached else None
+
             # For unsupported file types
-            else:
+            if self.extractor is None:
                 self.extracted_text = f"Unsupported file type: {self.file_type}"
-                
+                return self.extracted_text
+
+            if key is None or not self.load_cached(key):
+                self.extractor.extract(self)
+                if key is not None:
+                    self.store_cached(key)
             return self.extracted_text
             
         except Exception as e:
             # Handle any errors during extraction
+            self.extract_error = str(e)
             self.extracted_text = f"Error extracting text: {str(e)}"
             return self.extracted_text
 
+    def find_extractor(self):
+        """Pick the extractor for the file by its content, type and name, and settle file_type from it."""
+        self.extractor, self.file_type = select_extractor(self.file_path, self.file_name, self.file_type)
+        return self.extractor
+
+    def cache_key(self):
+        """
+        The document's extraction cache key, hashing the file if it wasn't
+        hashed on upload. None if its extractor's results aren't cached.
+        """
+        if self.extractor is None or not self.extractor.cacheable or extraction_cache.max_bytes <= 0:
+            return None
+        if self.content_hash is None:
+            self.content_hash = file_hash(self.file_path)
+        return ExtractionCache.make_key(self.content_hash, self.file_type, self.pages)
+
+    def load_cached(self, key):
+        """Fill in the extracted text from the extraction cache, returns whether it was there."""
+        cached = extraction_cache.get(key)
+        if cached is None:
+            return False
+        self.extracted_text, self.page_images = cached
+        return True
+
+    def store_cached(self, key):
+        """Keep the extracted text in the extraction cache, unless extraction failed."""
+        if self.extract_error is None and self.extracted_text is not None:
+            extraction_cache.put(key, self.extracted_text, self.page_images)
+
 
     
     def cleanup(self):
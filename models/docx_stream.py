@@ -0,0 +1,148 @@
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+
+# Parts of a .docx that hold text besides the main document body
+RELS_PATH = "word/_rels/document.xml.rels"
+NOTE_PARTS = (("word/footnotes.xml", "Footnotes"), ("word/endnotes.xml", "Endnotes"))
+
+
+def _local(tag):
+    """Tag name without its namespace, so transitional and strict OOXML both match."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _attr(elem, name):
+    """Attribute value by local name, whatever its namespace."""
+    for key, value in elem.attrib.items():
+        if _local(key) == name:
+            return value
+    return None
+
+
+def iter_paragraphs(stream):
+    """
+    Stream-parse one WordprocessingML part and yield its paragraphs as text.
+    Each table row is yielded as one line with its cells separated by " | ",
+    nested tables are flattened into the cell that holds them. Elements are
+    dropped as soon as they have been read, so memory stays flat however
+    large the part is.
+    """
+    stack = []            # Open elements, so finished ones can be removed from their parent
+    paragraphs = []       # Text pieces of each open paragraph (text boxes nest paragraphs)
+    runs = 0              # Depth of w:r elements, tabs and breaks only count inside a run
+    fallback = 0          # Depth of mc:Fallback, which repeats the content of mc:Choice
+    tables = 0
+    row, cell = [], []
+    note_id = None
+
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        tag = _local(elem.tag)
+
+        if event == "start":
+            stack.append(elem)
+            if tag == "Fallback":
+                fallback += 1
+            elif fallback:
+                continue
+            elif tag == "p":
+                paragraphs.append([])
+            elif tag == "r":
+                runs += 1
+            elif tag == "tbl":
+                tables += 1
+            elif tag in ("footnote", "endnote"):
+                note_id = _attr(elem, "id")
+            continue
+
+        stack.pop()
+        if tag == "Fallback":
+            fallback -= 1
+        elif fallback:
+            continue
+        elif tag == "t" and paragraphs:
+            paragraphs[-1].append(elem.text or "")
+        elif tag == "tab" and runs and paragraphs:
+            paragraphs[-1].append("\t")
+        elif tag in ("br", "cr") and runs and paragraphs:
+            paragraphs[-1].append("\n")
+        elif tag == "r":
+            runs -= 1
+        elif tag == "p":
+            text = "".join(paragraphs.pop())
+            if note_id is not None and text:
+                # Number the first paragraph of each footnote
+                text = f"[{note_id}] {text}"
+                note_id = None
+            if paragraphs:
+                # A paragraph inside a text box belongs to the enclosing paragraph
+                paragraphs[-1].append(text)
+            elif tables:
+                cell.append(text)
+            else:
+                yield text
+        elif tag == "tc" and tables == 1:
+            row.append(" ".join(text for text in cell if text))
+            cell = []
+        elif tag == "tr" and tables == 1:
+            if any(row):
+                yield " | ".join(row)
+            row = []
+        elif tag == "tbl":
+            tables -= 1
+        elif tag in ("footnote", "endnote"):
+            note_id = None
+
+        # Finished top-level paragraphs, tables and table rows are dropped from the tree
+        top_level = tag in ("p", "tbl") and not tables or tag == "tr" and tables == 1
+        if top_level and not paragraphs and stack:
+            elem.clear()
+            stack[-1].remove(elem)
+
+
+def _header_footer_parts(archive):
+    """Header and footer part names in the order the document references them."""
+    headers, footers = [], []
+    try:
+        with archive.open(RELS_PATH) as rels:
+            for _, elem in ET.iterparse(rels):
+                kind = (elem.get("Type") or "").rsplit("/", 1)[-1]
+                if _local(elem.tag) == "Relationship" and kind in ("header", "footer"):
+                    target = posixpath.normpath(posixpath.join("word", elem.get("Target", "")))
+                    (headers if kind == "header" else footers).append(target.lstrip("/"))
+    except KeyError:
+        pass
+    return headers, footers
+
+
+def _iter_labelled(archive, names, label):
+    """Yield the non-empty paragraphs of several small parts under one label, skipping repeated parts."""
+    seen = set()
+    lines = []
+    for name in names:
+        try:
+            with archive.open(name) as part:
+                text = [line for line in iter_paragraphs(part) if line.strip()]
+        except KeyError:
+            continue
+        if text and tuple(text) not in seen:
+            seen.add(tuple(text))
+            lines.extend(text)
+    if lines:
+        yield f"[{label}]"
+        yield from lines
+
+
+def iter_docx_text(file_path):
+    """
+    Yield the text of a .docx file line by line, in reading order:
+    headers, the document body (tables included), footnotes, endnotes, footers.
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        headers, footers = _header_footer_parts(archive)
+        yield from _iter_labelled(archive, headers, "Header")
+        with archive.open("word/document.xml") as body:
+            yield from iter_paragraphs(body)
+        for name, label in NOTE_PARTS:
+            yield from _iter_labelled(archive, [name], label)
+        yield from _iter_labelled(archive, footers, "Footer")
@@ -0,0 +1,49 @@
+import os
+import asyncio
+from starlette.responses import FileResponse, Response
+
+
+class DownloadResponse(FileResponse):
+    """
+    Serve a result file straight from disk and run on_sent (in a thread, it
+    usually deletes files and database rows) once the whole body has
+    reached the client. Range requests, HEAD requests and
+    interrupted downloads leave the file in place so the client can resume.
+    Starlette provides the ETag, Last-Modified and Range handling, this adds
+    If-None-Match so a client that already has the file gets a 304.
+    """
+    def __init__(self, path, on_sent=None, **kwargs):
+        super().__init__(path, stat_result=os.stat(path), **kwargs)
+        self.on_sent = on_sent
+
+    async def __call__(self, scope, receive, send):
+        if_none_match = [tag.strip() for tag in dict(scope["headers"]).get(b"if-none-match", b"").decode("latin-1").split(",")]
+        if self.headers["etag"] in if_none_match or "*" in if_none_match:
+            headers = {name: self.headers[name] for name in ("etag", "last-modified") if name in self.headers}
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+
+        sent = {"status": None, "complete": False}
+
+        async def tracking_send(message):
+            await send(message)
+            if message["type"] == "http.response.start":
+                sent["status"] = message["status"]
+            elif message["type"] == "http.response.pathsend" or (
+                message["type"] == "http.response.body" and not message.get("more_body", False)
+            ):
+                sent["complete"] = True
+
+        await super().__call__(scope, receive, tracking_send)
+        full_body = scope["method"].upper() == "GET" and sent["status"] == 200
+        if full_body and sent["complete"] and self.on_sent is not None:
+            await asyncio.to_thread(self.on_sent)
+
+
+def remove_file(path):
+    """Delete a file if it still exists. Returns True if this call removed it."""
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,199 @@
+import os
+import hashlib
+import zipfile
+from .cache import ExtractionCache
+
+# Bytes read from the start of a file to recognize its format
+SNIFF_SIZE = 8 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# Extraction results of files seen before, per server process
+extraction_cache = ExtractionCache()
+
+
+class Extractor:
+    """
+    Turns one kind of file into text. A subclass lists the MIME types and
+    file extensions it handles, and can recognize its files from their
+    first bytes with sniff(). Whatever library it needs is imported in
+    extract(), so a process only loads the ones for files it has seen.
+    """
+    name = None
+    file_types = ()  # MIME types handled
+    extensions = {}  # extension -> MIME type, for files uploaded without a useful type
+    cacheable = True  # whether results go into the extraction cache
+
+    def handles(self, file_type):
+        return file_type in self.file_types
+
+    def sniff(self, head, file_path):
+        """The file's MIME type if head (its first SNIFF_SIZE bytes) is one of this extractor's files, else None."""
+        return None
+
+    def extract(self, document):
+        """Set document.extracted_text (and document.page_images). Errors are raised."""
+        raise NotImplementedError
+
+
+EXTRACTORS = []
+EXTRACTORS_BY_NAME = {}
+
+
+def register(cls):
+    """Class decorator adding an extractor to the registry. Formats are sniffed in registration order."""
+    extractor = cls()
+    EXTRACTORS.append(extractor)
+    EXTRACTORS_BY_NAME[extractor.name] = extractor
+    return cls
+
+
+@register
+class PdfExtractor(Extractor):
+    name = "pdf"
+    file_types = ('application/pdf',)
+    extensions = {'.pdf': 'application/pdf'}
+
+    def sniff(self, head, file_path):
+        return 'application/pdf' if head.lstrip().startswith(b"%PDF-") else None
+
+    def extract(self, document):
+        # Only the requested pages are parsed, one at a time; scanned pages are rendered as images
+        from .pdf_extract import iter_pdf_pages, join_pages, page_count, select_pages
+
+        pages = select_pages(document.pages, page_count(document.file_path)) if document.pages else None
+        document.extracted_text, document.page_images = join_pages(iter_pdf_pages(document.file_path, pages))
+
+
+@register
+class DocxExtractor(Extractor):
+    name = "docx"
+    file_types = (DOCX_TYPE,)
+    extensions = {'.docx': DOCX_TYPE}
+
+    def sniff(self, head, file_path):
+        if not head.startswith(b"PK\x03\x04"):
+            return None
+        # Any Office file is a zip, a Word document is the one with a word/document.xml part
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                archive.getinfo("word/document.xml")
+        except (zipfile.BadZipFile, KeyError):
+            return None
+        return DOCX_TYPE
+
+    def extract(self, document):
+        # Stream-parse the zip, including tables, headers, footers and footnotes
+        from .docx_stream import iter_docx_text
+
+        document.extracted_text = '\n'.join(iter_docx_text(document.file_path))
+
+
+@register
+class ImageExtractor(Extractor):
+    name = "image"
+    file_types = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/heic', 'image/heif')
+    extensions = {'.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.gif': 'image/gif',
+                  '.webp': 'image/webp', '.heic': 'image/heic', '.heif': 'image/heif'}
+    # The text only names the file, the image itself is sent to Gemini
+    cacheable = False
+
+    def handles(self, file_type):
+        return file_type.startswith('image/')
+
+    def sniff(self, head, file_path):
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return 'image/png'
+        if head.startswith(b"\xff\xd8\xff"):
+            return 'image/jpeg'
+        if head[:6] in (b"GIF87a", b"GIF89a"):
+            return 'image/gif'
+        if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+            return 'image/webp'
+        if head[4:8] == b"ftyp":
+            brand = head[8:12]
+            if brand in (b"heic", b"heix"):
+                return 'image/heic'
+            if brand in (b"mif1", b"msf1", b"heif"):
+                return 'image/heif'
+        return None
+
+    def extract(self, document):
+        # For images, we'll rely on the LLM to describe the image
+        document.extracted_text = f"[Image: {document.file_name}]"
+
+
+@register
+class JsonExtractor(Extractor):
+    name = "json"
+    file_types = ('application/json',)
+    extensions = {'.json': 'application/json'}
+
+    def extract(self, document):
+        # Walk the file incrementally into compact JSON or path: value lines
+        from .json_stream import iter_json_text
+
+        document.extracted_text = ''.join(iter_json_text(document.file_path))
+
+
+@register
+class TextExtractor(Extractor):
+    name = "text"
+    file_types = ('text/plain', 'text/markdown')
+    extensions = {'.txt': 'text/plain', '.md': 'text/markdown', '.markdown': 'text/markdown'}
+
+    def extract(self, document):
+        # Memory-mapped and decoded in chunks, in whatever encoding the file is in
+        from .text_stream import read_text
+
+        document.extracted_text = read_text(document.file_path)
+
+
+def _looks_like_text(head):
+    from .text_stream import BOMS
+
+    return b"\0" not in head or any(head.startswith(bom) for bom, _ in BOMS)
+
+
+def select_extractor(file_path, file_name, file_type):
+    """
+    Pick the extractor for a file, returns (extractor, MIME type). The
+    file's first bytes decide first, since browsers go by the extension
+    when they send a type: a PDF renamed to .txt is still read as a PDF.
+    Formats without a signature (JSON, Markdown, text) go by the type
+    the file was uploaded with, then by its extension, and text/* or
+    untyped files that look like text are read as plain text. The
+    extractor is None if nothing fits.
+    """
+    with open(file_path, "rb") as f:
+        head = f.read(SNIFF_SIZE)
+
+    for extractor in EXTRACTORS:
+        sniffed = extractor.sniff(head, file_path)
+        if sniffed is not None:
+            return extractor, sniffed
+
+    if file_type and file_type != 'application/octet-stream':
+        for extractor in EXTRACTORS:
+            if extractor.handles(file_type):
+                return extractor, file_type
+
+    extension = os.path.splitext(file_name)[1].lower()
+    for extractor in EXTRACTORS:
+        if extension in extractor.extensions:
+            return extractor, extractor.extensions[extension]
+
+    if (not file_type or file_type == 'application/octet-stream' or file_type.startswith('text/')) \
+            and _looks_like_text(head):
+        return EXTRACTORS_BY_NAME["text"], 'text/plain'
+    return None, file_type
+
+
+def file_hash(file_path):
+    """SHA-256 hex digest of a file, read a chunk at a time."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,381 @@
+import os
+import time
+import random
+import asyncio
+import datetime
+import threading
+from .metrics import Counter, record_stage
+
+# Quota of the Gemini project, 0 turns a limit off. The limits are per server process.
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "2000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "4000000"))
+# Seconds to wait for a response (or for the next chunk of a streamed one)
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "120"))
+# Retries of transient errors, with jittered exponential backoff starting at GEMINI_RETRY_BACKOFF seconds
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", "3"))
+GEMINI_RETRY_BACKOFF = float(os.getenv("GEMINI_RETRY_BACKOFF", "1"))
+MAX_BACKOFF = 30
+# Start a second copy of a call that hasn't answered after this many seconds, 0 = off
+GEMINI_HEDGE_AFTER = float(os.getenv("GEMINI_HEDGE_AFTER", "0"))
+# Fail fast for GEMINI_BREAKER_COOLDOWN seconds after this many failed calls in a row, 0 = off
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_COOLDOWN = float(os.getenv("GEMINI_BREAKER_COOLDOWN", "30"))
+
+# Context caching needs an explicitly versioned model and a minimum prompt size
+CONTEXT_CACHE_MODEL = os.getenv("CONTEXT_CACHE_MODEL", "models/gemini-2.0-flash-001")
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "4096"))
+
+# HTTP statuses worth retrying: timeouts, rate limiting and server errors
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+# Gemini bills an image as a fixed number of tokens
+IMAGE_TOKENS = 258
+
+GEMINI_EVENTS = Counter("contentlens_gemini_events_total",
+                        "Gemini client retries, hedged calls, timeouts and calls refused by the circuit breaker.")
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Gemini while the circuit breaker is open."""
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"Gemini is currently unavailable, please try again in {retry_after:.0f} seconds")
+
+
+def is_transient(error):
+    """Whether an error from the Gemini SDK is worth retrying."""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # google.api_core exceptions carry the HTTP status as `code`
+    return getattr(error, "code", None) in TRANSIENT_STATUS
+
+
+def estimate_tokens(contents):
+    """Rough prompt size in tokens (4 characters per token, a fixed cost per image)."""
+    if isinstance(contents, str):
+        return len(contents) // 4 + 1
+    if isinstance(contents, dict):
+        return IMAGE_TOKENS
+    return sum(estimate_tokens(part) for part in contents)
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `per_minute` tokens a minute, holding at most
+    `burst` (default: a minute's worth). Callers reserve tokens up front and
+    wait for as long as reserve() tells them, so waiters are served in order.
+    """
+    def __init__(self, per_minute, burst=None):
+        self.per_minute = per_minute
+        self.capacity = burst or per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount=1):
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        if self.per_minute <= 0:
+            return 0.0
+        rate = self.per_minute / 60
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * rate)
+            self._updated = now
+            # A request bigger than the bucket would never fit, let it through once the bucket is full
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / rate)
+
+    def adjust(self, amount):
+        """Correct an earlier reservation once the real size is known (negative gives tokens back)."""
+        if self.per_minute <= 0:
+            return
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens - amount)
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` failed calls in a row. While it is open calls fail
+    with CircuitOpenError, after `cooldown` seconds one trial call is let
+    through: if it succeeds the breaker closes, otherwise it opens again.
+    """
+    def __init__(self, threshold=GEMINI_BREAKER_THRESHOLD, cooldown=GEMINI_BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "half-open" if self._trial or time.monotonic() >= self._opened_at + self.cooldown else "open"
+
+    def check(self):
+        """Raise CircuitOpenError if calls should not be made right now."""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._trial:
+                GEMINI_EVENTS.inc(event="circuit_open")
+                raise CircuitOpenError(max(remaining, 1))
+            self._trial = True
+
+    def success(self):
+        with self._lock:
+            if self._opened_at is not None:
+                print("Gemini circuit breaker closed")
+            self.failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.threshold > 0 and (self._trial or self.failures >= self.threshold):
+                if self._opened_at is None:
+                    print(f"Gemini circuit breaker opened after {self.failures} failures")
+                self._opened_at = time.monotonic()
+                self._trial = False
+
+    def release(self):
+        """Give up a trial call that was cancelled before it got an answer."""
+        with self._lock:
+            self._trial = False
+
+
+class GeminiClient:
+    """
+    Calls a Gemini model with client-side rate limiting (requests and tokens
+    per minute), a deadline per call, retries of transient errors with
+    jittered exponential backoff, optional hedging of slow calls and a
+    circuit breaker that fails fast during outages.
+    get_model returns the model to call, so it can be loaded lazily.
+    """
+    def __init__(self, get_model, rpm=GEMINI_RPM, tpm=GEMINI_TPM, timeout=GEMINI_TIMEOUT, retries=GEMINI_RETRIES,
+                 backoff=GEMINI_RETRY_BACKOFF, hedge_after=GEMINI_HEDGE_AFTER, breaker=None):
+        self._get_model = get_model
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge_after = hedge_after
+        self.breaker = breaker if breaker is not None else CircuitBreaker()
+
+    @property
+    def model(self):
+        return self._get_model()
+
+    def _reserve(self, contents):
+        """Reserve quota for one call and return (seconds to wait, estimated tokens)."""
+        estimate = estimate_tokens(contents)
+        wait = max(self.requests.reserve(), self.tokens.reserve(estimate))
+        if wait > 0:
+            record_stage("rate_limit", wait)
+        return wait, estimate
+
+    def _settle(self, estimate, response):
+        """Correct the token reservation with the prompt size Gemini reports."""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0)
+        if prompt_tokens:
+            self.tokens.adjust(prompt_tokens - estimate)
+
+    def _retry_delay(self, error, attempt):
+        """
+        Record a failed attempt. Returns the seconds to wait before retrying,
+        or None if the error should be raised.
+        """
+        if not is_transient(error):
+            # Gemini answered, the request itself was rejected
+            self.breaker.success()
+            return None
+        self.breaker.failure()
+        if attempt >= self.retries:
+            return None
+        delay = random.uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+        GEMINI_EVENTS.inc(event="retry")
+        print(f"Gemini call failed ({type(error).__name__}: {error}), retry {attempt + 1} in {delay:.1f}s")
+        return delay
+
+    async def _attempt(self, call, contents):
+        """One rate-limited call with a deadline."""
+        wait, estimate = self._reserve(contents)
+        await asyncio.sleep(wait)
+        try:
+            result = await asyncio.wait_for(call(), self.timeout)
+        except asyncio.TimeoutError:
+            GEMINI_EVENTS.inc(event="timeout")
+            raise TimeoutError(f"Gemini did not answer within {self.timeout:g} seconds") from None
+        self._settle(estimate, result)
+        return result
+
+    async def _hedged(self, start):
+        """
+        Await start(). If hedging is on and it hasn't finished after
+        hedge_after seconds, start a second copy and return whichever
+        succeeds first.
+        """
+        if self.hedge_after <= 0:
+            return await start()
+
+        pending = {asyncio.ensure_future(start())}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=self.hedge_after)
+            if not done:
+                GEMINI_EVENTS.inc(event="hedge")
+                pending.add(asyncio.ensure_future(start()))
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, call, contents):
+        """Run call() with the rate limits, deadline, hedging, retries and circuit breaker."""
+        attempt = 0
+        while True:
+            self.breaker.check()
+            try:
+                result = await self._hedged(lambda: self._attempt(call, contents))
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.success()
+                return result
+
+    async def generate(self, contents, model=None):
+        """generate_content_async with the client's protections. model overrides the default model."""
+        model = model or self.model
+        return await self._call(lambda: model.generate_content_async(contents), contents)
+
+    async def stream(self, contents, model=None):
+        """
+        Stream a response chunk by chunk. Opening the stream and waiting for
+        the first chunk are retried and hedged like generate(). Once a chunk
+        has been yielded errors are raised, as the output can't be taken back.
+        """
+        model = model or self.model
+
+        async def open_stream():
+            response = await model.generate_content_async(contents, stream=True)
+            chunks = aiter(response)
+            return chunks, await anext(chunks, None)
+
+        chunks, chunk = await self._call(open_stream, contents)
+        while chunk is not None:
+            yield chunk
+            try:
+                chunk = await asyncio.wait_for(anext(chunks, None), self.timeout)
+            except Exception as e:
+                if is_transient(e):
+                    self.breaker.failure()
+                if isinstance(e, asyncio.TimeoutError):
+                    GEMINI_EVENTS.inc(event="timeout")
+                    raise TimeoutError(f"Gemini stopped sending for {self.timeout:g} seconds") from None
+                raise
+
+    async def count_tokens(self, contents):
+        """count_tokens_async with a deadline and retries (it has its own quota, so no rate limiting)."""
+        attempt = 0
+        while True:
+            try:
+                return await asyncio.wait_for(self.model.count_tokens_async(contents), self.timeout)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def generate_blocking(self, contents):
+        """
+        Blocking generate_content for synchronous callers, with the same rate
+        limits, retries and circuit breaker (no hedging). The deadline is
+        passed to the SDK.
+        """
+        attempt = 0
+        while True:
+            self.breaker.check()
+            wait, estimate = self._reserve(contents)
+            time.sleep(wait)
+            try:
+                response = self.model.generate_content(contents, request_options={"timeout": self.timeout})
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.breaker.release()
+                raise
+            else:
+                self.breaker.success()
+                self._settle(estimate, response)
+                return response
+
+
+class ContextCaches:
+    """
+    Gemini context caches: contents stored once and referenced by later
+    calls, so their tokens are billed at the cached rate instead of being
+    sent and processed again. The calls are blocking, run them in a thread.
+    """
+    def __init__(self, api_key, model_name=CONTEXT_CACHE_MODEL):
+        self.api_key = api_key
+        self.model_name = model_name
+        self._models = {}  # cache name -> model that answers from it
+        self._lock = threading.Lock()
+
+    def _caching(self):
+        import google.generativeai as genai
+        from google.generativeai import caching
+
+        genai.configure(api_key=self.api_key)
+        return genai, caching
+
+    def create(self, contents, ttl):
+        """Cache contents for ttl seconds and return the cache name."""
+        _, caching = self._caching()
+        cache = caching.CachedContent.create(
+            model=self.model_name, contents=contents, ttl=datetime.timedelta(seconds=ttl)
+        )
+        return cache.name
+
+    def model(self, name):
+        """A model whose calls are answered with the cached contents in front of the prompt."""
+        with self._lock:
+            if name not in self._models:
+                genai, caching = self._caching()
+                self._models[name] = genai.GenerativeModel.from_cached_content(caching.CachedContent.get(name))
+            return self._models[name]
+
+    def delete(self, name):
+        """Delete a cache before its ttl runs out. Missing caches are ignored."""
+        with self._lock:
+            self._models.pop(name, None)
+        _, caching = self._caching()
+        try:
+            caching.CachedContent.get(name).delete()
+        except Exception as e:
+            print(f"Could not delete context cache {name}: {e}")
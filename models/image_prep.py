@@ -0,0 +1,68 @@
+import io
+import os
+
+# Gemini tiles images into 768px squares, larger images cost more tokens and bytes for no gain
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Formats Gemini accepts as they are, anything else is always re-encoded
+NATIVE_TYPES = ("image/png", "image/jpeg", "image/webp")
+
+
+def prepare_image(file_path, file_type, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY):
+    """
+    Downscale an image so its longest side is at most max_side, drop its
+    metadata and re-encode it as WebP (JPEG if Pillow was built without
+    WebP). Returns (mime_type, bytes). Images Pillow can't read are sent
+    as they are.
+    """
+    # Pillow is only loaded once there is an image to process
+    from PIL import Image, ImageOps
+
+    with open(file_path, "rb") as f:
+        data = f.read()
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Apply the EXIF rotation before the EXIF data is dropped
+            original_size = image.size
+            image = ImageOps.exif_transpose(image)
+            # Downscaled in place, so the size afterwards tells whether it was
+            mime_type, encoded = encode_image(image, max_side, quality)
+            resized = image.size != original_size
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return file_type, data
+
+    # Small images can grow when re-encoded, keep the original if it is smaller and has nothing to strip
+    if file_type in NATIVE_TYPES and not resized and len(encoded) >= len(data) and not _has_metadata(data):
+        return file_type, data
+    return mime_type, encoded
+
+
+def encode_image(image, max_side=IMAGE_MAX_SIDE, quality=IMAGE_QUALITY):
+    """
+    Downscale a PIL image in place so its longest side is at most max_side
+    and encode it as WebP (JPEG without WebP support). Returns (mime_type, bytes).
+    """
+    from PIL import Image, features
+
+    image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    if features.check("webp"):
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+        image.save(output, "WEBP", quality=quality, method=4)
+        return "image/webp", output.getvalue()
+    image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+    return "image/jpeg", output.getvalue()
+
+
+def _has_metadata(data):
+    """Whether the image carries EXIF data (location, camera, ...)."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return bool(image.getexif()) or "exif" in image.info
+    except OSError:
+        return False
@@ -0,0 +1,491 @@
+import os
+import math
+import time
+import sqlite3
+import asyncio
+import weakref
+import threading
+from .document import Document
+from .metrics import Trace, span, RESULT_BYTES
+from .text_stream import read_text, write_text
+
+# Job settings
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "16"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "120"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+RESULT_TTL = int(os.getenv("RESULT_TTL", "3600"))  # seconds a finished result is kept
+
+# Admission control: jobs running at once across all server processes (0 = only JOB_WORKERS per process),
+# and jobs waiting in total and per browser session before new ones are turned away
+JOB_MAX_RUNNING = int(os.getenv("JOB_MAX_RUNNING", "0"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "200"))
+JOB_SESSION_QUEUE_SIZE = int(os.getenv("JOB_SESSION_QUEUE_SIZE", "10"))
+# Seconds per job assumed for retry hints until some jobs have finished
+DEFAULT_JOB_SECONDS = 10
+MAX_RETRY_AFTER = 300
+
+# Queued jobs with their turn: a session's n-th queued job gets turn n plus the number of jobs the
+# session has running. Jobs are run by turn, then oldest first, so a busy session can't starve the rest.
+FAIR_QUEUE = """
+    SELECT jobs.*, ROW_NUMBER() OVER (PARTITION BY jobs.session_id ORDER BY jobs.created_at)
+                   + COALESCE(running.jobs, 0) AS turn
+    FROM jobs LEFT JOIN (
+        SELECT session_id, COUNT(*) AS jobs FROM jobs WHERE status = 'running' GROUP BY session_id
+    ) AS running ON running.session_id IS jobs.session_id
+    WHERE jobs.status = 'queued'
+"""
+
+
+class QueueFullError(Exception):
+    """Raised instead of queueing a job when the queue, or the session's share of it, is full."""
+    def __init__(self, retry_after, session=False):
+        self.retry_after = retry_after
+        reason = "You already have too many documents waiting" if session else "The server is busy"
+        super().__init__(f"{reason}, please try again in {retry_after} seconds")
+
+
+class JobStore:
+    """
+    SQLite-backed store for processing jobs.
+    A worker claims a job by taking a lease on it and keeps renewing the lease
+    while it works. If the worker dies the lease runs out and the job is
+    picked up again, so in-flight jobs survive a restart.
+    Jobs belong to a browser session and finished jobs expire after RESULT_TTL
+    seconds. The database is shared, so every server process sees every job.
+    New jobs are turned away once JOB_QUEUE_SIZE jobs (JOB_SESSION_QUEUE_SIZE
+    of one session) are waiting, and queued jobs are claimed fairly across
+    sessions, at most JOB_MAX_RUNNING at a time. The files of a batch are
+    jobs of the batch's session too, they are claimed and limited the same
+    way but don't count against the queue sizes (batches have their own).
+    """
+    def __init__(self, db_path=JOBS_DB):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,          -- queued, running, done, failed
+                file_path TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                file_type TEXT,
+                content_hash TEXT,
+                instructions TEXT NOT NULL,
+                result_path TEXT NOT NULL,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                session_id TEXT,
+                expires_at REAL,
+                document_id TEXT,              -- document session for follow-up questions
+                pages TEXT,                    -- page range to extract from a PDF, NULL for every page
+                started_at REAL,               -- when the current attempt was claimed
+                result_key TEXT,               -- result cache key, so the cached copy goes with the result
+                batch_id TEXT                  -- batch the file belongs to, NULL for a single upload or question
+            )
+        """)
+        # Databases created before sessions, document sessions, page ranges, admission control, result keys and
+        # batch jobs lack these columns
+        columns = {row["name"] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        for column, kind in (("session_id", "TEXT"), ("expires_at", "REAL"), ("document_id", "TEXT"),
+                             ("pages", "TEXT"), ("started_at", "REAL"), ("result_key", "TEXT"), ("batch_id", "TEXT")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_session ON jobs (session_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def enqueue(self, job_id, file_path, file_name, file_type, instructions, content_hash=None, session_id=None,
+                document_id=None, pages=None):
+        """
+        Add a job to the queue. Its result will be written to downloads/{job_id}_result.md.
+        document_id links the job to a document kept for follow-up questions,
+        pages is the page range to extract from a PDF.
+        Raises QueueFullError if the queue is full.
+        """
+        now = time.time()
+        with self._lock:
+            # Check and insert in one transaction, so other server processes can't fill the queue in between
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._check_admission(session_id)
+                self._conn.execute(
+                    "INSERT INTO jobs (id, status, file_path, file_name, file_type, content_hash, instructions, "
+                    "result_path, created_at, updated_at, session_id, document_id, pages) "
+                    "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, file_path, file_name, file_type, content_hash, instructions,
+                     f"downloads/{job_id}_result.md", now, now, session_id, document_id, pages)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return job_id
+
+    def enqueue_batch(self, batch_id, session_id, instructions, files):
+        """
+        Queue the files of a batch, given as (job_id, file_path, file_name,
+        file_type) tuples. The batch was admitted as a whole, so its files
+        are queued without a queue size check.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO jobs (id, status, file_path, file_name, file_type, instructions, result_path, "
+                    "created_at, updated_at, session_id, batch_id) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(job_id, file_path, file_name, file_type, instructions, f"downloads/{job_id}_result.md",
+                      now, now, session_id, batch_id) for job_id, file_path, file_name, file_type in files]
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def admit(self, session_id):
+        """
+        Check that a job from session_id would be queued right now, so a
+        request can be turned away before its upload is read. Raises
+        QueueFullError with a retry hint if it wouldn't.
+        """
+        with self._lock:
+            self._check_admission(session_id)
+
+    def _check_admission(self, session_id):
+        # Called with self._lock held
+        row = self._conn.execute(
+            "SELECT COUNT(*) AS queued, COALESCE(SUM(session_id IS ?), 0) AS own FROM jobs "
+            "WHERE status = 'queued' AND batch_id IS NULL",
+            (session_id,)
+        ).fetchone()
+        if row["own"] >= JOB_SESSION_QUEUE_SIZE:
+            raise QueueFullError(self._retry_after(row["own"] - JOB_SESSION_QUEUE_SIZE + 1), session=True)
+        if row["queued"] >= JOB_QUEUE_SIZE:
+            raise QueueFullError(self._retry_after(row["queued"] - JOB_QUEUE_SIZE + 1))
+
+    def _retry_after(self, jobs):
+        """Seconds until about `jobs` more queued jobs have started, from how long recent jobs took."""
+        # Called with self._lock held
+        row = self._conn.execute(
+            "SELECT (SELECT AVG(updated_at - started_at) FROM ("
+            "            SELECT updated_at, started_at FROM jobs WHERE status = 'done' AND started_at IS NOT NULL "
+            "            ORDER BY updated_at DESC LIMIT 20)) AS seconds, "
+            "       (SELECT COUNT(*) FROM jobs WHERE status = 'running') AS running"
+        ).fetchone()
+        slots = JOB_MAX_RUNNING or max(row["running"], 1)
+        seconds = (row["seconds"] or DEFAULT_JOB_SECONDS) * jobs / slots
+        return max(1, min(MAX_RETRY_AFTER, math.ceil(seconds)))
+
+    def queue_position(self, job_id):
+        """Place of a queued job in the fair queue (1 is next), or None if the job isn't queued."""
+        row = self._execute(
+            f"WITH queue AS ({FAIR_QUEUE}) "
+            "SELECT (SELECT COUNT(*) FROM queue AS other "
+            "        WHERE (other.turn, other.created_at) < (job.turn, job.created_at)) + 1 AS position "
+            "FROM queue AS job WHERE job.id = ?",
+            (job_id,)
+        ).fetchone()
+        return row["position"] if row else None
+
+    def get(self, job_id, session_id=None):
+        """Return a job as a dict, or None. If session_id is given the job must belong to that session."""
+        row = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (session_id is not None and row["session_id"] != session_id):
+            return None
+        return dict(row)
+
+    def claim(self):
+        """
+        Atomically claim a running job whose lease has expired, or else the
+        next queued job in fair order (see FAIR_QUEUE). Returns the job as a
+        dict, or None if there is nothing to do or JOB_MAX_RUNNING jobs are
+        already running.
+        """
+        while True:
+            now = time.time()
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    if JOB_MAX_RUNNING:
+                        running = self._conn.execute(
+                            "SELECT COUNT(*) FROM jobs WHERE status = 'running' AND lease_until >= ?", (now,)
+                        ).fetchone()[0]
+                        if running >= JOB_MAX_RUNNING:
+                            self._conn.execute("COMMIT")
+                            return None
+                    row = self._conn.execute(
+                        "SELECT * FROM jobs WHERE status = 'running' AND lease_until < ? ORDER BY created_at LIMIT 1",
+                        (now,)
+                    ).fetchone()
+                    if row is None:
+                        row = self._conn.execute(f"{FAIR_QUEUE} ORDER BY turn, jobs.created_at LIMIT 1").fetchone()
+                    if row is None:
+                        self._conn.execute("COMMIT")
+                        return None
+
+                    job = dict(row)
+                    job.pop("turn", None)
+                    if job["attempts"] >= JOB_MAX_ATTEMPTS:
+                        # Keeps killing its worker, give up on it and look for another job
+                        self._conn.execute(
+                            "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated_at = ?, expires_at = ? "
+                            "WHERE id = ?",
+                            ("Processing was interrupted too many times", now, now + RESULT_TTL, job["id"])
+                        )
+                        self._conn.execute("COMMIT")
+                        continue
+
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, updated_at = ?, "
+                        "started_at = ? WHERE id = ?",
+                        (now + JOB_LEASE_SECONDS, now, now, job["id"])
+                    )
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            job["status"] = "running"
+            job["attempts"] += 1
+            job["started_at"] = now
+            return job
+
+    def renew(self, job_id):
+        """Extend the lease on a running job."""
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'running'",
+            (now + JOB_LEASE_SECONDS, now, job_id)
+        )
+
+    def finish(self, job_id, result_key=None):
+        """Mark a job as done, with the result cache key of its result. Returns False if the job no longer exists."""
+        now = time.time()
+        cursor = self._execute(
+            "UPDATE jobs SET status = 'done', lease_until = NULL, updated_at = ?, expires_at = ?, result_key = ? "
+            "WHERE id = ?",
+            (now, now + RESULT_TTL, result_key, job_id)
+        )
+        return cursor.rowcount > 0
+
+    def fail(self, job_id, error):
+        now = time.time()
+        self._execute(
+            "UPDATE jobs SET status = 'failed', error = ?, lease_until = NULL, updated_at = ?, expires_at = ? WHERE id = ?",
+            (error, now, now + RESULT_TTL, job_id)
+        )
+
+    def delete(self, job_id):
+        """Delete a job. Returns False if it was already gone."""
+        return self._execute("DELETE FROM jobs WHERE id = ?", (job_id,)).rowcount > 0
+
+    def finished(self, session_id):
+        """Jobs of a session that are done or failed (not counting batch files, the batch deletes those)."""
+        rows = self._execute(
+            "SELECT * FROM jobs WHERE session_id = ? AND status IN ('done', 'failed') AND batch_id IS NULL",
+            (session_id,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def batch_jobs(self, batch_id):
+        """The jobs of a batch's files that are still in the store."""
+        rows = self._execute("SELECT * FROM jobs WHERE batch_id = ?", (batch_id,)).fetchall()
+        return [dict(row) for row in rows]
+
+    def expired(self):
+        """Finished jobs whose results have outlived RESULT_TTL."""
+        rows = self._execute("SELECT * FROM jobs WHERE expires_at < ?", (time.time(),)).fetchall()
+        return [dict(row) for row in rows]
+
+
+class JobWorkers:
+    """
+    Runs queued jobs through the Processor, up to `workers` at a time. A
+    single task per process claims the jobs, and only while a worker is
+    free, so an idle server makes one claim query per poll_interval. Store
+    calls run in a thread, off the event loop; if one fails (the database
+    stayed locked past its busy timeout, a disk error) it is logged and
+    claiming carries on after retry_delay seconds.
+    Text extraction runs in the WorkerPool if one is given, otherwise in a thread.
+    Jobs on a document kept for follow-up questions need the DocumentSessionStore.
+    """
+    def __init__(self, store, processor, workers=JOB_WORKERS, poll_interval=0.5, pool=None, sessions=None,
+                 retry_delay=5):
+        self.store = store
+        self.processor = processor
+        self.pool = pool
+        self.sessions = sessions
+        # One job at a time prepares a kept document, so it is only extracted once (per process)
+        self._followup_locks = weakref.WeakValueDictionary()
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self._wakeup = None
+        self._tasks = set()
+
+    def start(self):
+        """Start claiming jobs on the running event loop."""
+        self._wakeup = asyncio.Event()
+        self._tasks = {asyncio.create_task(self._claim_jobs())}
+
+    async def stop(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = set()
+
+    def notify(self):
+        """Wake an idle worker because a new job was enqueued."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim_jobs(self):
+        free = asyncio.Semaphore(self.workers)
+        while True:
+            await free.acquire()
+            # Cleared before claiming, so a job enqueued during the claim still wakes us
+            self._wakeup.clear()
+            try:
+                job = await asyncio.to_thread(self.store.claim)
+            except Exception as e:
+                print(f"Claiming a job failed, retrying in {self.retry_delay}s: {e}")
+                free.release()
+                await asyncio.sleep(self.retry_delay)
+                continue
+            if job is None:
+                # Nothing to do, wait for a new job or poll again for expired leases
+                free.release()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            task = asyncio.create_task(self.run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            task.add_done_callback(lambda _: free.release())
+
+    async def _keep_lease(self, job_id):
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            try:
+                await asyncio.to_thread(self.store.renew, job_id)
+            except Exception as e:
+                # The lease has time left, the next renewal may go through
+                print(f"Renewing the lease on job {job_id} failed: {e}")
+
+    async def _extract(self, document):
+        # Extraction is CPU/disk bound, keep it off the event loop
+        with span("extract"):
+            if self.pool is not None:
+                await self.pool.extract(document)
+            else:
+                await asyncio.to_thread(document.extract_text)
+        if document.extract_error is not None:
+            # Fail the job with the reason rather than asking Gemini about an error message
+            raise ValueError(document.extracted_text)
+
+    async def _prepare_followup(self, document, document_id):
+        """
+        Load a kept document's text, extracting and saving it on its first
+        job, and make sure it has had a chance at a context cache.
+        Returns the context cache name ("" if it has none).
+        """
+        lock = self._followup_locks.setdefault(document_id, asyncio.Lock())
+        async with lock:
+            doc_session = await asyncio.to_thread(self.sessions.get, document_id)
+            if doc_session is None:
+                raise ValueError("This document has expired, please upload it again")
+            return await self._load_followup(document, doc_session)
+
+    async def _load_followup(self, document, doc_session):
+        text_path = doc_session["text_path"]
+        if text_path and os.path.exists(text_path):
+            with span("load_text"):
+                document.extracted_text = await asyncio.to_thread(read_text, text_path)
+        else:
+            await self._extract(document)
+            # Scanned PDF pages are images too, those documents are extracted again for each question
+            if not document.file_type.startswith("image/") and not document.page_images:
+                text_path = os.path.join(os.path.dirname(document.file_path), f"{doc_session['id']}.txt")
+                await asyncio.to_thread(_write_text, text_path, document.extracted_text)
+                await asyncio.to_thread(self.sessions.set_text, doc_session["id"], text_path)
+                # The text is all that is needed from now on
+                if document.cleanup():
+                    print(f"Deleted uploaded file after extraction: {document.file_path}")
+
+        cache_name = doc_session["cache_name"]
+        if cache_name is None:
+            ttl = doc_session["expires_at"] - time.time()
+            cache_name = await self.processor.acreate_context_cache(document, ttl)
+            await asyncio.to_thread(self.sessions.set_cache, doc_session["id"], cache_name)
+        return cache_name
+
+    async def run_job(self, job):
+        """
+        Extract and process one job. The response is appended to
+        {result_path}.part as it streams in, then renamed to result_path.
+        """
+        lease = asyncio.create_task(self._keep_lease(job["id"]))
+        document = Document(job["file_path"], job["file_name"], job["file_type"], content_hash=job["content_hash"],
+                            pages=job.get("pages"))
+        result_path = job["result_path"]
+        part_path = f"{result_path}.part"
+        document_id = job.get("document_id")
+        with Trace(job["id"], job["file_type"]) as trace:
+            try:
+                context_cache = None
+                if document_id:
+                    context_cache = await self._prepare_followup(document, document_id)
+                else:
+                    await self._extract(document)
+                    if job.get("batch_id") and document.extractor is None:
+                        # A batch lists the files it couldn't read instead of asking Gemini about them
+                        raise ValueError(document.extracted_text)
+
+                with open(part_path, "w", encoding="utf-8") as f:
+                    stream = self.processor.astream_document(
+                        document, job["instructions"], follow_up=bool(document_id), context_cache=context_cache
+                    )
+                    async for chunk in stream:
+                        f.write(chunk)
+                        f.flush()
+                    RESULT_BYTES.observe(f.tell())
+                os.replace(part_path, result_path)
+                if not await asyncio.to_thread(self.store.finish, job["id"], document.result_key):
+                    # The job was deleted while it was running, nobody will download this
+                    os.remove(result_path)
+                    self.processor.cache.delete(document.result_key)
+
+            except Exception as e:
+                trace.status = "failed"
+                try:
+                    await asyncio.to_thread(self.store.fail, job["id"], str(e))
+                except Exception as store_error:
+                    # Still marked running, the job is tried again once its lease runs out
+                    print(f"Could not mark job {job['id']} as failed: {store_error}")
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+
+            finally:
+                lease.cancel()
+
+        # Delete the original uploaded file since we don't need it anymore
+        # (kept documents are deleted when their session expires)
+        if not document_id and document.cleanup():
+            print(f"Deleted uploaded file after processing: {document.file_path}")
+
+
+def _write_text(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        write_text(f, text)
@@ -0,0 +1,289 @@
+import os
+import re
+import json
+from json.decoder import scanstring
+
+# How JSON files are turned into prompt text
+JSON_EXTRACT_MODE = os.getenv("JSON_EXTRACT_MODE", "minified")  # minified or flat
+JSON_ARRAY_SAMPLE = int(os.getenv("JSON_ARRAY_SAMPLE", "50"))  # items kept per array, 0 keeps all
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+NUMBER = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][-+]?\d+)?")
+NUMBER_CHARS = re.compile(r"[0-9.eE+-]*\Z")
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*\Z")
+LITERALS = ("true", "false", "null")
+
+
+class _Reader:
+    """Character buffer over a text file that only holds the part still being parsed."""
+    def __init__(self, f, chunk_size):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """Read more of the file. Reads at least as much as is buffered, so long tokens take few reads."""
+        if self.eof:
+            return False
+        chunk = self.f.read(max(self.chunk_size, len(self.buffer) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message):
+        return ValueError(f"Invalid JSON: {message}")
+
+
+def _tokens(f, chunk_size):
+    """Yield (kind, value) tokens from a JSON text file."""
+    reader = _Reader(f, chunk_size)
+    while True:
+        reader.pos = WHITESPACE.match(reader.buffer, reader.pos).end()
+        if reader.pos >= len(reader.buffer):
+            if not reader.fill():
+                return
+            continue
+
+        char = reader.buffer[reader.pos]
+        if char in "{}[]:,":
+            reader.pos += 1
+            yield char, None
+
+        elif char == '"':
+            try:
+                value, end = scanstring(reader.buffer, reader.pos + 1)
+            except json.JSONDecodeError as e:
+                # The string may just continue in the next chunk
+                if reader.fill():
+                    continue
+                raise reader.error(e.msg)
+            reader.pos = end
+            yield "string", value
+
+        else:
+            # A number that runs to the end of the buffer may continue in the next chunk
+            if NUMBER_CHARS.match(reader.buffer, reader.pos) and reader.fill():
+                continue
+            match = NUMBER.match(reader.buffer, reader.pos)
+            if match:
+                reader.pos = match.end()
+                yield "number", match.group()
+                continue
+
+            word = next((word for word in LITERALS if reader.buffer.startswith(word, reader.pos)), None)
+            if word is None and len(reader.buffer) - reader.pos < 5 and reader.fill():
+                continue
+            if word is None:
+                raise reader.error(f"unexpected character {char!r}")
+            reader.pos += len(word)
+            yield "literal", word
+
+
+def iter_json_events(f, chunk_size=CHUNK_SIZE):
+    """
+    Parse a JSON text file incrementally and yield (event, value) pairs:
+    start_map, key, end_map, start_array, end_array and scalar values as
+    ("string", text), ("number", source text) or ("literal", true/false/null).
+    Only the token being read is held in memory, never the whole document.
+    """
+    stack = []
+    expect = "value"
+    for kind, value in _tokens(f, chunk_size):
+        if expect in ("value", "value_or_end"):
+            if kind == "]" and expect == "value_or_end":
+                stack.pop()
+                yield "end_array", None
+            elif kind == "{":
+                stack.append("{")
+                expect = "key_or_end"
+                yield "start_map", None
+                continue
+            elif kind == "[":
+                stack.append("[")
+                expect = "value_or_end"
+                yield "start_array", None
+                continue
+            elif kind in ("string", "number", "literal"):
+                yield kind, value
+            else:
+                raise ValueError(f"Invalid JSON: expected a value, got {kind!r}")
+
+        elif expect in ("key", "key_or_end"):
+            if kind == "}" and expect == "key_or_end":
+                stack.pop()
+                yield "end_map", None
+            elif kind == "string":
+                expect = "colon"
+                yield "key", value
+                continue
+            else:
+                raise ValueError(f"Invalid JSON: expected a key, got {kind!r}")
+
+        elif expect == "colon":
+            if kind != ":":
+                raise ValueError(f"Invalid JSON: expected ':', got {kind!r}")
+            expect = "value"
+            continue
+
+        elif expect == "comma_or_end":
+            if kind == ",":
+                expect = "key" if stack[-1] == "{" else "value"
+                continue
+            if (kind, stack[-1]) not in (("}", "{"), ("]", "[")):
+                raise ValueError(f"Invalid JSON: expected ',' or a closing bracket, got {kind!r}")
+            stack.pop()
+            yield ("end_map" if kind == "}" else "end_array"), None
+
+        else:
+            raise ValueError("Invalid JSON: extra data after the document")
+
+        # A value just finished
+        expect = "comma_or_end" if stack else "done"
+
+    if expect != "done":
+        raise ValueError("Invalid JSON: unexpected end of file")
+
+
+def sample_arrays(events, array_sample=JSON_ARRAY_SAMPLE):
+    """
+    Keep the first array_sample items of every array and replace the rest
+    with a single ("omitted", count) event before the array closes.
+    """
+    counts = []  # Items seen in each open array, None for objects
+    skipping = 0  # Depth inside an item that is being dropped
+    for event, value in events:
+        if skipping:
+            if event in ("start_map", "start_array"):
+                skipping += 1
+            elif event in ("end_map", "end_array"):
+                skipping -= 1
+            continue
+
+        if event == "end_array":
+            count = counts.pop()
+            if array_sample and count > array_sample:
+                yield "omitted", count - array_sample
+            yield event, value
+            continue
+        if event == "end_map":
+            counts.pop()
+            yield event, value
+            continue
+        if event == "key":
+            yield event, value
+            continue
+
+        # A value starts, drop it if its array is already full
+        if counts and counts[-1] is not None:
+            counts[-1] += 1
+            if array_sample and counts[-1] > array_sample:
+                if event in ("start_map", "start_array"):
+                    skipping = 1
+                continue
+        if event == "start_array":
+            counts.append(0)
+        elif event == "start_map":
+            counts.append(None)
+        yield event, value
+
+
+def _scalar(event, value):
+    return json.dumps(value, ensure_ascii=False) if event == "string" else value
+
+
+def iter_minified(events):
+    """Yield compact JSON text for a stream of events. Omitted items become a note string."""
+    containers = []  # [type, first] for each open container
+    for event, value in events:
+        if event in ("end_map", "end_array"):
+            containers.pop()
+            yield "}" if event == "end_map" else "]"
+            continue
+
+        comma = ""
+        if containers and (event == "key" or containers[-1][0] == "["):
+            comma = "" if containers[-1][1] else ","
+            containers[-1][1] = False
+
+        if event == "key":
+            yield f"{comma}{json.dumps(value, ensure_ascii=False)}:"
+        elif event == "start_map":
+            containers.append(["{", True])
+            yield comma + "{"
+        elif event == "start_array":
+            containers.append(["[", True])
+            yield comma + "["
+        elif event == "omitted":
+            yield f'{comma}"... {value} more items omitted"'
+        else:
+            yield comma + _scalar(event, value)
+
+
+def _path_part(key):
+    if isinstance(key, int):
+        return f"[{key}]"
+    if IDENTIFIER.match(key):
+        return f".{key}"
+    return f"[{json.dumps(key, ensure_ascii=False)}]"
+
+
+def iter_flat(events):
+    """
+    Yield one "path: value" line per scalar, e.g. users[0].name: "Ada".
+    Empty objects and arrays are kept as {} and [] so nothing disappears.
+    """
+    frames = []  # [type, path part of the current item, next index, empty] for each open container
+
+    def path():
+        return "".join(frame[1] for frame in frames).lstrip(".")
+
+    for event, value in events:
+        if event == "key":
+            frames[-1][1] = _path_part(value)
+            frames[-1][3] = False
+            continue
+        if event in ("end_map", "end_array"):
+            kind, _, _, empty = frames.pop()
+            if empty:
+                yield f"{path() or '$'}: {'{}' if kind == '{' else '[]'}\n"
+            continue
+
+        if frames and frames[-1][0] == "[":
+            frame = frames[-1]
+            frame[1] = "[...]" if event == "omitted" else _path_part(frame[2])
+            frame[2] += 1
+            frame[3] = False
+
+        if event == "start_map":
+            frames.append(["{", "", 0, True])
+        elif event == "start_array":
+            frames.append(["[", "", 0, True])
+        elif event == "omitted":
+            yield f"{path()}: {value} more items omitted\n"
+        else:
+            yield f"{path() or '$'}: {_scalar(event, value)}\n"
+
+
+def iter_json_text(file_path, mode=None, array_sample=None):
+    """
+    Yield a compact text rendering of a JSON file without loading it whole.
+    mode is "minified" (compact JSON) or "flat" ("path: value" lines). Arrays
+    longer than array_sample are cut down to their first array_sample items
+    followed by a count of what was left out.
+    """
+    if mode is None:
+        mode = JSON_EXTRACT_MODE
+    if array_sample is None:
+        array_sample = JSON_ARRAY_SAMPLE
+    if mode not in ("minified", "flat"):
+        raise ValueError(f"Unknown JSON extract mode: {mode}")
+
+    render = iter_flat if mode == "flat" else iter_minified
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield from render(sample_arrays(iter_json_events(f), array_sample))
@@ -0,0 +1,286 @@
+import os
+import gc
+import sys
+import time
+import random
+import bisect
+import asyncio
+import inspect
+import threading
+import contextvars
+from collections import Counter as Tally
+from contextlib import contextmanager
+
+# Jobs slower than this (seconds) get their stage breakdown logged
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "10"))
+# Share of jobs whose stack is sampled (where the job's task runs or waits), profiles of slow jobs are saved to PROFILE_DIR
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(10))  # 1KB to 256MB
+TOKEN_BUCKETS = (100, 500, 1000, 5000, 10_000, 50_000, 100_000, 500_000, 1_000_000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Counter:
+    """A Prometheus counter with optional labels."""
+    def __init__(self, name, help, registry=None):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_label_text(key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram with optional labels."""
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS, registry=None):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+        (registry if registry is not None else REGISTRY).append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_label_text(key + (('le', f'{bound:g}'),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{_label_text(key)} {total:g}")
+                lines.append(f"{self.name}_count{_label_text(key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram("contentlens_stage_seconds", "Time spent in each stage of processing a document.")
+JOB_SECONDS = Histogram("contentlens_job_seconds", "Time from a job being picked up to its result being ready.")
+JOBS = Counter("contentlens_jobs_total", "Jobs finished, by status.")
+UPLOAD_BYTES = Histogram("contentlens_upload_bytes", "Size of uploaded files.", SIZE_BUCKETS)
+RESULT_BYTES = Histogram("contentlens_result_bytes", "Size of generated results.", SIZE_BUCKETS)
+PROMPT_TOKENS = Histogram("contentlens_prompt_tokens", "Prompt tokens per Gemini call.", TOKEN_BUCKETS)
+CACHED_TOKENS = Histogram("contentlens_cached_tokens", "Prompt tokens served from a context cache per Gemini call.",
+                          TOKEN_BUCKETS)
+COMPACTION_SAVED_TOKENS = Histogram("contentlens_compaction_saved_tokens",
+                                    "Estimated prompt tokens removed by compaction per document.", TOKEN_BUCKETS)
+RESPONSE_TOKENS = Histogram("contentlens_response_tokens", "Response tokens per Gemini call.", TOKEN_BUCKETS)
+
+_current_trace = contextvars.ContextVar("contentlens_trace", default=None)
+
+
+def render_metrics(extra=()):
+    """Every registered metric in the Prometheus text format, followed by any extra lines."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    lines.extend(extra)
+    return "\n".join(lines) + "\n"
+
+
+def record_stage(stage, seconds):
+    """Record time spent in a stage, in contentlens_stage_seconds and the current job's trace."""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.stages[stage] += seconds
+
+
+@contextmanager
+def span(stage):
+    """Time the body of a with block as a stage."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_usage(response):
+    """Record the token counts Gemini reports on a response (or the last chunk of a stream)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    if getattr(usage, "prompt_token_count", 0):
+        PROMPT_TOKENS.observe(usage.prompt_token_count)
+    if getattr(usage, "cached_content_token_count", 0):
+        CACHED_TOKENS.observe(usage.cached_content_token_count)
+    if getattr(usage, "candidates_token_count", 0):
+        RESPONSE_TOKENS.observe(usage.candidates_token_count)
+
+
+def _frame_name(frame):
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+def _awaiting(coro):
+    """
+    Frames of a suspended coroutine and of what it awaits, outermost first,
+    ending with the future it waits on (a thread, a worker process, a
+    network call).
+    """
+    stack = []
+    while coro is not None:
+        if isinstance(coro, asyncio.Task):
+            coro = coro.get_coro()
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            if type(coro).__name__ in ("async_generator_asend", "async_generator_athrow", "FutureIter"):
+                # `async for` and `await future` go through a wrapper, only the garbage collector sees what it wraps
+                coro = next((ref for ref in gc.get_referents(coro)
+                             if inspect.isasyncgen(ref) or asyncio.isfuture(ref)), None)
+                continue
+            stack.append(f"<{type(coro).__name__}>")
+            break
+        stack.append(_frame_name(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "ag_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return stack
+
+
+class StackSampler(threading.Thread):
+    """
+    Samples where one asyncio task is every `interval` seconds and counts
+    identical stacks. While the task runs that is the stack of its thread
+    (thread_id, the event loop's) from the task's coroutine down, while it
+    is suspended the coroutines it waits in and the future at the end, so
+    time spent in threads, worker processes or Gemini shows up as the await
+    that waited for it. Other tasks on the same loop aren't sampled.
+    """
+    def __init__(self, task, thread_id, interval=0.01):
+        super().__init__(daemon=True)
+        self.task = task
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Tally()
+        self.path = None
+        self._done = threading.Event()
+
+    def run(self):
+        coro = self.task.get_coro()
+        while not self._done.wait(self.interval):
+            root = getattr(coro, "cr_frame", None)
+            if root is None:
+                continue
+            stack = self._running(root) or _awaiting(coro)
+            if stack:
+                self.stacks[";".join(stack)] += 1
+        if self.path is not None:
+            self.save(self.path)
+            print(f"Saved profile of slow job: {self.path}")
+
+    def _running(self, root):
+        """The task's frames on its thread if it is running right now, else None."""
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame))
+            if frame is root:
+                return list(reversed(stack))
+            frame = frame.f_back
+        return None
+
+    def stop(self, path=None):
+        """
+        Stop sampling without waiting for the sampler thread, which saves
+        the profile to path (if given) on its way out.
+        """
+        self.path = path
+        self._done.set()
+
+    def save(self, path):
+        """Write the samples in the folded format used by flame graph tools."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+_sampling = threading.Lock()  # Only one job is sampled at a time
+
+
+def _current_task():
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # No event loop running in this thread
+        return None
+
+
+class Trace:
+    """
+    Per-job record of how long each stage took. Stages timed with span()
+    while the trace is active are added to it. Slow jobs are logged with
+    their breakdown, and a sampled share of jobs entered in an asyncio task
+    also has that task's stack sampled (see StackSampler) so slow ones can
+    be profiled.
+    """
+    def __init__(self, job_id, file_type=None):
+        self.job_id = job_id
+        self.file_type = file_type
+        self.stages = Tally()
+        self.status = "done"
+        self._start = None
+        self._token = None
+        self._sampler = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        self._token = _current_trace.set(self)
+        task = _current_task()
+        if task is not None and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE \
+                and _sampling.acquire(blocking=False):
+            self._sampler = StackSampler(task, threading.get_ident())
+            self._sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        total = time.perf_counter() - self._start
+        _current_trace.reset(self._token)
+        JOB_SECONDS.observe(total, file_type=self.file_type or "unknown")
+        JOBS.inc(status="failed" if exc_type is not None else self.status)
+
+        slow = total >= SLOW_REQUEST_SECONDS
+        if slow:
+            breakdown = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in self.stages.most_common())
+            print(f"Slow job {self.job_id} ({self.file_type}): {total:.2f}s ({breakdown})")
+        if self._sampler is not None:
+            # The sampler finishes (and writes the profile) in its own thread, off the event loop
+            self._sampler.stop(os.path.join(PROFILE_DIR, f"{self.job_id}.folded") if slow else None)
+            _sampling.release()
+        return False
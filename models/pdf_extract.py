@@ -0,0 +1,171 @@
+import os
+import re
+import threading
+
+# A page with fewer characters of text than this and at least one image is treated as a scan
+PDF_SCANNED_PAGE_CHARS = int(os.getenv("PDF_SCANNED_PAGE_CHARS", "20"))
+# Scanned pages sent to Gemini as images per document, later ones are only mentioned in the text
+PDF_MAX_PAGE_IMAGES = int(os.getenv("PDF_MAX_PAGE_IMAGES", "20"))
+# Resolution scanned pages are rendered at, before they are downscaled like uploaded images
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "150"))
+# Pages extracted per worker pool task, a document's tasks run in parallel
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "16"))
+
+PAGE_RANGE = re.compile(r"^\s*(\d+)\s*(?:(-)\s*(\d+)?)?\s*$")
+
+# PDFium isn't thread-safe, calls into it from threads of the same process take turns
+_pdfium_lock = threading.Lock()
+
+
+def parse_page_range(spec):
+    """
+    Parse a page range like "1-5, 8, 12-" into a list of (first, last) page
+    numbers, counting from 1, with last None for an open end. An empty spec
+    means every page and gives None. Raises ValueError for anything else.
+    """
+    if spec is None or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        match = PAGE_RANGE.match(part)
+        if match is None:
+            raise ValueError(f"{part.strip()!r} is not a page or a page range like 3-7")
+        first = int(match.group(1))
+        last = int(match.group(3)) if match.group(3) else (None if match.group(2) else first)
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"{part.strip()!r} is not a valid page range")
+        ranges.append((first, last))
+    return ranges
+
+
+def select_pages(spec, page_count):
+    """
+    0-based indexes of the pages a page range spec selects in a document of
+    page_count pages. Raises ValueError if it selects none, so a range past
+    the end of the document isn't processed as an empty one.
+    """
+    ranges = parse_page_range(spec)
+    if ranges is None:
+        pages = range(page_count)
+    else:
+        pages = set()
+        for first, last in ranges:
+            pages.update(range(first - 1, min(last or page_count, page_count)))
+    if not pages:
+        if spec is None or not spec.strip():
+            raise ValueError("The document has no pages")
+        raise ValueError(f"The document has {page_count} pages, pages {spec.strip()} aren't in it")
+    return sorted(pages)
+
+
+def page_count(file_path):
+    """Number of pages in a PDF. Only the document's page tree is read."""
+    import pypdfium2 as pdfium
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+
+def iter_pdf_pages(file_path, pages=None, max_images=PDF_MAX_PAGE_IMAGES):
+    """
+    Yield (page number, text, scanned, image) for the given 0-based page
+    indexes (every page if None). Pages are loaded one at a time and closed
+    before the next, pages that aren't asked for are never parsed. A page
+    is scanned if it has next to no text but an image. The first max_images
+    scanned pages are rendered, image is then a (mime_type, bytes) pair
+    (None otherwise).
+    """
+    # PDFium is only loaded once there is a PDF to read
+    import pypdfium2 as pdfium
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+    try:
+        rendered = 0
+        for index in (range(len(pdf)) if pages is None else pages):
+            with _pdfium_lock:
+                text, scanned, image = _read_page(pdf, index, render=rendered < max_images)
+            rendered += image is not None
+            yield index + 1, text, scanned, image
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+
+def extract_pages(file_path, pages, max_images=PDF_MAX_PAGE_IMAGES):
+    """iter_pdf_pages as a list, for a worker pool task."""
+    return list(iter_pdf_pages(file_path, pages, max_images))
+
+
+def render_pages(file_path, pages):
+    """Render the given 0-based pages, returns a list of (page number, (mime_type, bytes))."""
+    import pypdfium2 as pdfium
+
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(file_path)
+    try:
+        rendered = []
+        for index in pages:
+            with _pdfium_lock:
+                page = pdf[index]
+                try:
+                    rendered.append((index + 1, _render(page)))
+                finally:
+                    page.close()
+        return rendered
+    finally:
+        with _pdfium_lock:
+            pdf.close()
+
+
+def _read_page(pdf, index, render):
+    import pypdfium2.raw as pdfium_c
+
+    page = pdf[index]
+    try:
+        textpage = page.get_textpage()
+        try:
+            text = textpage.get_text_range().replace("\r\n", "\n").strip()
+        finally:
+            textpage.close()
+
+        scanned = False
+        if len(text) < PDF_SCANNED_PAGE_CHARS:
+            images = page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,), max_depth=2)
+            scanned = next(images, None) is not None
+        return text, scanned, _render(page) if scanned and render else None
+    finally:
+        page.close()
+
+
+def _render(page):
+    """A page as an image, downscaled and encoded like uploaded images."""
+    from .image_prep import encode_image
+
+    bitmap = page.render(scale=PDF_RENDER_DPI / 72)
+    try:
+        return encode_image(bitmap.to_pil())
+    finally:
+        bitmap.close()
+
+
+def join_pages(pages, max_images=PDF_MAX_PAGE_IMAGES):
+    """
+    Combine (page number, text, scanned, image) results into the document's
+    text, with each page under a "[Page N]" line, and the list of page
+    images to send along with it as (page number, mime_type, bytes).
+    Scanned pages past max_images are only mentioned in the text.
+    """
+    parts, images = [], []
+    for number, text, scanned, image in pages:
+        if image is not None and len(images) < max_images:
+            images.append((number, *image))
+            text = f"{text}\n(Scanned page, see the attached image of page {number})".strip()
+        elif scanned:
+            text = f"{text}\n(Scanned page, its image was left out)".strip()
+        parts.append(f"[Page {number}]\n{text}")
+    return "\n\n".join(parts), images
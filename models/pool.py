@@ -0,0 +1,233 @@
+import os
+import asyncio
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from .text_stream import read_text, write_text
+from .pdf_extract import (PDF_MAX_PAGE_IMAGES, PDF_PAGES_PER_TASK, extract_pages, join_pages, page_count,
+                          render_pages, select_pages)
+
+# Process pool for CPU-bound work (extraction, image preprocessing, markdown rendering)
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(os.cpu_count() or 1)))  # 0 runs the work in threads instead
+EXTRACT_TIMEOUT = float(os.getenv("EXTRACT_TIMEOUT", "60"))  # seconds per task
+HANDOFF_SIZE = int(os.getenv("POOL_HANDOFF_SIZE", str(1024 * 1024)))  # larger text comes back through a temp file
+RENDER_INLINE_SIZE = 20_000  # shorter markdown renders faster in-process than a round trip to the pool
+
+
+class _TextFile:
+    """Text a worker wrote to a temp file instead of pickling it back."""
+    def __init__(self, path):
+        self.path = path
+
+
+def _handoff(text):
+    # Runs in the worker, or in the server process for text sent to one
+    if text is None or len(text) < HANDOFF_SIZE:
+        return text
+    fd, path = tempfile.mkstemp(prefix="contentlens-", suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        write_text(f, text)
+    return _TextFile(path)
+
+
+def _receive(value):
+    # Runs in the server process
+    if not isinstance(value, _TextFile):
+        return value
+    try:
+        return read_text(value.path)
+    finally:
+        os.remove(value.path)
+
+
+def _warm():
+    """Import the extraction code so the first real task doesn't pay for it."""
+    from . import document, image_prep, compaction  # noqa: F401
+    import markdown  # noqa: F401
+    import pypdfium2  # noqa: F401
+    from PIL import Image  # noqa: F401
+    return os.getpid()
+
+
+def _extract(file_path, file_name, file_type):
+    from .document import Document
+    document = Document(file_path, file_name, file_type)
+    # The server process looks up and fills the extraction cache
+    text = document.extract_text(cached=False)
+    return document.file_type, _handoff(text), document.extract_error
+
+
+def _render(text):
+    return _handoff(_markdown(text))
+
+
+def _compact(text, markdown, dedupe):
+    from .compaction import compact_text
+    if isinstance(text, _TextFile):
+        # The server process removes the file once the task is over
+        text = read_text(text.path)
+    text, before, after = compact_text(text, markdown, dedupe)
+    return _handoff(text), before, after
+
+
+def _markdown(text):
+    import markdown
+    return markdown.markdown(text)
+
+
+class WorkerPool:
+    """
+    Pre-warmed pool of worker processes for CPU-bound steps, so they run on
+    every core instead of the event loop thread. Each task has a timeout,
+    counted once a worker is free to take it; a task that runs over it has
+    its workers killed and the pool restarted.
+    Large text comes back through a temp file rather than being pickled.
+    With workers=0 the work runs in threads like before.
+    """
+    def __init__(self, workers=EXTRACT_WORKERS, timeout=EXTRACT_TIMEOUT):
+        self.workers = workers
+        self.timeout = timeout
+        self._executor = None
+        self._slots_loop = None
+        self._slot_semaphore = None
+
+    def start(self):
+        """Start the worker processes and have each one import the extraction code."""
+        if self.workers <= 0 or self._executor is not None:
+            return
+        # Spawned workers don't inherit the server's threads, sockets or SQLite connections
+        self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        for _ in range(self.workers):
+            self._executor.submit(_warm)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _restart(self, executor):
+        """Kill the workers of executor (a timed out task can't be cancelled otherwise) and start fresh ones."""
+        if executor is not self._executor:
+            return  # Another task already replaced it
+        self._executor = None
+        # ProcessPoolExecutor has no public way to stop a running task before Python 3.14
+        for process in list((getattr(executor, "_processes", None) or {}).values()):
+            process.terminate()
+        executor.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def _slots(self):
+        """Semaphore with one slot per worker, for the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._slots_loop is not loop:
+            self._slots_loop = loop
+            self._slot_semaphore = asyncio.Semaphore(self.workers)
+        return self._slot_semaphore
+
+    async def run(self, fn, *args):
+        """
+        Run fn(*args) in a worker process (or a thread with workers=0) within
+        the timeout. Tasks wait for a free worker before they are submitted,
+        so the timeout only counts the time the task runs.
+        """
+        if self.workers <= 0:
+            return await asyncio.wait_for(asyncio.to_thread(fn, *args), self.timeout)
+
+        async with self._slots():
+            while True:
+                self.start()
+                executor = self._executor
+                future = asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+                try:
+                    return await asyncio.wait_for(future, self.timeout)
+                except asyncio.TimeoutError:
+                    self._restart(executor)
+                    raise TimeoutError(f"Processing took longer than {self.timeout:g} seconds") from None
+                except BrokenProcessPool:
+                    if executor is not self._executor:
+                        # The pool was restarted because of another task's timeout, try again on the new one
+                        continue
+                    self._restart(executor)
+                    raise RuntimeError("A worker process crashed while processing the document") from None
+
+    async def extract(self, document):
+        """
+        Extract the text of a Document in a worker and store it on the
+        document. Files in the extraction cache aren't sent to a worker.
+        """
+        if self.workers <= 0:
+            return await self.run(document.extract_text)
+        try:
+            # Sniffing the type and hashing the file only read it, the parsing is what goes to a worker
+            await asyncio.to_thread(document.find_extractor)
+            key = await asyncio.to_thread(document.cache_key)
+        except Exception as e:
+            document.extract_error = str(e)
+            document.extracted_text = f"Error extracting text: {str(e)}"
+            return document.extracted_text
+        if document.extractor is None:
+            document.extracted_text = f"Unsupported file type: {document.file_type}"
+            return document.extracted_text
+        if key is not None and document.load_cached(key):
+            return document.extracted_text
+
+        if document.file_type == 'application/pdf':
+            await self._extract_pdf(document)
+        else:
+            file_type, text, document.extract_error = await self.run(
+                _extract, document.file_path, document.file_name, document.file_type)
+            document.file_type = file_type
+            document.extracted_text = _receive(text)
+        if key is not None:
+            document.store_cached(key)
+        return document.extracted_text
+
+    async def _extract_pdf(self, document):
+        """
+        Extract the requested pages of a PDF in parallel: first the text of
+        every page, PDF_PAGES_PER_TASK pages per task, then images of the
+        scanned pages that will be sent, spread over the workers. Errors end
+        up in the text, as with Document.extract_text.
+        """
+        path = document.file_path
+        try:
+            pages = select_pages(document.pages, await self.run(page_count, path))
+            batches = [pages[i:i + PDF_PAGES_PER_TASK] for i in range(0, len(pages), PDF_PAGES_PER_TASK)]
+            results = await asyncio.gather(*(self.run(extract_pages, path, batch, 0) for batch in batches))
+            results = [page for batch in results for page in batch]
+
+            scanned = [number - 1 for number, _, is_scanned, _ in results if is_scanned][:PDF_MAX_PAGE_IMAGES]
+            rendered = await asyncio.gather(*(
+                self.run(render_pages, path, scanned[i::self.workers]) for i in range(min(self.workers, len(scanned)))
+            ))
+        except Exception as e:
+            document.extract_error = str(e)
+            document.extracted_text = f"Error extracting text: {str(e)}"
+            return document.extracted_text
+
+        images = dict(image for batch in rendered for image in batch)
+        document.extracted_text, document.page_images = join_pages(
+            (number, text, is_scanned, images.get(number)) for number, text, is_scanned, _ in results
+        )
+        return document.extracted_text
+
+    async def compact(self, text, markdown=False, dedupe=True):
+        """Compact prompt text in a worker, returns (text, estimated tokens before, after)."""
+        if self.workers <= 0:
+            from .compaction import compact_text
+            return await self.run(compact_text, text, markdown, dedupe)
+        # Large text goes to the worker through a temp file too
+        sent = await asyncio.to_thread(_handoff, text)
+        try:
+            text, before, after = await self.run(_compact, sent, markdown, dedupe)
+        finally:
+            if isinstance(sent, _TextFile):
+                os.remove(sent.path)
+        return _receive(text), before, after
+
+    async def render(self, text):
+        """Render markdown to HTML, in a worker unless the text is short."""
+        if self.workers <= 0 or len(text) < RENDER_INLINE_SIZE:
+            return _markdown(text)
+        return _receive(await self.run(_render, text))
@@ -1,60 +1,453 @@
-import os 
-import google.generativeai as genai 
+import os
+import time
+import asyncio
+import hashlib
+import threading
 from dotenv import load_dotenv
+from .cache import ResultCache
+from .chunking import split_into_chunks
+from .image_prep import prepare_image
+from .metrics import span, record_stage, record_usage, COMPACTION_SAVED_TOKENS
+from .compaction import compact_text, PROMPT_COMPACTION
+from .gemini_client import GeminiClient, ContextCaches, CONTEXT_CACHE_MIN_TOKENS
 
 load_dotenv()
 
+MODEL_NAME = 'gemini-2.0-flash'
+
 class Processor:
-    def __init__(self):
+    def __init__(self, max_concurrency=None, cache=None, pool=None):
         api_key = os.getenv("GEMINI_API_KEY")
-        
+
         if not api_key:
             raise ValueError("GEMINI_API_KEY environment variable not set")
-        
-        # Configure the GEMINI API with our key
-        genai.configure(api_key=api_key)
-        
-        # Initializing the gemini model
-        self.model = genai.GenerativeModel('gemini-2.0-flash')
-        
-    # In models/processor.py
-    def process_document(self, document, instructions):
-        """Process a document according to the given instructions."""
-        if not document.extracted_text:
-            document.extract_text()
-        
-        # For images, use Gemini Pro Vision
-        if document.file_type.startswith('image/'):
-            try:
-                # Initialize the vision model
-                vision_model = genai.GenerativeModel('gemini-2.0-flash')
-                
-                # Create image part
-                image_parts = [{"mime_type": document.file_type, "data": open(document.file_path, "rb").read()}]
-                
-                # Create prompt
-                prompt = f"Instructions: {instructions}\n\nAnalyze this image and respond according to the instructions."
-                
-                # Generate content with image
-                response = vision_model.generate_content([prompt, *image_parts])
-                return response.text
-                
-            except Exception as e:
-                return f"Error processing image: {str(e)}"
-        
-        # For text-based documents
-        prompt = f"""
+
+        # The Gemini client is slow to import, it is created on first use (see model)
+        self._api_key = api_key
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        # Rate limits, deadlines, retries and the circuit breaker around the model
+        self.client = GeminiClient(lambda: self.model)
+        # Documents kept for follow-up questions are stored in Gemini context caches
+        self.context_caches = ContextCaches(api_key)
+
+        # Limit how many LLM calls can be in flight at once (async path only)
+        if max_concurrency is None:
+            max_concurrency = int(os.getenv("GEMINI_MAX_CONCURRENCY", "16"))
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+        # Results of previous identical requests
+        self.cache = cache if cache is not None else ResultCache()
+
+        # Optional WorkerPool for CPU-bound image preprocessing (threads otherwise)
+        self.pool = pool
+
+        # Map-reduce settings for documents larger than the threshold (in tokens)
+        self.map_reduce_threshold = int(os.getenv("MAP_REDUCE_THRESHOLD", "100000"))
+        self.chunk_tokens = int(os.getenv("MAP_REDUCE_CHUNK_TOKENS", "30000"))
+        self.overlap_tokens = int(os.getenv("MAP_REDUCE_OVERLAP_TOKENS", "500"))
+        self.map_concurrency = int(os.getenv("MAP_REDUCE_CONCURRENCY", "4"))
+
+    @property
+    def model(self):
+        """The Gemini model, configured and created the first time it is needed."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    import google.generativeai as genai
+
+                    # Configure the GEMINI API with our key
+                    genai.configure(api_key=self._api_key)
+                    self._model = genai.GenerativeModel(MODEL_NAME)
+        return self._model
+
+    @model.setter
+    def model(self, model):
+        # Take the lock so a first load already in progress can't overwrite this model
+        with self._model_lock:
+            self._model = model
+
+    def _build_prompt(self, document, instructions):
+        """Build the text prompt for a text-based document."""
+        return f"""
         Instructions from user: {instructions}
-        
+
         Document content (from {document.file_name}, type: {document.file_type}):
-        
+
         {document.extracted_text}
-        
+
         Process the above document content according to the user's instructions.
         Format your response in markdown.
         """
-        
-        response = self.model.generate_content(prompt)
-        return response.text
 
+    def _build_image_request(self, document, instructions, image=None):
+        """
+        Build the prompt and image parts for an image document, downscaled and stripped of metadata.
+        image is an already prepared (mime_type, data) pair, if there is one.
+        """
+        mime_type, data = image or prepare_image(document.file_path, document.file_type)
+        image_parts = [{"mime_type": mime_type, "data": data}]
+
+        prompt = f"Instructions: {instructions}\n\nAnalyze this image and respond according to the instructions."
+        return [prompt, *image_parts]
+
+    def _with_page_images(self, document, contents):
+        """Add the images of a PDF's scanned pages, each after a line naming its page, to the contents of a request."""
+        if not document.page_images:
+            return contents
+        parts = contents if isinstance(contents, list) else [contents]
+        for number, mime_type, data in document.page_images:
+            parts = [*parts, f"Image of page {number}:", {"mime_type": mime_type, "data": data}]
+        return parts
+
+    def _build_document_context(self, document):
+        """
+        The document part of a follow-up question. It is the same for every
+        question and comes first, so it can be cached.
+        """
+        return f"""
+        The user uploaded {document.file_name} (type: {document.file_type}) and will ask about it.
+
+        Document content:
+
+        {document.extracted_text}
+        """
+
+    def _build_question_prompt(self, instructions):
+        """The question part of a follow-up question, sent after the document context."""
+        return f"""
+        Instructions from user: {instructions}
+
+        Process the document above according to the user's instructions.
+        Format your response in markdown.
+        """
+
+    def _build_map_prompt(self, document, instructions, chunk, index, total):
+        """Build the prompt for one chunk of a large document."""
+        return f"""
+        Instructions from user: {instructions}
+
+        The document {document.file_name} (type: {document.file_type}) is too large to process at once.
+        Below is part {index} of {total}. Parts overlap slightly at the edges.
+
+        {chunk}
+
+        Apply the user's instructions to this part only. Your answer will be combined
+        with the answers for the other parts, so keep every relevant detail and do not
+        mention that you only saw part of the document.
+        """
+
+    def _build_reduce_prompt(self, document, instructions, partials):
+        """Build the prompt that combines the answers for each chunk into one."""
+        parts = "\n\n".join(f"--- Part {i} ---\n{partial}" for i, partial in enumerate(partials, 1))
+        return f"""
+        Instructions from user: {instructions}
+
+        The document {document.file_name} (type: {document.file_type}) was processed in parts.
+        Here are the answers for each part, in document order:
+
+        {parts}
+
+        Combine these into a single response that follows the user's instructions for the
+        whole document. Remove duplication from the overlapping parts.
+        Format your response in markdown.
+        """
+
+    async def _aplan_chunks(self, document):
+        """
+        Return the chunks to map-reduce over, or None if the document fits in one call.
+        Token counts come from the model's count_tokens and are turned into a
+        character budget for splitting.
+        """
+        text = document.extracted_text
+        # A token is at least one character, so short texts can skip the count
+        if len(text) <= self.map_reduce_threshold:
+            return None
+
+        total_tokens = (await self.client.count_tokens(text)).total_tokens
+        if total_tokens <= self.map_reduce_threshold:
+            return None
+
+        chars_per_token = len(text) / max(total_tokens, 1)
+        return split_into_chunks(
+            text,
+            max_chars=int(self.chunk_tokens * chars_per_token),
+            overlap_chars=int(self.overlap_tokens * chars_per_token),
+        )
+
+    async def _amap_reduce(self, document, instructions, chunks):
+        """
+        Process chunks in parallel and reduce the answers until they fit in one prompt.
+        Returns the contents for the final reduce call.
+        """
+        limit = asyncio.Semaphore(self.map_concurrency)
+        # The chunks were sized to the token budget, so use the largest as the budget for answers too
+        max_chars = max(len(chunk) for chunk in chunks)
+
+        async def generate(prompt):
+            async with limit, self._semaphore:
+                with span("gemini_map_reduce"):
+                    response = await self.client.generate(prompt)
+                record_usage(response)
+                return response.text
+
+        partials = await asyncio.gather(*(
+            generate(self._build_map_prompt(document, instructions, chunk, i, len(chunks)))
+            for i, chunk in enumerate(chunks, 1)
+        ))
+
+        # Reduce in groups until the answers fit in a single prompt
+        while len(partials) > 1 and sum(len(p) for p in partials) > max_chars:
+            groups, group, size = [], [], 0
+            for partial in partials:
+                if group and size + len(partial) > max_chars:
+                    groups.append(group)
+                    group, size = [], 0
+                group.append(partial)
+                size += len(partial)
+            groups.append(group)
+            if len(groups) == len(partials):
+                break
+            partials = await asyncio.gather(*(
+                generate(self._build_reduce_prompt(document, instructions, group)) for group in groups
+            ))
+
+        return self._build_reduce_prompt(document, instructions, partials)
+
+    async def _abuild_request(self, document, instructions):
+        """
+        Return the contents to send for a document.
+        Documents above the map-reduce threshold are processed chunk by chunk
+        first, and the contents become the final reduce prompt.
+        """
+        if document.file_type.startswith('image/'):
+            # The model is multimodal, preprocess the image off the event loop
+            run = self.pool.run if self.pool is not None else asyncio.to_thread
+            image = await run(prepare_image, document.file_path, document.file_type)
+            return self._build_image_request(document, instructions, image)
+
+        chunks = await self._aplan_chunks(document)
+        if chunks:
+            # Scanned pages only join in the final step, the parts are mapped from their text
+            return self._with_page_images(document, await self._amap_reduce(document, instructions, chunks))
+        return self._with_page_images(document, self._build_prompt(document, instructions))
+
+    async def _abuild_followup_request(self, document, instructions, context_cache=None):
+        """
+        Return the contents for a question about a kept document. With a
+        context cache only the question is sent. Otherwise the document
+        context goes first, so Gemini can reuse it between questions.
+        """
+        if context_cache:
+            return self._build_question_prompt(instructions)
+        if document.file_type.startswith('image/') or len(document.extracted_text) > self.map_reduce_threshold:
+            return await self._abuild_request(document, instructions)
+        contents = self._build_document_context(document) + self._build_question_prompt(instructions)
+        return self._with_page_images(document, contents)
+
+    async def acreate_context_cache(self, document, ttl):
+        """
+        Store a kept document's context in a Gemini context cache for ttl seconds.
+        Returns the cache name, or "" for documents that aren't worth caching:
+        images, PDFs with scanned pages, documents too small to cache and
+        documents that are map-reduced.
+        """
+        if document.file_type.startswith('image/') or document.page_images:
+            return ""
+        # Cache the document as it will be prompted
+        await self._acompact(document)
+        # Estimate at 4 characters per token, counting tokens costs a call of its own
+        tokens = len(document.extracted_text) // 4
+        if not CONTEXT_CACHE_MIN_TOKENS <= tokens <= self.map_reduce_threshold:
+            return ""
+        try:
+            with span("context_cache"):
+                return await asyncio.to_thread(self.context_caches.create, self._build_document_context(document), ttl)
+        except Exception as e:
+            print(f"Could not create a context cache for {document.file_name}: {e}")
+            return ""
+
+    def _compaction_options(self, document):
+        """(markdown, dedupe) for a document, or None if its text isn't compacted."""
+        if not PROMPT_COMPACTION or document.compacted or document.file_type.startswith('image/'):
+            return None
+        markdown = document.file_type == 'text/markdown' or document.file_name.endswith(('.md', '.markdown'))
+        # Repeated lines in JSON and plain text (code, logs, CSV) are content, not boilerplate
+        dedupe = markdown or document.file_type not in ('application/json', 'text/plain')
+        return markdown, dedupe
+
+    def _compacted(self, document, text, before, after):
+        document.extracted_text = text
+        document.compacted = True
+        COMPACTION_SAVED_TOKENS.observe(before - after)
+        if after < before:
+            print(f"Compacted {document.file_name}: {before} -> {after} tokens ({before - after} saved)")
+
+    def _compact(self, document):
+        """Compact the document's extracted text for prompts, in place (see models/compaction.py)."""
+        options = self._compaction_options(document)
+        if options is not None:
+            self._compacted(document, *compact_text(document.extracted_text, *options))
+
+    async def _acompact(self, document):
+        """Async version of _compact, in the worker pool if there is one."""
+        options = self._compaction_options(document)
+        if options is None:
+            return
+        with span("compact"):
+            if self.pool is not None:
+                result = await self.pool.compact(document.extracted_text, *options)
+            else:
+                result = await asyncio.to_thread(compact_text, document.extracted_text, *options)
+        self._compacted(document, *result)
+
+    def _cache_key(self, document, instructions):
+        """Cache key for a document: image bytes or extracted text (and scanned pages), instructions and model."""
+        if document.file_type.startswith('image/'):
+            content_hash = document.content_hash
+            if content_hash is None:
+                with open(document.file_path, "rb") as f:
+                    content_hash = hashlib.sha256(f.read()).hexdigest()
+        else:
+            digest = hashlib.sha256(document.extracted_text.encode("utf-8"))
+            # Scanned pages are only placeholders in the text
+            for _, _, data in document.page_images:
+                digest.update(data)
+            content_hash = digest.hexdigest()
+        return ResultCache.make_key(content_hash, instructions, MODEL_NAME)
+
+    async def _cached(self, document, instructions, compute, coalesce=True):
+        """
+        The one place processing meets the result cache. Sets
+        document.result_key and yields the result: the cached one, that of
+        an identical call already in flight (unless coalesce is off) or the
+        chunks of compute(), an async iterator making the Gemini call, as
+        they arrive; they are cached once complete. Errors are raised, for
+        images with an "Error processing image" prefix.
+        """
+        key = document.result_key = self._cache_key(document, instructions)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        if coalesce:
+            inflight = self.cache.join(key)
+            if inflight is not None:
+                yield await asyncio.shield(inflight)
+                return
+            self.cache.start(key)
+
+        chunks = []
+        try:
+            async for chunk in compute():
+                chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            error = ValueError(f"Error processing image: {e}") if document.file_type.startswith('image/') else e
+            if coalesce:
+                self.cache.finish(key, error=error)
+            if error is e:
+                raise
+            raise error from e
+        except BaseException:
+            if coalesce:
+                self.cache.finish(key, error=RuntimeError("Processing was cancelled"))
+            raise
+        if coalesce:
+            self.cache.finish(key, "".join(chunks))
+        else:
+            self.cache.put(key, "".join(chunks))
+
+    # In models/processor.py
+    def process_document(self, document, instructions):
+        """Process a document according to the given instructions, blocking until the response is complete."""
+        if document.extracted_text is None:
+            document.extract_text()
+        self._compact(document)
+
+        async def compute():
+            # For images, send the preprocessed image to the same multimodal model
+            if document.file_type.startswith('image/'):
+                contents = self._build_image_request(document, instructions)
+            else:
+                contents = self._with_page_images(document, self._build_prompt(document, instructions))
+            yield self.client.generate_blocking(contents).text
+
+        async def result():
+            return "".join([chunk async for chunk in self._cached(document, instructions, compute, coalesce=False)])
+
+        # Calls in flight belong to the server's event loop, a blocking caller only reads and fills the cache
+        return asyncio.run(result())
+
+    async def _agenerate(self, document, instructions):
+        """Make a single async LLM call for a document, within the concurrency limit."""
+        with span("prompt_build"):
+            contents = await self._abuild_request(document, instructions)
+        async with self._semaphore:
+            with span("gemini"):
+                response = await self.client.generate(contents)
+            record_usage(response)
+            return response.text
+
+    async def aprocess_document(self, document, instructions):
+        """
+        Async version of process_document.
+        Uses the SDK's async generation path so the event loop stays free while
+        Gemini is working, and never runs more than max_concurrency calls at once.
+        Identical requests are served from the cache or share one in-flight call.
+        """
+        if document.extracted_text is None:
+            await asyncio.to_thread(document.extract_text)
+        await self._acompact(document)
+
+        async def compute():
+            yield await self._agenerate(document, instructions)
+
+        return "".join([chunk async for chunk in self._cached(document, instructions, compute)])
+
+    async def astream_document(self, document, instructions, follow_up=False, context_cache=None):
+        """
+        Stream the response for a document as it is generated.
+        Yields text chunks from Gemini's stream=True generation, holding a
+        concurrency slot until the whole response has been read. Cached and
+        coalesced results are yielded as a single chunk.
+        For a document kept for follow-up questions set follow_up, and pass
+        the name of its Gemini context cache if it has one.
+        """
+        if document.extracted_text is None:
+            await asyncio.to_thread(document.extract_text)
+        await self._acompact(document)
+
+        async def compute():
+            model, cache_name = None, context_cache
+            if cache_name:
+                try:
+                    model = await asyncio.to_thread(self.context_caches.model, cache_name)
+                except Exception as e:
+                    print(f"Context cache {cache_name} is unavailable, sending the document again: {e}")
+                    cache_name = None
+            with span("prompt_build"):
+                if follow_up:
+                    contents = await self._abuild_followup_request(document, instructions, cache_name)
+                else:
+                    contents = await self._abuild_request(document, instructions)
+            async with self._semaphore:
+                start = time.perf_counter()
+                chunk = None
+                first = True
+                with span("gemini"):
+                    async for chunk in self.client.stream(contents, model=model):
+                        # Some chunks (e.g. the final one) carry no text parts
+                        if chunk.parts:
+                            if first:
+                                record_stage("gemini_first_token", time.perf_counter() - start)
+                                first = False
+                            yield chunk.text
+                # Token counts arrive with the last chunk
+                record_usage(chunk)
 
+        async for chunk in self._cached(document, instructions, compute):
+            yield chunk
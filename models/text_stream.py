@@ -0,0 +1,94 @@
+import io
+import os
+import mmap
+import codecs
+
+# Encoding of text files that aren't UTF-8 (or UTF-16/32 with a byte order mark)
+TEXT_FALLBACK_ENCODING = os.getenv("TEXT_FALLBACK_ENCODING", "cp1252")
+
+# Bytes looked at to detect the encoding, and bytes decoded at a time
+ENCODING_SAMPLE_SIZE = 64 * 1024
+TEXT_CHUNK_SIZE = 256 * 1024
+
+# Checked in this order: the UTF-32 LE mark starts with the UTF-16 LE one
+BOMS = (
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def detect_encoding(sample):
+    """
+    Guess the encoding of a text file from the first bytes of it: a byte
+    order mark, UTF-16 without one (every other byte NUL), UTF-8 if the
+    sample decodes as UTF-8, TEXT_FALLBACK_ENCODING otherwise.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+
+    # Mostly-ASCII UTF-16 has a NUL in every other byte
+    pairs = len(sample) // 2
+    if pairs and sample.count(0) > pairs // 2:
+        if sample[1::2].count(0) > pairs * 0.4:
+            return "utf-16-le"
+        if sample[0::2].count(0) > pairs * 0.4:
+            return "utf-16-be"
+
+    try:
+        # Not final: the sample may end in the middle of a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return TEXT_FALLBACK_ENCODING
+
+
+def iter_text(path, chunk_size=TEXT_CHUNK_SIZE):
+    """
+    Decode a text file in chunks of about chunk_size bytes and yield the text
+    with its line endings turned into "\\n". The file is memory-mapped and
+    the pages already decoded are given back as it goes, so memory stays
+    flat however large the file is. Bytes that aren't valid in the detected
+    encoding become U+FFFD instead of failing the whole file.
+    """
+    # madvise needs page-aligned offsets
+    chunk_size = max(mmap.PAGESIZE, chunk_size - chunk_size % mmap.PAGESIZE)
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding = detect_encoding(mm[:ENCODING_SAMPLE_SIZE])
+            decoder = io.IncrementalNewlineDecoder(
+                codecs.getincrementaldecoder(encoding)(errors="replace"), translate=True
+            )
+            for start in range(0, size, chunk_size):
+                end = min(start + chunk_size, size)
+                text = decoder.decode(mm[start:end], final=end == size)
+                if hasattr(mm, "madvise"):
+                    mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+                if text:
+                    yield text
+
+
+def read_text(path):
+    """
+    The whole text of a file, decoded like iter_text. The result is grown in
+    place chunk by chunk (CPython resizes a string nothing else refers to),
+    so peak memory is about the size of the text rather than a multiple of
+    it. The string is copied only when a chunk needs a wider character size
+    than the text so far (ASCII, Latin-1, UCS-2, UCS-4).
+    """
+    text = ""
+    for chunk in iter_text(path):
+        text += chunk
+    return text
+
+
+def write_text(file, text, chunk_size=TEXT_CHUNK_SIZE):
+    """Write text to an open text file a slice at a time, so it is never encoded in one piece."""
+    for start in range(0, len(text), chunk_size):
+        file.write(text[start:start + chunk_size])
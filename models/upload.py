@@ -0,0 +1,87 @@
+import os
+import hashlib
+
+from starlette.exceptions import HTTPException
+
+# Default size limit and chunk size for uploads
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+CHUNK_SIZE = 64 * 1024  # 64KB
+# Room on top of the file limits for the other form fields and the multipart framing
+FORM_OVERHEAD = 1024 * 1024  # 1MB
+
+
+class FileTooLargeError(ValueError):
+    """Raised when an upload goes over the size limit."""
+    def __init__(self, max_size):
+        self.max_size = max_size
+        super().__init__(f"File too large. Please upload files smaller than {max_size // (1024 * 1024)}MB.")
+
+
+class UploadLimit:
+    """
+    ASGI middleware capping the request body of upload routes. `limits` maps
+    a path to the most file bytes it takes, the body may be FORM_OVERHEAD
+    bigger. A body that says it is too big is turned away before any of it
+    is read, and the bytes are counted as they arrive so uploads without a
+    Content-Length (chunked) are cut off at the limit too. Both raise a 413
+    HTTPException from whatever reads the body, before it is parsed or
+    spooled to disk.
+    """
+    def __init__(self, app, limits):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_size = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_size is None:
+            return await self.app(scope, receive, send)
+
+        max_body = max_size + FORM_OVERHEAD
+        headers = dict(scope["headers"])
+        announced = int(headers.get(b"content-length") or 0)
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            if announced > max_body:
+                raise HTTPException(413, str(FileTooLargeError(max_size)))
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    raise HTTPException(413, str(FileTooLargeError(max_size)))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+async def save_upload(uploaded_file, file_path, max_size=MAX_UPLOAD_SIZE, chunk_size=CHUNK_SIZE):
+    """
+    Copy an uploaded file to disk in fixed-size chunks.
+    The size limit is checked as bytes arrive, so oversize files are aborted
+    early and never held in memory. Returns (size, sha256 hex digest).
+    """
+    # Starlette already knows the size of the spooled upload, fail fast if we can
+    if getattr(uploaded_file, "size", None) is not None and uploaded_file.size > max_size:
+        raise FileTooLargeError(max_size)
+
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                chunk = await uploaded_file.read(chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    raise FileTooLargeError(max_size)
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        # Don't leave a partial file behind
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+
+    return size, digest.hexdigest()
@@ -0,0 +1,56 @@
+from models.compaction import compact_text
+
+PYTHON = """def first(items):
+    for item in items:
+        if item:
+            return item
+        return None
+
+def last(items):
+    if not items:
+        return None
+    return items[-1]
+
+def middle(items):
+    if len(items) < 3:
+        return None
+    return items[len(items) // 2]
+"""
+
+
+def test_plain_text_keeps_repeated_code_lines():
+    text, _, _ = compact_text(PYTHON, dedupe=False)
+    assert text.count("return None") == 3
+
+
+def test_repeated_code_lines_are_kept_even_with_dedupe():
+    text, _, _ = compact_text(PYTHON)
+    assert text.count("return None") == 3
+
+
+def test_repeated_log_lines_are_kept():
+    log = "INFO: starting\n" + "ERROR: connection refused\n" * 5 + "INFO: retrying\n"
+    for dedupe in (False, True):
+        text, _, _ = compact_text(log, dedupe=dedupe)
+        assert text.count("ERROR: connection refused") == 5
+
+
+def test_duplicate_csv_rows_are_kept():
+    csv = "name,score\nann,10\nbob,7\nann,10\nann,10\ncid,3\n"
+    for dedupe in (False, True):
+        text, _, _ = compact_text(csv, dedupe=dedupe)
+        assert text.count("ann,10") == 3
+
+
+def test_running_headers_and_footers_are_kept_once():
+    pages = []
+    for number in range(1, 6):
+        pages.append(f"[Page {number}]\nACME Corporation - Internal\nBody of page {number}.\n"
+                     f"Same sentence on every page.\nConfidential, do not distribute.")
+    text, before, after = compact_text("\n\n".join(pages))
+    assert text.count("ACME Corporation - Internal") == 1
+    assert text.count("Confidential, do not distribute.") == 1
+    # Lines inside a page are content, even when they repeat
+    assert text.count("Same sentence on every page.") == 5
+    assert all(f"Body of page {number}." in text for number in range(1, 6))
+    assert after < before
@@ -0,0 +1,123 @@
+import time
+import asyncio
+
+import pytest
+
+from benchmarks.fake_gemini import FakeModel, FakeServerError
+from models.gemini_client import GeminiClient, CircuitBreaker, CircuitOpenError
+
+PROMPT = "Summarize this document."
+
+
+class FlakyModel(FakeModel):
+    """A FakeModel whose first `failures` calls fail."""
+    def __init__(self, failures, **kwargs):
+        super().__init__(latency=0, **kwargs)
+        self.failures = failures
+
+    def _should_fail(self):
+        self.calls += 1
+        return self.calls <= self.failures
+
+
+class SlowFirstModel(FakeModel):
+    """A FakeModel whose first call takes `first_latency` seconds, recording when each call started."""
+    def __init__(self, first_latency, **kwargs):
+        super().__init__(**kwargs)
+        self.first_latency = first_latency
+        self.started = []
+
+    def _latency(self, contents=()):
+        self.started.append(time.monotonic())
+        return self.first_latency if len(self.started) == 1 else self.latency
+
+
+def client(model, **kwargs):
+    settings = dict(rpm=0, tpm=0, timeout=5, retries=3, backoff=0, hedge_after=0,
+                    breaker=CircuitBreaker(threshold=0))
+    settings.update(kwargs)
+    return GeminiClient(lambda: model, **settings)
+
+
+@pytest.mark.parametrize("code", [429, 503])
+def test_transient_errors_are_retried_up_to_the_limit(monkeypatch, code):
+    monkeypatch.setattr(FakeServerError, "code", code)
+    model = FakeModel(latency=0, error_rate=1.0)
+    with pytest.raises(FakeServerError):
+        asyncio.run(client(model, retries=2).generate(PROMPT))
+    assert model.calls == 3
+
+
+def test_call_succeeds_after_transient_errors():
+    model = FlakyModel(failures=2)
+    response = asyncio.run(client(model, retries=2).generate(PROMPT))
+    assert response.text.startswith("# Result")
+    assert model.calls == 3
+
+
+def test_rejected_requests_are_not_retried(monkeypatch):
+    monkeypatch.setattr(FakeServerError, "code", 400)
+    model = FakeModel(latency=0, error_rate=1.0)
+    with pytest.raises(FakeServerError):
+        asyncio.run(client(model).generate(PROMPT))
+    assert model.calls == 1
+
+
+def test_deadline_raises_timeout_error():
+    model = FakeModel(latency=5)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        asyncio.run(client(model, timeout=0.1, retries=0).generate(PROMPT))
+    assert time.monotonic() - start < 1
+
+
+def test_stream_deadline_raises_timeout_error():
+    async def read():
+        return [chunk async for chunk in client(FakeModel(latency=5), timeout=0.1, retries=0).stream(PROMPT)]
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(read())
+
+
+def test_breaker_opens_after_threshold_failures_then_half_opens():
+    model = FakeModel(latency=0, error_rate=1.0)
+    breaker = CircuitBreaker(threshold=3, cooldown=0.2)
+    gemini = client(model, retries=0, breaker=breaker)
+
+    for _ in range(3):
+        with pytest.raises(FakeServerError):
+            asyncio.run(gemini.generate(PROMPT))
+    assert breaker.state == "open"
+    # Refused without calling the backend
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(gemini.generate(PROMPT))
+    assert model.calls == 3
+
+    time.sleep(0.25)
+    assert breaker.state == "half-open"
+    # A failed trial call opens it again
+    with pytest.raises(FakeServerError):
+        asyncio.run(gemini.generate(PROMPT))
+    assert breaker.state == "open"
+
+    time.sleep(0.25)
+    model.error_rate = 0
+    asyncio.run(gemini.generate(PROMPT))
+    assert breaker.state == "closed"
+    assert model.calls == 5
+
+
+def test_hedge_fires_only_after_the_delay():
+    model = SlowFirstModel(first_latency=2, latency=0.05)
+    start = time.monotonic()
+    asyncio.run(client(model, hedge_after=0.3).generate(PROMPT))
+    assert len(model.started) == 2
+    assert model.started[1] - model.started[0] >= 0.3
+    # The hedged copy answered, the slow call was given up
+    assert time.monotonic() - start < 1
+
+
+def test_no_hedge_when_the_call_is_fast():
+    model = SlowFirstModel(first_latency=0.05, latency=0.05)
+    asyncio.run(client(model, hedge_after=0.3).generate(PROMPT))
+    assert len(model.started) == 1